@@ -0,0 +1,157 @@
+"""
+Diagnosis analytics served from daily rollups instead of diagnosis_log.
+
+Every confirmation adds to two rollup tables in the transaction that writes the
+log rows: diagnosis_code_daily counts (day, NAMASTE code, ICD-11 code) and
+diagnosis_doctor_daily counts (day, doctor, NAMASTE code). A query reads at most
+one row per day and key in its window, so its cost is bounded by the window and
+the number of distinct codes, not by how large the log has grown.
+
+Days are UTC dates of diagnosis_log.timestamp, always computed by the database
+from its own clock, so the incremental counts and rebuild() agree on which day
+a confirmation belongs to. rebuild() recomputes both tables from the raw log,
+e.g. after a backfill or to repair drift.
+"""
+import datetime
+from collections import Counter
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from sqlalchemy import delete, func, select, text
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+
+from . import models
+
+ANALYTICS_DEFAULT_DAYS = 30
+
+
+def utc_today() -> datetime.date:
+    return datetime.datetime.now(datetime.timezone.utc).date()
+
+
+def _dialect_insert(dialect_name: str):
+    if dialect_name == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert
+    else:
+        from sqlalchemy.dialects.sqlite import insert
+    return insert
+
+
+def _utc_day(dialect_name: str, timestamp):
+    """The UTC date of a timestamp, computed by the database."""
+    if dialect_name == "postgresql":
+        return func.date(func.timezone("UTC", timestamp))
+    return func.date(timestamp)
+
+
+def _increment(dialect_name: str, table, keys: Tuple[str, ...], counts: Counter):
+    """An upsert adding each key's count to today's rollup row, today by the database clock."""
+    # now() is the transaction start on PostgreSQL, the very value the log rows get as their
+    # timestamp. SQLite reads its clock per statement, a skew of at most the time between them.
+    day = _utc_day(dialect_name, func.now())
+    rows = [dict(zip(keys, key), day=day, count=count) for key, count in sorted(counts.items())]
+    statement = _dialect_insert(dialect_name)(table).values(rows)
+    return statement.on_conflict_do_update(
+        index_elements=[table.c.day] + [table.c[key] for key in keys], set_={"count": table.c["count"] + statement.excluded["count"]}
+    )
+
+
+# --- Incremental maintenance ---
+
+async def record_confirmed(db: AsyncSession, doctor_id: str, codes: Iterable[Tuple[str, Optional[str]]]):
+    """
+    Adds confirmed (NAMASTE code, ICD-11 code) pairs of one doctor to today's
+    rollups. Runs in the caller's transaction, so the counts commit or roll back
+    with the log rows.
+    """
+    by_code, by_doctor = Counter(), Counter()
+    for namaste_code, icd_code in codes:
+        by_code[(namaste_code, icd_code or "")] += 1
+        by_doctor[(doctor_id, namaste_code)] += 1
+    if not by_code:
+        return
+    dialect_name = db.bind.dialect.name
+    await db.execute(_increment(dialect_name, models.DiagnosisCodeDaily.__table__, ("namaste_code", "icd_code"), by_code))
+    await db.execute(_increment(dialect_name, models.DiagnosisDoctorDaily.__table__, ("doctor_id", "namaste_code"), by_doctor))
+
+
+# --- Rebuild ---
+
+def rebuild(db: Session) -> Dict[str, int]:
+    """Recomputes both rollup tables from diagnosis_log in one transaction and commits."""
+    conn = db.connection()
+    dialect_name = conn.dialect.name
+    if dialect_name == "postgresql":
+        # Confirmations wait until the rebuild commits, so none is counted twice or lost.
+        conn.execute(text("LOCK TABLE diagnosis_code_daily, diagnosis_doctor_daily IN EXCLUSIVE MODE"))
+    log = models.DiagnosisRecord
+    code_table, doctor_table = models.DiagnosisCodeDaily.__table__, models.DiagnosisDoctorDaily.__table__
+    day = _utc_day(dialect_name, log.timestamp)
+    icd_code = func.coalesce(log.icd_code, "")
+
+    conn.execute(delete(code_table))
+    conn.execute(delete(doctor_table))
+    conn.execute(code_table.insert().from_select(
+        ["day", "namaste_code", "icd_code", "count"],
+        select(day, log.namaste_code, icd_code, func.count()).group_by(day, log.namaste_code, icd_code)
+    ))
+    conn.execute(doctor_table.insert().from_select(
+        ["day", "doctor_id", "namaste_code", "count"],
+        select(day, log.doctor_id, log.namaste_code, func.count()).group_by(day, log.doctor_id, log.namaste_code)
+    ))
+    stats = {
+        "diagnoses": conn.scalar(select(func.count()).select_from(log)),
+        "code_rows": conn.scalar(select(func.count()).select_from(code_table)),
+        "doctor_rows": conn.scalar(select(func.count()).select_from(doctor_table)),
+    }
+    db.commit()
+    return stats
+
+
+# --- Queries ---
+
+def window(since: Optional[datetime.date], until: Optional[datetime.date], max_days: int) -> Tuple[datetime.date, datetime.date]:
+    """Resolves an inclusive [since, until] day window, defaulting to the last ANALYTICS_DEFAULT_DAYS days."""
+    until = until or utc_today()
+    since = since or until - datetime.timedelta(days=ANALYTICS_DEFAULT_DAYS - 1)
+    if since > until:
+        raise ValueError("since must not be after until")
+    if (until - since).days + 1 > max_days:
+        raise ValueError(f"The window may span at most {max_days} days")
+    return since, until
+
+
+async def top_codes(db: AsyncSession, since: datetime.date, until: datetime.date, by: str = "namaste", limit: int = 10) -> List[Tuple[str, int]]:
+    table = models.DiagnosisCodeDaily
+    column = table.namaste_code if by == "namaste" else table.icd_code
+    total = func.sum(table.count).label("total")
+    query = (select(column, total).where(table.day.between(since, until))
+             .group_by(column).order_by(total.desc(), column).limit(limit))
+    return [(code, int(count)) for code, count in (await db.execute(query)).all()]
+
+
+async def time_series(db: AsyncSession, since: datetime.date, until: datetime.date, namaste_code: Optional[str] = None,
+                      icd_code: Optional[str] = None) -> List[Tuple[datetime.date, int]]:
+    """Daily counts over the window, every day present (zero when nothing was confirmed)."""
+    table = models.DiagnosisCodeDaily
+    query = select(table.day, func.sum(table.count)).where(table.day.between(since, until))
+    if namaste_code is not None:
+        query = query.where(table.namaste_code == namaste_code)
+    if icd_code is not None:
+        query = query.where(table.icd_code == icd_code)
+    counts = {day: int(count) for day, count in (await db.execute(query.group_by(table.day))).all()}
+    days = (until - since).days + 1
+    return [(day, counts.get(day, 0)) for day in (since + datetime.timedelta(days=n) for n in range(days))]
+
+
+async def doctor_breakdown(db: AsyncSession, since: datetime.date, until: datetime.date, doctor_id: Optional[str] = None,
+                           limit: int = 10) -> List[Tuple[str, int]]:
+    """Diagnoses per doctor, most active first; with doctor_id, that doctor's counts per NAMASTE code."""
+    table = models.DiagnosisDoctorDaily
+    column = table.namaste_code if doctor_id is not None else table.doctor_id
+    total = func.sum(table.count).label("total")
+    query = select(column, total).where(table.day.between(since, until))
+    if doctor_id is not None:
+        query = query.where(table.doctor_id == doctor_id)
+    query = query.group_by(column).order_by(total.desc(), column).limit(limit)
+    return [(key, int(count)) for key, count in (await db.execute(query)).all()]
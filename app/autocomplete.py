@@ -0,0 +1,53 @@
+import bisect
+from array import array
+from typing import Iterable, List, Optional, Tuple
+
+from .search_index import fold, tokenize
+
+Row = Tuple[str, Optional[str], Optional[str], Optional[str]]
+
+
+class PrefixIndex:
+    """
+    Sorted-array prefix index over every written form of a NAMASTE term.
+
+    Each row is indexed under its code, its romanized term, its diacritic-folded
+    IAST term and its Devanagari term, both as a whole and word by word. Keys live
+    in one sorted list with a parallel array of row ids, so a lookup is a binary
+    search followed by a short forward scan; nothing is allocated per entry.
+    """
+
+    def __init__(self, rows: Iterable[Row] = ()):
+        self.rows: List[Row] = sorted(rows, key=lambda r: (len(r[0]), r[0]))
+        entries = set()
+        for row_id, (code, term, term_diacritical, term_devanagari) in enumerate(self.rows):
+            entries.add((code.casefold(), row_id))
+            for form in (term, term_diacritical, term_devanagari):
+                folded = fold(form).strip()
+                if not folded:
+                    continue
+                entries.add((folded, row_id))
+                entries.update((token, row_id) for token in tokenize(form))
+        ordered = sorted(entries)
+        self._keys: List[str] = [key for key, _ in ordered]
+        self._row_ids = array("I", (row_id for _, row_id in ordered))
+
+    def __len__(self) -> int:
+        return len(self.rows)
+
+    def complete(self, prefix: str, limit: int = 10) -> List[Row]:
+        """Returns up to `limit` distinct rows with a form starting with `prefix`, exact forms first."""
+        folded = fold(prefix).strip()
+        if not folded or limit <= 0:
+            return []
+        seen, results = set(), []
+        position = bisect.bisect_left(self._keys, folded)
+        while position < len(self._keys) and len(results) < limit:
+            if not self._keys[position].startswith(folded):
+                break
+            row_id = self._row_ids[position]
+            if row_id not in seen:
+                seen.add(row_id)
+                results.append(self.rows[row_id])
+            position += 1
+        return results
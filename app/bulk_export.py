@@ -0,0 +1,117 @@
+"""
+Bulk NDJSON export of the code system, the concept map and the diagnosis log.
+
+Each export is one Core SELECT read through a server-side cursor
+(yield_per) and serialized batch by batch, so memory stays constant whatever
+the table size and no ORM objects are built. Output can be gzipped on the fly.
+
+With `since`, only rows changed at or after it are exported: rows ingestion
+inserted or changed (updated_at) for the terminology tables, and diagnoses
+recorded since then for the log. Rows deleted from the concept map do not
+appear in an incremental export; a full export reflects them.
+
+The nested-set bounds (lft, rgt) are not part of namaste-codes: one new code
+renumbers most of the tree without changing any other code, so they are not
+tracked by updated_at. namaste-hierarchy exports them, always in full.
+
+On PostgreSQL both columns hold the start of the transaction that wrote the
+row, and a transaction can commit long after it started. The `since` to use
+next is therefore not the time of the export but its watermark(): the start of
+the oldest transaction still open when the export began. Every row committed
+after the export was read carries a time at or after it, so consecutive
+incremental pulls never skip a row; rows near the boundary may be sent twice.
+"""
+import datetime
+import os
+import zlib
+from typing import AsyncIterator, Dict, Optional
+
+from sqlalchemy import Table, func, select, text
+from sqlalchemy.ext.asyncio import AsyncConnection, AsyncEngine
+
+from . import models
+from .fragments import dumps
+
+EXPORT_BATCH_ROWS = int(os.getenv("EXPORT_BATCH_ROWS", "2000"))
+EXPORT_GZIP_LEVEL = int(os.getenv("EXPORT_GZIP_LEVEL", "6"))
+
+
+class Export:
+    """
+    One exportable table: the columns written, the stable order and the column
+    `since` filters on (None when the export is only available in full).
+    """
+
+    def __init__(self, table: Table, columns, order_by, since_column: Optional[str], signed_in_only: bool = False):
+        self.table = table
+        self.columns = [table.c[column] for column in columns]
+        self.order_by = table.c[order_by]
+        self.since_column = table.c[since_column] if since_column is not None else None
+        # Patient data is only exported to a signed-in user.
+        self.signed_in_only = signed_in_only
+
+    def query(self, since: Optional[datetime.datetime] = None):
+        query = select(*self.columns).order_by(self.order_by)
+        if since is not None:
+            if since.tzinfo is not None:
+                since = since.astimezone(datetime.timezone.utc)
+            query = query.where(self.since_column >= since)
+        return query
+
+
+EXPORTS: Dict[str, Export] = {
+    "namaste-codes": Export(
+        models.NamasteCode.__table__,
+        ("code", "term", "term_diacritical", "term_devanagari", "short_definition", "parent_code", "path", "depth", "updated_at"),
+        "code", "updated_at"
+    ),
+    "namaste-hierarchy": Export(
+        models.NamasteCode.__table__, ("code", "parent_code", "path", "depth", "lft", "rgt"), "lft", None
+    ),
+    "concept-map": Export(
+        models.ConceptMap.__table__,
+        ("map_id", "source_code", "target_code", "target_display", "equivalence", "rank", "similarity_score", "updated_at"),
+        "map_id", "updated_at"
+    ),
+    "diagnosis-log": Export(
+        models.DiagnosisRecord.__table__,
+        ("id", "patient_id", "doctor_id", "namaste_code", "namaste_term", "icd_code", "icd_display", "timestamp"),
+        "id", "timestamp", signed_in_only=True
+    ),
+}
+
+
+async def watermark(conn: AsyncConnection) -> datetime.datetime:
+    """The `since` for the next incremental pull; call it before the export is read."""
+    if conn.dialect.name == "postgresql":
+        # xact_start of other roles' sessions is only visible with pg_read_all_stats; the
+        # ingestion and the API are expected to share the role.
+        mark = await conn.scalar(text(
+            "SELECT least(now(), min(xact_start)) FROM pg_stat_activity WHERE datname = current_database()"
+        ))
+        await conn.rollback()
+        return mark
+    # SQLite has one writer at a time: holding the write lock means no write is in flight.
+    await conn.exec_driver_sql("BEGIN IMMEDIATE")
+    mark = await conn.scalar(select(func.now()))
+    await conn.rollback()
+    # CURRENT_TIMESTAMP has whole seconds and naive UTC; rows of the same second must still match.
+    return mark.replace(tzinfo=datetime.timezone.utc) - datetime.timedelta(seconds=1)
+
+
+async def ndjson(engine: AsyncEngine, query) -> AsyncIterator[bytes]:
+    """Streams the rows of `query` as NDJSON, one chunk per fetched batch, on a connection of its own."""
+    async with engine.connect() as conn:
+        result = await conn.stream(query.execution_options(yield_per=EXPORT_BATCH_ROWS))
+        keys = list(result.keys())
+        async for rows in result.partitions():
+            yield b"".join(dumps(dict(zip(keys, row))) + b"\n" for row in rows)
+
+
+async def gzipped(chunks: AsyncIterator[bytes]) -> AsyncIterator[bytes]:
+    compressor = zlib.compressobj(EXPORT_GZIP_LEVEL, zlib.DEFLATED, 31)  # wbits 31: gzip framing
+    async for chunk in chunks:
+        compressed = compressor.compress(chunk)
+        if compressed:
+            yield compressed
+    yield compressor.flush()
@@ -0,0 +1,229 @@
+import math
+import os
+import threading
+from array import array
+from collections import OrderedDict
+from typing import Any, Dict, Iterable, Iterator, List, NamedTuple, Optional, Tuple
+
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+
+from . import models
+
+CONCEPT_MAP_CACHE_SIZE = int(os.getenv("CONCEPT_MAP_CACHE_SIZE", "10000"))
+
+
+class CachedMapping(NamedTuple):
+    source_code: str
+    target_code: str
+    target_display: Optional[str]
+    equivalence: str
+    rank: Optional[int] = None
+    similarity_score: Optional[float] = None
+
+
+def candidate_order(mapping: CachedMapping) -> Tuple:
+    """Best candidate first: by rank, then by descending score; unranked and unscored rows go last."""
+    return (
+        mapping.rank is None, mapping.rank or 0,
+        mapping.similarity_score is None, -(mapping.similarity_score or 0.0),
+        mapping.target_code
+    )
+
+
+class CandidateIndex:
+    """
+    Every ranked candidate of every source code, in parallel arrays.
+
+    Candidates are grouped by source code and presorted best first at build time;
+    a source's candidates are the slice offsets[slot]:offsets[slot + 1] of the
+    column arrays, so a top-k lookup is a dict probe and a short forward scan.
+    """
+
+    def __init__(self, mappings: Iterable[CachedMapping] = ()):
+        ordered = sorted(mappings, key=lambda m: (m.source_code,) + candidate_order(m))
+        self._slots: Dict[str, int] = {}
+        self._offsets = array('I', [0])
+        self._scores = array('d')
+        self._ranks = array('i')
+        self._targets: List[str] = []
+        self._displays: List[Optional[str]] = []
+        self._equivalences: List[str] = []
+        self._sources: List[str] = []
+        for mapping in ordered:
+            if mapping.source_code not in self._slots:
+                if self._sources:
+                    self._offsets.append(len(self._targets))
+                self._slots[mapping.source_code] = len(self._sources)
+                self._sources.append(mapping.source_code)
+            self._scores.append(math.nan if mapping.similarity_score is None else mapping.similarity_score)
+            self._ranks.append(-1 if mapping.rank is None else mapping.rank)
+            self._targets.append(mapping.target_code)
+            self._displays.append(mapping.target_display)
+            self._equivalences.append(mapping.equivalence)
+        if self._sources:
+            self._offsets.append(len(self._targets))
+
+    def __len__(self) -> int:
+        return len(self._targets)
+
+    def __contains__(self, source_code: str) -> bool:
+        return source_code in self._slots
+
+    @property
+    def sources(self) -> int:
+        return len(self._sources)
+
+    def __iter__(self) -> Iterator[CachedMapping]:
+        for slot, source_code in enumerate(self._sources):
+            yield from self.candidates(source_code, self._offsets[slot + 1] - self._offsets[slot])
+
+    def candidates(self, source_code: str, top_k: int = 1, min_score: Optional[float] = None) -> List[CachedMapping]:
+        slot = self._slots.get(source_code)
+        if slot is None:
+            return []
+        found = []
+        for i in range(self._offsets[slot], self._offsets[slot + 1]):
+            score = self._scores[i]
+            # NaN (no score) never passes a score threshold.
+            if min_score is not None and not score >= min_score:
+                continue
+            found.append(CachedMapping(
+                source_code, self._targets[i], self._displays[i], self._equivalences[i],
+                None if self._ranks[i] < 0 else self._ranks[i], None if math.isnan(score) else score
+            ))
+            if len(found) >= top_k:
+                break
+        return found
+
+
+def _select(candidates: List[CachedMapping], top_k: int, min_score: Optional[float]) -> List[CachedMapping]:
+    if min_score is not None:
+        candidates = [c for c in candidates if c.similarity_score is not None and c.similarity_score >= min_score]
+    return candidates[:top_k]
+
+
+class ConceptMapCache:
+    """
+    NAMASTE code -> ranked ConceptMap candidates.
+
+    The whole table is preloaded into a CandidateIndex whenever the terminology is
+    (re)loaded, so steady state translations never touch the database. Codes that
+    are not in the index fall back to a single query and the answer is kept in a
+    bounded LRU, including "no mapping", so repeated lookups of an unmapped code do
+    not hit the database either.
+    """
+
+    def __init__(self, maxsize: int = CONCEPT_MAP_CACHE_SIZE):
+        self.maxsize = maxsize
+        self._lock = threading.Lock()
+        self._index = CandidateIndex()
+        self._entries: "OrderedDict[str, List[CachedMapping]]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self) -> int:
+        return self._index.sources + len(self._entries)
+
+    def replace(self, mappings: Iterable[CachedMapping]):
+        """Swaps in a freshly loaded table; readers see either the old or the new contents."""
+        self.replace_index(CandidateIndex(mappings))
+
+    def replace_index(self, index):
+        """Swaps in a prebuilt index: a CandidateIndex or a snapshot's concept map."""
+        with self._lock:
+            self._index = index
+            self._entries = OrderedDict()
+
+    def _cached(self, source_code: str, top_k: int, min_score: Optional[float]) -> Optional[List[CachedMapping]]:
+        """Candidates from the index or the LRU, or None when the database must be asked; call with the lock held."""
+        index = self._index
+        if source_code in index:
+            self.hits += 1
+            return index.candidates(source_code, top_k, min_score)
+        if source_code in self._entries:
+            self._entries.move_to_end(source_code)
+            self.hits += 1
+            return _select(self._entries[source_code], top_k, min_score)
+        self.misses += 1
+        return None
+
+    def _remember(self, fetched: Dict[str, List[CachedMapping]]):
+        with self._lock:
+            self._entries.update(fetched)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    async def _fetch(self, db: AsyncSession, source_codes: List[str]) -> Dict[str, List[CachedMapping]]:
+        rows = (await db.execute(select(*_MAPPING_COLUMNS).where(models.ConceptMap.source_code.in_(source_codes)))).all()
+        fetched: Dict[str, List[CachedMapping]] = {source_code: [] for source_code in source_codes}
+        for row in rows:
+            fetched[row.source_code].append(CachedMapping(*row))
+        for candidates in fetched.values():
+            candidates.sort(key=candidate_order)
+        return fetched
+
+    async def candidates(self, db: AsyncSession, source_code: str, top_k: int = 1,
+                         min_score: Optional[float] = None) -> List[CachedMapping]:
+        """The best `top_k` candidates for a code, optionally only those scoring at least `min_score`."""
+        with self._lock:
+            found = self._cached(source_code, top_k, min_score)
+        if found is not None:
+            return found
+        fetched = await self._fetch(db, [source_code])
+        self._remember(fetched)
+        return _select(fetched[source_code], top_k, min_score)
+
+    async def candidates_many(self, db: AsyncSession, source_codes: List[str], top_k: int = 1,
+                              min_score: Optional[float] = None) -> Dict[str, List[CachedMapping]]:
+        """Resolves many codes at once; every code missing from the cache is fetched by one IN query."""
+        found: Dict[str, List[CachedMapping]] = {}
+        missing = []
+        with self._lock:
+            for source_code in dict.fromkeys(source_codes):
+                cached = self._cached(source_code, top_k, min_score)
+                if cached is None:
+                    missing.append(source_code)
+                else:
+                    found[source_code] = cached
+        if missing:
+            fetched = await self._fetch(db, missing)
+            self._remember(fetched)
+            for source_code in missing:
+                found[source_code] = _select(fetched[source_code], top_k, min_score)
+        return found
+
+    async def get(self, db: AsyncSession, source_code: str) -> Optional[CachedMapping]:
+        """The best candidate for a code, or None if it has no mapping."""
+        found = await self.candidates(db, source_code)
+        return found[0] if found else None
+
+    async def get_many(self, db: AsyncSession, source_codes: List[str]) -> Dict[str, Optional[CachedMapping]]:
+        found = await self.candidates_many(db, source_codes)
+        return {source_code: candidates[0] if candidates else None for source_code, candidates in found.items()}
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "sources": self._index.sources,
+            "candidates": len(self._index),
+            "fallback_size": len(self._entries),
+            "maxsize": self.maxsize,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0
+        }
+
+
+_MAPPING_COLUMNS = (
+    models.ConceptMap.source_code, models.ConceptMap.target_code, models.ConceptMap.target_display,
+    models.ConceptMap.equivalence, models.ConceptMap.rank, models.ConceptMap.similarity_score
+)
+
+
+def load_mappings(db: Session):
+    return [CachedMapping(*row) for row in db.query(*_MAPPING_COLUMNS).all()]
@@ -1,9 +1,15 @@
 import os
+import time
 from sqlalchemy import create_engine
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import AsyncAdaptedQueuePool
 from urllib.parse import quote_plus
 
+from . import metrics
+
 # --- Configuration ---
 # It is highly recommended to use environment variables for production
 DB_USER = os.getenv("DB_USER", "postgres")
@@ -15,12 +21,66 @@ DB_NAME = os.getenv("DB_NAME", "ayush_setu_db")
 # URL-encode the password to handle special characters like '@'
 encoded_pass = quote_plus(DB_PASS)
 
-# Construct the database URL safely
-DATABASE_URL = f"postgresql://{DB_USER}:{encoded_pass}@{DB_HOST}:{DB_PORT}/{DB_NAME}"
+# Construct the database URL safely; DATABASE_URL overrides it (e.g. sqlite:///./accura.db locally)
+DATABASE_URL = os.getenv("DATABASE_URL", f"postgresql://{DB_USER}:{encoded_pass}@{DB_HOST}:{DB_PORT}/{DB_NAME}")
+
+# Connection pool of the async engine that serves the API
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "10"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "20"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))
+DB_POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING", "true").lower() in ("1", "true", "yes")
+# asyncpg prepared statement cache per connection; set to 0 behind pgbouncer in transaction mode
+DB_STATEMENT_CACHE_SIZE = int(os.getenv("DB_STATEMENT_CACHE_SIZE", "100"))
 # --------------------
 
-engine = create_engine(DATABASE_URL)
+
+def _async_url(url: str):
+    """Maps the sync URL onto its async driver: asyncpg for PostgreSQL, aiosqlite for SQLite."""
+    parsed = make_url(url)
+    if parsed.get_backend_name() == "postgresql":
+        return parsed.set(drivername="postgresql+asyncpg")
+    if parsed.get_backend_name() == "sqlite":
+        return parsed.set(drivername="sqlite+aiosqlite")
+    return parsed
+
+
+ASYNC_DATABASE_URL = os.getenv("ASYNC_DATABASE_URL") or _async_url(DATABASE_URL)
+
+
+class TimedAsyncQueuePool(AsyncAdaptedQueuePool):
+    """The async engine's pool; times every checkout, including the wait for a free connection and the pre-ping."""
+
+    def connect(self):
+        start = time.perf_counter()
+        try:
+            return super().connect()
+        finally:
+            metrics.db_pool_checkout_seconds.observe(time.perf_counter() - start)
+
+
+def _async_engine_options(url) -> dict:
+    url = make_url(url)
+    options = {"pool_pre_ping": DB_POOL_PRE_PING}
+    if url.get_backend_name() == "sqlite" and url.database in (None, "", ":memory:"):
+        # In-memory SQLite lives in a single connection; there is no pool to size.
+        return options
+    options.update(poolclass=TimedAsyncQueuePool, pool_size=DB_POOL_SIZE, max_overflow=DB_MAX_OVERFLOW, pool_timeout=DB_POOL_TIMEOUT, pool_recycle=DB_POOL_RECYCLE)
+    if url.get_backend_name() == "postgresql":
+        options["connect_args"] = {"prepared_statement_cache_size": DB_STATEMENT_CACHE_SIZE}
+    return options
+
+
+# The sync engine serves ingestion, startup warm-up and the CLI scripts.
+engine = create_engine(DATABASE_URL, pool_pre_ping=DB_POOL_PRE_PING)
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+
+async_engine = create_async_engine(ASYNC_DATABASE_URL, **_async_engine_options(ASYNC_DATABASE_URL))
+AsyncSessionLocal = async_sessionmaker(async_engine, class_=AsyncSession, autoflush=False, expire_on_commit=False)
+
+metrics.instrument_engine(engine, "sync")
+metrics.instrument_engine(async_engine.sync_engine, "async")
+
 Base = declarative_base()
 
 # Dependency for FastAPI
@@ -31,3 +91,26 @@ def get_db():
     finally:
         db.close()
 
+# Async dependency for FastAPI; the API endpoints use this one
+# The session checks a connection out on its first statement, so requests answered from memory never touch the pool.
+async def get_async_db():
+    async with AsyncSessionLocal() as db:
+        yield db
+
+
+def pool_status() -> dict:
+    """Occupancy of the async engine's pool, for spotting saturation."""
+    pool = async_engine.pool
+    if not hasattr(pool, "checkedout"):
+        return {"pool": type(pool).__name__}
+    capacity = pool.size() + max(DB_MAX_OVERFLOW, 0)
+    checked_out = pool.checkedout()
+    return {
+        "pool": type(pool).__name__,
+        "size": pool.size(),
+        "max_overflow": DB_MAX_OVERFLOW,
+        "checked_out": checked_out,
+        "checked_in": pool.checkedin(),
+        "overflow": pool.overflow(),
+        "saturation": round(checked_out / capacity, 4) if capacity else 0.0
+    }
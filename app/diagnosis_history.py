@@ -0,0 +1,53 @@
+"""
+Keyset pagination over a patient's diagnosis log.
+
+Pages are ordered by (timestamp desc, id desc) and served by the composite
+ix_diagnosis_log_patient_timestamp_id index, so every page costs the same no
+matter how deep into the history it is.
+"""
+import base64
+import binascii
+import datetime
+from typing import Optional
+
+from sqlalchemy import and_, or_, select
+
+from . import models
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+def encode_cursor(record: models.DiagnosisRecord) -> str:
+    return base64.urlsafe_b64encode(str(record.id).encode("ascii")).decode("ascii").rstrip("=")
+
+
+def decode_cursor(cursor: str) -> int:
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        return int(base64.urlsafe_b64decode(padded.encode("ascii")).decode("ascii"))
+    except (binascii.Error, UnicodeError, ValueError):
+        raise InvalidCursor(f"Invalid cursor: {cursor}")
+
+
+def history_query(patient_id: str, after_id: Optional[int] = None, since: Optional[datetime.datetime] = None,
+                  until: Optional[datetime.datetime] = None, namaste_code: Optional[str] = None,
+                  icd_code: Optional[str] = None):
+    """Selects the patient's records newest first, starting after the record with id `after_id`."""
+    record = models.DiagnosisRecord
+    query = select(record).where(record.patient_id == patient_id)
+    if after_id is not None:
+        # The cursor row's own timestamp is looked up by primary key, so the comparison
+        # never depends on how the driver round-trips timestamps.
+        after_timestamp = select(record.timestamp).where(record.id == after_id).scalar_subquery()
+        query = query.where(or_(record.timestamp < after_timestamp, and_(record.timestamp == after_timestamp, record.id < after_id)))
+    if since is not None:
+        query = query.where(record.timestamp >= since)
+    if until is not None:
+        query = query.where(record.timestamp < until)
+    if namaste_code is not None:
+        query = query.where(record.namaste_code == namaste_code)
+    if icd_code is not None:
+        query = query.where(record.icd_code == icd_code)
+    return query.order_by(record.timestamp.desc(), record.id.desc())
@@ -0,0 +1,186 @@
+"""
+Durable outbox for EMR submissions.
+
+/diagnosis/confirm writes its FHIR entries to emr_outbox in the same transaction as
+the diagnosis_log row and returns. A background dispatcher claims due rows,
+coalesces them into transaction Bundles and posts them to the EMR with bounded
+parallelism, retrying failures with exponential backoff.
+"""
+import asyncio
+import datetime
+import json
+import logging
+import os
+from typing import Any, Callable, Dict, List, Optional, Tuple, Union
+
+from sqlalchemy import func, select
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
+from sqlalchemy.orm import Session
+
+from . import fhir, models
+
+logger = logging.getLogger(__name__)
+
+OUTBOX_CONCURRENCY = int(os.getenv("EMR_OUTBOX_CONCURRENCY", "8"))
+OUTBOX_BATCH_SIZE = int(os.getenv("EMR_OUTBOX_BATCH_SIZE", "50"))
+OUTBOX_MAX_ATTEMPTS = int(os.getenv("EMR_OUTBOX_MAX_ATTEMPTS", "8"))
+OUTBOX_BACKOFF_SECONDS = float(os.getenv("EMR_OUTBOX_BACKOFF_SECONDS", "2"))
+OUTBOX_BACKOFF_MAX_SECONDS = float(os.getenv("EMR_OUTBOX_BACKOFF_MAX_SECONDS", "300"))
+OUTBOX_POLL_SECONDS = float(os.getenv("EMR_OUTBOX_POLL_SECONDS", "5"))
+# A claimed row is invisible to other dispatchers for this long; if its worker dies, it is retried.
+OUTBOX_LEASE_SECONDS = float(os.getenv("EMR_OUTBOX_LEASE_SECONDS", "60"))
+
+STATUS_PENDING = "pending"
+STATUS_SENT = "sent"
+STATUS_FAILED = "failed"
+
+
+def utcnow() -> datetime.datetime:
+    return datetime.datetime.now(datetime.timezone.utc)
+
+
+def enqueue(db: Union[Session, AsyncSession], entries: List[Dict[str, Any]]) -> models.EmrOutbox:
+    """Adds FHIR transaction entries to the outbox; they are sent once the caller commits."""
+    row = models.EmrOutbox(payload=json.dumps(entries), status=STATUS_PENDING, attempts=0, next_attempt_at=utcnow())
+    db.add(row)
+    return row
+
+
+def backoff_delay(attempts: int) -> float:
+    return min(OUTBOX_BACKOFF_SECONDS * (2 ** max(attempts - 1, 0)), OUTBOX_BACKOFF_MAX_SECONDS)
+
+
+class OutboxDispatcher:
+    """Background task draining emr_outbox into the EMR FHIR endpoint."""
+
+    def __init__(self, session_factory: async_sessionmaker, endpoint: str, get_client: Callable):
+        self.session_factory = session_factory
+        self.endpoint = endpoint
+        self.get_client = get_client
+        self._task: Optional[asyncio.Task] = None
+        self._wakeup: Optional[asyncio.Event] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._semaphore: Optional[asyncio.Semaphore] = None
+
+    async def start(self):
+        self._loop = asyncio.get_running_loop()
+        self._wakeup = asyncio.Event()
+        self._semaphore = asyncio.Semaphore(OUTBOX_CONCURRENCY)
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def notify(self):
+        """Wakes the dispatcher after a commit; safe to call from the event loop or from threads."""
+        if self._loop is not None and self._wakeup is not None:
+            self._loop.call_soon_threadsafe(self._wakeup.set)
+
+    async def _run(self):
+        while True:
+            # Cleared before the claim, so a notify() arriving mid-dispatch is kept for the wait below.
+            self._wakeup.clear()
+            try:
+                dispatched = await self.dispatch_once()
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("EMR outbox dispatch failed")
+                dispatched = 0
+            if dispatched:
+                continue
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=OUTBOX_POLL_SECONDS)
+            except asyncio.TimeoutError:
+                pass
+
+    async def dispatch_once(self) -> int:
+        """Claims every due row (up to one round of batches), sends them and returns how many were claimed."""
+        claimed = await self._claim_due(OUTBOX_CONCURRENCY * OUTBOX_BATCH_SIZE)
+        if not claimed:
+            return 0
+        await asyncio.gather(*(self._send(batch) for batch in self._batches(claimed)))
+        return len(claimed)
+
+    @staticmethod
+    def _batches(claimed: List[Tuple[int, int, list]]) -> List[List[Tuple[int, int, list]]]:
+        # Rows that already failed once go out alone, so one bad entry cannot keep failing a whole batch.
+        batches, current = [], []
+        for row in claimed:
+            if row[1] > 1:
+                batches.append([row])
+                continue
+            current.append(row)
+            if len(current) >= OUTBOX_BATCH_SIZE:
+                batches.append(current)
+                current = []
+        if current:
+            batches.append(current)
+        return batches
+
+    async def _claim_due(self, limit: int) -> List[Tuple[int, int, list]]:
+        async with self.session_factory() as db:
+            now = utcnow()
+            rows = (await db.execute(
+                select(models.EmrOutbox)
+                .where(models.EmrOutbox.status == STATUS_PENDING, models.EmrOutbox.next_attempt_at <= now)
+                .order_by(models.EmrOutbox.id)
+                .limit(limit)
+                .with_for_update(skip_locked=True)
+            )).scalars().all()
+            lease_expiry = now + datetime.timedelta(seconds=OUTBOX_LEASE_SECONDS)
+            claimed = []
+            for row in rows:
+                row.attempts += 1
+                row.next_attempt_at = lease_expiry
+                claimed.append((row.id, row.attempts, json.loads(row.payload)))
+            await db.commit()
+            return claimed
+
+    async def _send(self, batch: List[Tuple[int, int, list]]):
+        ids = [row_id for row_id, _, _ in batch]
+        bundle = fhir.transaction_bundle([entry for _, _, entries in batch for entry in entries])
+        async with self._semaphore:
+            try:
+                response = await self.get_client().post(self.endpoint, json=bundle)
+                error = None if response.status_code in (200, 201) else f"EMR responded {response.status_code}"
+            except Exception as e:
+                error = f"{type(e).__name__}: {e}"
+        retry_in = await self._record_result(ids, error)
+        if retry_in is not None:
+            self._loop.call_later(retry_in, self._wakeup.set)
+
+    async def _record_result(self, ids: List[int], error: Optional[str]) -> Optional[float]:
+        """Marks rows sent or schedules their retry; returns the earliest retry delay, if any."""
+        retry_in = None
+        async with self.session_factory() as db:
+            now = utcnow()
+            rows = (await db.execute(select(models.EmrOutbox).where(models.EmrOutbox.id.in_(ids)))).scalars().all()
+            for row in rows:
+                if error is None:
+                    row.status = STATUS_SENT
+                    row.sent_at = now
+                    row.last_error = None
+                elif row.attempts >= OUTBOX_MAX_ATTEMPTS:
+                    row.status = STATUS_FAILED
+                    row.last_error = error
+                else:
+                    delay = backoff_delay(row.attempts)
+                    row.next_attempt_at = now + datetime.timedelta(seconds=delay)
+                    row.last_error = error
+                    retry_in = delay if retry_in is None else min(retry_in, delay)
+            await db.commit()
+        if error is not None:
+            logger.warning("EMR submission of outbox rows %s failed: %s", ids, error)
+        return retry_in
+
+
+async def outbox_counts(db: AsyncSession) -> Dict[str, int]:
+    rows = await db.execute(select(models.EmrOutbox.status, func.count(models.EmrOutbox.id)).group_by(models.EmrOutbox.status))
+    return {status: count for status, count in rows}
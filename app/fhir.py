@@ -0,0 +1,149 @@
+"""Builders and parsers for the FHIR resources exchanged by the terminology endpoints."""
+import datetime
+import uuid
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+ICD11_SYSTEM = "http://id.who.int/icd/release/11/mms"
+NAMASTE_SYSTEM = "NAMASTE"
+
+# $translate input parameters that carry the source code, as a code or as a Coding.
+_CODE_PARAMETERS = ("code", "sourceCode")
+_CODING_PARAMETERS = ("coding", "sourceCoding")
+
+
+def match_parameter(mapping) -> Dict[str, Any]:
+    """One $translate `match` output parameter."""
+    parts = [{"name": "equivalence", "valueCode": mapping.equivalence}, {"name": "concept", "valueCoding": {"system": ICD11_SYSTEM, "code": mapping.target_code, "display": mapping.target_display}}]
+    if mapping.similarity_score is not None:
+        parts.append({"name": "similarity", "valueDecimal": mapping.similarity_score})
+    return {"name": "match", "part": parts}
+
+
+def translate_parameters(mappings) -> Dict[str, Any]:
+    """The $translate output Parameters for one or more candidate mappings, best first."""
+    parameters = [{"name": "result", "valueBoolean": True}]
+    parameters.extend(match_parameter(mapping) for mapping in mappings)
+    return {"resourceType": "Parameters", "parameter": parameters}
+
+
+def translate_not_found(namaste_code: str) -> Dict[str, Any]:
+    return {
+        "resourceType": "Parameters",
+        "parameter": [
+            {"name": "result", "valueBoolean": False},
+            {"name": "message", "valueString": f"Mapping not found for NAMASTE code: {namaste_code}"}
+        ]
+    }
+
+
+def _items(container: Dict[str, Any], key: str, what: str) -> List[Dict[str, Any]]:
+    """The JSON objects listed under `key`; anything else is malformed input."""
+    items = container.get(key) or []
+    if not isinstance(items, list) or not all(isinstance(item, dict) for item in items):
+        raise ValueError(f"{what} must be a list of JSON objects")
+    return items
+
+
+def _code(value: Any, what: str) -> str:
+    if not isinstance(value, str):
+        raise ValueError(f"{what} must be a string")
+    return value
+
+
+def _codes_from_parameters(parameters: Dict[str, Any]) -> List[str]:
+    codes = []
+    for parameter in _items(parameters, "parameter", "Parameters.parameter"):
+        name = parameter.get("name")
+        if name in _CODE_PARAMETERS and parameter.get("valueCode"):
+            codes.append(_code(parameter["valueCode"], "valueCode"))
+        elif name in _CODING_PARAMETERS and parameter.get("valueCoding"):
+            coding = parameter["valueCoding"]
+            if not isinstance(coding, dict):
+                raise ValueError("valueCoding must be a JSON object")
+            if coding.get("code"):
+                codes.append(_code(coding["code"], "valueCoding.code"))
+    return codes
+
+
+def extract_translate_codes(body: Dict[str, Any]) -> List[str]:
+    """
+    Reads the NAMASTE codes of a batch translate request, in order.
+
+    Accepts {"namaste_codes": [...]}, a FHIR Parameters resource with one code/coding
+    parameter per code, or a Bundle whose entries are such Parameters resources.
+    Raises ValueError for anything else, including malformed parameters.
+    """
+    if "namaste_codes" in body:
+        codes = body["namaste_codes"]
+        if not isinstance(codes, list) or not all(isinstance(code, str) for code in codes):
+            raise ValueError("namaste_codes must be a list of strings")
+        return codes
+    resource_type = body.get("resourceType")
+    if resource_type == "Parameters":
+        return _codes_from_parameters(body)
+    if resource_type == "Bundle":
+        codes = []
+        for entry in _items(body, "entry", "Bundle.entry"):
+            resource = entry.get("resource") or {}
+            if not isinstance(resource, dict) or resource.get("resourceType") != "Parameters":
+                raise ValueError("Bundle entries must be Parameters resources")
+            codes.extend(_codes_from_parameters(resource))
+        return codes
+    raise ValueError("Expected namaste_codes, a Parameters resource or a Bundle of Parameters")
+
+
+def translate_batch_bundle(results: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """Wraps per-code $translate results in a batch-response Bundle, one entry per input code."""
+    entries = []
+    for parameters in results:
+        found = parameters["parameter"][0]["valueBoolean"]
+        entries.append({"resource": parameters, "response": {"status": "200 OK" if found else "404 Not Found"}})
+    return {"resourceType": "Bundle", "type": "batch-response", "total": len(entries), "entry": entries}
+
+
+def _property(code: str, value: str) -> Dict[str, Any]:
+    return {"name": "property", "part": [{"name": "code", "valueCode": code}, {"name": "value", "valueCode": value}]}
+
+
+def lookup_parameters(row: Tuple, version: str, parent: Optional[str], children: Iterable[str]) -> Dict[str, Any]:
+    """CodeSystem/$lookup output for a (code, term, diacritical, devanagari, definition) row."""
+    _, term, diacritical, devanagari, definition = row
+    parameters = [{"name": "name", "valueString": NAMASTE_SYSTEM}, {"name": "version", "valueString": version}, {"name": "display", "valueString": term}]
+    if definition:
+        parameters.append({"name": "definition", "valueString": definition})
+    for language, value in (("sa-Latn", diacritical), ("sa-Deva", devanagari)):
+        if value:
+            parameters.append({"name": "designation", "part": [{"name": "language", "valueCode": language}, {"name": "value", "valueString": value}]})
+    if parent is not None:
+        parameters.append(_property("parent", parent))
+    parameters.extend(_property("child", child) for child in children)
+    return {"resourceType": "Parameters", "parameter": parameters}
+
+
+def valueset_expansion(identifier: str, timestamp: str, offset: int, total: Optional[int], contains: List[Tuple[str, Optional[str]]],
+                       parameters: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """A ValueSet/$expand result holding one page of (code, display) concepts."""
+    expansion = {"identifier": identifier, "timestamp": timestamp}
+    if total is not None:
+        expansion["total"] = total
+    expansion["offset"] = offset
+    expansion["parameter"] = parameters
+    expansion["contains"] = [{"system": NAMASTE_SYSTEM, "code": code, "display": display} for code, display in contains]
+    return {"resourceType": "ValueSet", "status": "active", "expansion": expansion}
+
+
+def diagnosis_entries(patient_id: str, doctor_id: str, mappings: List) -> List[Dict[str, Any]]:
+    """The transaction entries recording one encounter: an Encounter and a Condition per confirmed mapping."""
+    encounter_url = f"urn:uuid:{uuid.uuid4()}"
+    entries = [
+        {"fullUrl": encounter_url, "resource": {"resourceType": "Encounter", "status": "finished", "class": {"system": "http://terminology.hl7.org/CodeSystem/v3-ActCode", "code": "AMB", "display": "ambulatory"}, "subject": {"reference": f"Patient/{patient_id}"}, "participant": [{"individual": {"reference": f"Practitioner/{doctor_id}"}}]}, "request": {"method": "POST", "url": "Encounter"}}
+    ]
+    for mapping in mappings:
+        entries.append(
+            {"fullUrl": f"urn:uuid:{uuid.uuid4()}", "resource": {"resourceType": "Condition", "subject": {"reference": f"Patient/{patient_id}"}, "encounter": {"reference": encounter_url}, "code": {"text": mapping.target_display, "coding": [{"system": NAMASTE_SYSTEM, "code": mapping.source_code, "display": mapping.target_display}, {"system": ICD11_SYSTEM, "code": mapping.target_code, "display": mapping.target_display}]}}, "request": {"method": "POST", "url": "Condition"}}
+        )
+    return entries
+
+
+def transaction_bundle(entries: List[Dict[str, Any]]) -> Dict[str, Any]:
+    return {"resourceType": "Bundle", "type": "transaction", "timestamp": datetime.datetime.utcnow().isoformat() + "Z", "entry": entries}
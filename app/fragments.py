@@ -0,0 +1,127 @@
+"""
+Pre-rendered JSON fragments for the terminology read endpoints.
+
+Search and autocomplete rows and $translate `match` parameters only change when
+the terminology does, so they are serialized to bytes once per version, and a
+response is the concatenation of the fragments it needs. Codes outside the
+preloaded views are rendered on demand with the same encoder. The terminology
+snapshot stores the same fragments, so workers share them (see snapshot.py).
+
+orjson is used when installed; the standard library encoder is the fallback.
+"""
+import datetime
+import json
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
+
+from fastapi import Response
+
+from . import fhir
+
+try:
+    import orjson
+except ImportError:  # orjson is optional; json produces the same documents
+    orjson = None
+
+
+def _iso_format(value: Any) -> str:
+    if isinstance(value, (datetime.date, datetime.datetime)):
+        return value.isoformat()
+    raise TypeError(f"{type(value).__name__} is not JSON serializable")
+
+
+def dumps(data: Any) -> bytes:
+    """Compact UTF-8 JSON; dates and datetimes become ISO 8601 strings, as orjson writes them."""
+    if orjson is not None:
+        return orjson.dumps(data)
+    return json.dumps(data, ensure_ascii=False, separators=(",", ":"), default=_iso_format).encode("utf-8")
+
+
+class FastJSONResponse(Response):
+    """JSON response rendered with dumps(); bytes content is sent as is."""
+    media_type = "application/json"
+
+    def render(self, content: Any) -> bytes:
+        if isinstance(content, (bytes, bytearray)):
+            return bytes(content)
+        return dumps(content)
+
+
+def json_array(fragments: Iterable[bytes]) -> bytes:
+    return b"[" + b",".join(fragments) + b"]"
+
+
+_PARAMETERS_HEAD = b'{"resourceType":"Parameters","parameter":[' + dumps({"name": "result", "valueBoolean": True})
+_BUNDLE_FOUND = b',"response":' + dumps({"status": "200 OK"}) + b"}"
+_BUNDLE_NOT_FOUND = b',"response":' + dumps({"status": "404 Not Found"}) + b"}"
+
+
+def search_fragment(code: str, term: Optional[str], definition: Optional[str]) -> bytes:
+    return dumps({"code": code, "term": term, "short_definition": definition})
+
+
+def autocomplete_fragment(code: str, term: Optional[str], diacritical: Optional[str], devanagari: Optional[str]) -> bytes:
+    return dumps({"code": code, "term": term, "term_diacritical": diacritical, "term_devanagari": devanagari})
+
+
+def match_fragment(mapping) -> bytes:
+    return dumps(fhir.match_parameter(mapping))
+
+
+class Fragments:
+    """
+    Byte fragments of one terminology version, keyed by code (and target code for matches).
+    Subclasses may keep the fragments elsewhere by overriding the three lookups.
+    """
+
+    def __init__(self, rows: Sequence[Tuple[str, Optional[str], Optional[str], Optional[str], Optional[str]]] = (),
+                 mappings: Iterable = ()):
+        self._search: Dict[str, bytes] = {}
+        self._autocomplete: Dict[str, bytes] = {}
+        for code, term, diacritical, devanagari, definition in rows:
+            self._search[code] = search_fragment(code, term, definition)
+            self._autocomplete[code] = autocomplete_fragment(code, term, diacritical, devanagari)
+        self._matches: Dict[Tuple[str, str], bytes] = {
+            (mapping.source_code, mapping.target_code): match_fragment(mapping) for mapping in mappings
+        }
+
+    # --- Lookups; None when the fragment was not pre-rendered ---
+
+    def search_fragment(self, code: str) -> Optional[bytes]:
+        return self._search.get(code)
+
+    def autocomplete_fragment(self, code: str) -> Optional[bytes]:
+        return self._autocomplete.get(code)
+
+    def match_fragment(self, mapping) -> Optional[bytes]:
+        return self._matches.get((mapping.source_code, mapping.target_code))
+
+    # --- Responses ---
+
+    def search(self, rows: Iterable[Tuple[str, Optional[str], Optional[str]]]) -> bytes:
+        return json_array(
+            self.search_fragment(code) or search_fragment(code, term, definition)
+            for code, term, definition in rows
+        )
+
+    def autocomplete(self, rows: Iterable[Tuple[str, Optional[str], Optional[str], Optional[str]]]) -> bytes:
+        return json_array(
+            self.autocomplete_fragment(code) or autocomplete_fragment(code, term, diacritical, devanagari)
+            for code, term, diacritical, devanagari in rows
+        )
+
+    def _match(self, mapping) -> bytes:
+        return self.match_fragment(mapping) or match_fragment(mapping)
+
+    def translate_parameters(self, mappings: List) -> bytes:
+        """Same document as fhir.translate_parameters(mappings)."""
+        return _PARAMETERS_HEAD + b"".join(b"," + self._match(mapping) for mapping in mappings) + b"]}"
+
+    def translate_batch_bundle(self, results: List[Tuple[str, List]]) -> bytes:
+        """Same document as fhir.translate_batch_bundle() for (code, candidates) pairs in input order."""
+        entries = []
+        for code, candidates in results:
+            if candidates:
+                entries.append(b'{"resource":' + self.translate_parameters(candidates) + _BUNDLE_FOUND)
+            else:
+                entries.append(b'{"resource":' + dumps(fhir.translate_not_found(code)) + _BUNDLE_NOT_FOUND)
+        return b'{"resourceType":"Bundle","type":"batch-response","total":' + str(len(entries)).encode() + b',"entry":' + json_array(entries) + b"}"
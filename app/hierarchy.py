@@ -0,0 +1,135 @@
+"""
+The NAMASTE code hierarchy.
+
+NAMASTE codes nest by prefix: "AAA-2.1" sits under "AAA-2", "AAA-2" under
+"AAA", "AAA" under "AA" and "AA" under "A". A code whose parent by that rule is
+not in the code system ("AYU", "DIS") is a root.
+
+Hierarchy numbers the tree in preorder, siblings in natural code order
+("AAB-9" before "AAB-10"), so the descendants of every code are one contiguous
+run of the preorder list. Ingestion stores the same numbering in
+namaste_codesystem as a nested set (lft, rgt) together with the parent, the
+materialized path and the depth; the terminology snapshot stores the preorder
+run (see snapshot.py) and the API pages through it, so a subtree page costs
+time proportional to the page.
+"""
+import re
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+PATH_SEPARATOR = "/"
+
+_NUMBERS = re.compile(r"(\d+)")
+
+# (code, parent_code, path, depth, lft, rgt) as stored in namaste_codesystem
+HierarchyRow = Tuple[str, Optional[str], str, int, int, int]
+
+
+def parent_code(code: str) -> Optional[str]:
+    """The code `code` would nest under, whether or not it exists."""
+    if "." in code:
+        return code.rsplit(".", 1)[0]
+    if "-" in code:
+        return code.rsplit("-", 1)[0]
+    return code[:-1] or None
+
+
+def natural_key(code: str) -> tuple:
+    """Orders runs of digits by value; split() alternates text and digits, so positions never mix types."""
+    return tuple(int(part) if i % 2 else part for i, part in enumerate(_NUMBERS.split(code)))
+
+
+class Hierarchy:
+    """Immutable parent/child index over a set of codes, in preorder."""
+
+    def __init__(self, codes: Iterable[str] = ()):
+        known = set(codes)
+        self._parent: Dict[str, Optional[str]] = {}
+        children: Dict[Optional[str], List[str]] = {}
+        for code in known:
+            parent = parent_code(code)
+            parent = parent if parent in known else None
+            self._parent[code] = parent
+            children.setdefault(parent, []).append(code)
+        for siblings in children.values():
+            siblings.sort(key=natural_key)
+        self._children = children
+
+        self._order: List[str] = []
+        self._position: Dict[str, int] = {}
+        self._depth: List[int] = []
+        self._size: List[int] = []  # descendants of each position
+        stack = [(code, 0) for code in reversed(children.get(None, []))]
+        while stack:
+            code, depth = stack.pop()
+            self._position[code] = len(self._order)
+            self._order.append(code)
+            self._depth.append(depth)
+            self._size.append(0)
+            stack.extend((child, depth + 1) for child in reversed(children.get(code, [])))
+        # Preorder puts every subtree after its root, so sizes accumulate back to front.
+        for position in range(len(self._order) - 1, -1, -1):
+            parent = self._parent[self._order[position]]
+            if parent is not None:
+                self._size[self._position[parent]] += self._size[position] + 1
+
+    def __len__(self) -> int:
+        return len(self._order)
+
+    def __contains__(self, code: str) -> bool:
+        return code in self._position
+
+    def parent(self, code: str) -> Optional[str]:
+        return self._parent.get(code)
+
+    def children(self, code: Optional[str] = None) -> List[str]:
+        """Direct children of `code`, or the roots when code is None."""
+        return list(self._children.get(code, ()))
+
+    def ancestors(self, code: str) -> List[str]:
+        """From the root down to the parent of `code`."""
+        chain = []
+        parent = self._parent.get(code)
+        while parent is not None:
+            chain.append(parent)
+            parent = self._parent[parent]
+        return chain[::-1]
+
+    def depth(self, code: str) -> int:
+        return self._depth[self._position[code]]
+
+    def descendant_count(self, code: Optional[str] = None) -> int:
+        return len(self._order) if code is None else self._size[self._position[code]]
+
+    def _run(self, code: Optional[str]) -> Tuple[int, int]:
+        if code is None:
+            return 0, len(self._order)
+        start = self._position[code] + 1
+        return start, start + self._size[start - 1]
+
+    def descendants(self, code: Optional[str] = None, offset: int = 0, count: Optional[int] = None) -> List[str]:
+        """A page of the descendants of `code` (of every code when None), in preorder."""
+        start, end = self._run(code)
+        start += offset
+        if count is not None:
+            end = min(end, start + count)
+        return self._order[start:end]
+
+    def iter_descendants(self, code: Optional[str] = None) -> Iterator[str]:
+        start, end = self._run(code)
+        return (self._order[position] for position in range(start, end))
+
+    def preorder(self) -> Iterator[Tuple[str, Optional[str], int, int]]:
+        """Every code in preorder with its parent, depth and number of descendants."""
+        for position, code in enumerate(self._order):
+            yield code, self._parent[code], self._depth[position], self._size[position]
+
+    def rows(self) -> Iterator[HierarchyRow]:
+        """Every code with its parent, path, depth and nested-set bounds, numbered from 1 in preorder."""
+        paths: Dict[str, str] = {}
+        for position, code in enumerate(self._order):
+            parent = self._parent[code]
+            path = paths[code] = code if parent is None else paths[parent] + PATH_SEPARATOR + code
+            depth = self._depth[position]
+            # Each code's left bound counts the bounds opened and closed before it.
+            lft = 2 * position - depth + 1
+            yield code, parent, path, depth, lft, lft + 2 * self._size[position] + 1
@@ -0,0 +1,107 @@
+"""
+HTTP caching helpers for the terminology read endpoints.
+
+Terminology responses only change when ingestion stamps a new version, so their
+ETags are derived from that version and large payloads are serialized and
+compressed once per version instead of once per request. Each content-coding of
+a payload is a different representation, so it gets its own strong ETag: the
+version ETag with the coding appended ("<digest>-gzip").
+"""
+import gzip
+import hashlib
+import os
+from typing import Any, Dict, Optional
+
+from fastapi import Request, Response
+
+from .fragments import dumps
+
+try:
+    import brotli
+except ImportError:  # brotli is optional; gzip is always available
+    brotli = None
+
+CACHE_MAX_AGE = int(os.getenv("TERMINOLOGY_CACHE_MAX_AGE", "300"))
+COMPRESS_MIN_BYTES = 1024
+
+
+class Payload:
+    """A JSON body serialized once, with pre-compressed variants for large bodies."""
+
+    __slots__ = ("etag", "body", "encoded")
+
+    def __init__(self, etag: str, data: Any):
+        self.etag = etag
+        self.body = dumps(data)
+        self.encoded: Dict[str, bytes] = {}
+        if len(self.body) >= COMPRESS_MIN_BYTES:
+            self.encoded["gzip"] = gzip.compress(self.body, compresslevel=9, mtime=0)
+            if brotli is not None:
+                self.encoded["br"] = brotli.compress(self.body, quality=11)
+
+
+def make_etag(version: str, *parts: str) -> str:
+    digest = hashlib.sha256("\x1f".join((version,) + parts).encode("utf-8")).hexdigest()
+    return f'"{digest[:32]}"'
+
+
+ENCODINGS = ("br", "gzip")
+
+
+def encoded_etag(etag: str, encoding: Optional[str]) -> str:
+    """The ETag of the `encoding` variant of the representation tagged `etag`; identity keeps it as is."""
+    return etag if encoding is None else f'{etag[:-1]}-{encoding}"'
+
+
+def _unencoded(tag: str) -> str:
+    for encoding in ENCODINGS:
+        suffix = f'-{encoding}"'
+        if tag.endswith(suffix):
+            return tag[:-len(suffix)] + '"'
+    return tag
+
+
+def cache_headers(etag: str) -> Dict[str, str]:
+    return {"ETag": etag, "Cache-Control": f"public, max-age={CACHE_MAX_AGE}", "Vary": "Accept-Encoding"}
+
+
+def is_not_modified(request: Request, etag: str) -> bool:
+    """
+    Evaluates If-None-Match with the weak comparison RFC 9110 prescribes for it.
+    A tag of any content-coding of `etag` matches, since they share one body.
+    """
+    header = request.headers.get("if-none-match")
+    if not header:
+        return False
+    if header.strip() == "*":
+        return True
+    candidates = (tag.strip() for tag in header.split(","))
+    return any(_unencoded(tag.removeprefix("W/")) == etag for tag in candidates)
+
+
+def not_modified(etag: str) -> Response:
+    return Response(status_code=304, headers=cache_headers(etag))
+
+
+def accepted_encodings(request: Request) -> set:
+    accepted = set()
+    for item in request.headers.get("accept-encoding", "").split(","):
+        name, _, params = item.strip().partition(";")
+        if params.strip().replace(" ", "") in ("q=0", "q=0.0", "q=0.00", "q=0.000"):
+            continue
+        accepted.add(name.strip().lower())
+    return accepted
+
+
+def payload_response(request: Request, payload: Payload) -> Response:
+    """Serves a pre-built payload, answering 304 or picking a pre-compressed variant."""
+    accepted = accepted_encodings(request)
+    encoding = next((name for name in ENCODINGS if name in accepted and name in payload.encoded), None)
+    etag = encoded_etag(payload.etag, encoding)
+    if is_not_modified(request, payload.etag):
+        return not_modified(etag)
+    headers = cache_headers(etag)
+    if encoding is None:
+        return Response(content=payload.body, media_type="application/json", headers=headers)
+    headers["Content-Encoding"] = encoding
+    return Response(content=payload.encoded[encoding], media_type="application/json", headers=headers)
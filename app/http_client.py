@@ -0,0 +1,35 @@
+"""Process-wide pooled HTTP client for ABHA and the FHIR EMR, opened and closed with the app."""
+import os
+from typing import Optional
+
+import httpx
+
+from . import metrics
+
+HTTP_MAX_CONNECTIONS = int(os.getenv("HTTP_MAX_CONNECTIONS", "100"))
+HTTP_MAX_KEEPALIVE_CONNECTIONS = int(os.getenv("HTTP_MAX_KEEPALIVE_CONNECTIONS", "20"))
+HTTP_TIMEOUT_SECONDS = float(os.getenv("HTTP_TIMEOUT_SECONDS", "10"))
+
+_client: Optional[httpx.AsyncClient] = None
+
+
+async def start():
+    global _client
+    _client = httpx.AsyncClient(
+        limits=httpx.Limits(max_connections=HTTP_MAX_CONNECTIONS, max_keepalive_connections=HTTP_MAX_KEEPALIVE_CONNECTIONS),
+        timeout=HTTP_TIMEOUT_SECONDS,
+        event_hooks=metrics.httpx_event_hooks()
+    )
+
+
+async def stop():
+    global _client
+    if _client is not None:
+        await _client.aclose()
+        _client = None
+
+
+def get_client() -> httpx.AsyncClient:
+    if _client is None:
+        raise RuntimeError("HTTP client is not started; it is opened in the app lifespan.")
+    return _client
@@ -0,0 +1,169 @@
+"""
+Background ingestion jobs.
+
+Ingestion runs on its own thread with its own session, so the admin request
+returns at once with a job id that can be polled or cancelled. The load commits
+in a single transaction and the in-memory terminology is swapped only after that
+commit, so reads keep being served from the previous version until then.
+"""
+import datetime
+import logging
+import threading
+import uuid
+from typing import Any, Callable, Dict, Optional
+
+from sqlalchemy.orm import Session
+
+from . import ingestion_logic, metrics, terminology
+
+logger = logging.getLogger(__name__)
+
+STATUS_QUEUED = "queued"
+STATUS_RUNNING = "running"
+STATUS_SUCCEEDED = "succeeded"
+STATUS_FAILED = "failed"
+STATUS_CANCELLED = "cancelled"
+
+PHASES = ("namaste_codes", "concept_map", "stamp_version", "reload")
+
+MAX_FINISHED_JOBS = 20
+
+
+class IngestionCancelled(Exception):
+    pass
+
+
+class JobAlreadyRunning(Exception):
+    def __init__(self, job: "IngestionJob"):
+        super().__init__(f"Ingestion job {job.id} is already {job.status}")
+        self.job = job
+
+
+def _now() -> str:
+    return datetime.datetime.now(datetime.timezone.utc).isoformat()
+
+
+class IngestionJob:
+    def __init__(self, force: bool):
+        self.id = uuid.uuid4().hex
+        self.force = force
+        self.status = STATUS_QUEUED
+        self.phase: Optional[str] = None
+        self.rows_processed = 0
+        self.results: Optional[Dict[str, Any]] = None
+        self.error: Optional[str] = None
+        self.created_at = _now()
+        self.started_at: Optional[str] = None
+        self.finished_at: Optional[str] = None
+        self._cancel = threading.Event()
+        self._phase_rows = 0
+        self._timer = metrics.PhaseTimer()
+
+    @property
+    def finished(self) -> bool:
+        return self.status in (STATUS_SUCCEEDED, STATUS_FAILED, STATUS_CANCELLED)
+
+    def progress(self) -> float:
+        if self.status == STATUS_SUCCEEDED:
+            return 1.0
+        if self.phase not in PHASES:
+            return 0.0
+        return round(PHASES.index(self.phase) / len(PHASES), 2)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "job_id": self.id,
+            "status": self.status,
+            "phase": self.phase,
+            "progress": self.progress(),
+            "rows_processed": self.rows_processed,
+            "force": self.force,
+            "results": self.results,
+            "error": self.error,
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+        }
+
+    # --- Callbacks from the ingestion engine ---
+
+    def _on_phase(self, phase: str):
+        if self._cancel.is_set():
+            raise IngestionCancelled()
+        self.phase = phase
+        self._phase_rows = self.rows_processed
+        self._timer.start(phase, self.rows_processed)
+
+    def _on_chunk(self, stats: Dict[str, int]):
+        self.rows_processed = self._phase_rows + stats['rows']
+        if self._cancel.is_set():
+            raise IngestionCancelled()
+
+
+class IngestionJobManager:
+    """
+    Runs at most one ingestion at a time and remembers recent jobs for status
+    polling. The in-process check answers a second request with the running
+    job; the database lock taken by ingestion_logic covers other workers and
+    the scripts, and fails a job that finds it held.
+    """
+
+    def __init__(self, session_factory: Callable[[], Session]):
+        self.session_factory = session_factory
+        self._lock = threading.Lock()
+        self._jobs: Dict[str, IngestionJob] = {}
+
+    def start(self, force: bool = False) -> IngestionJob:
+        with self._lock:
+            for job in self._jobs.values():
+                if not job.finished:
+                    raise JobAlreadyRunning(job)
+            job = IngestionJob(force)
+            self._jobs[job.id] = job
+            finished = [j for j in self._jobs.values() if j.finished]
+            for old in finished[:max(len(finished) - MAX_FINISHED_JOBS, 0)]:
+                del self._jobs[old.id]
+        threading.Thread(target=self._run, args=(job,), name=f"ingestion-{job.id}", daemon=True).start()
+        return job
+
+    def get(self, job_id: str) -> Optional[IngestionJob]:
+        return self._jobs.get(job_id)
+
+    def cancel(self, job_id: str) -> Optional[IngestionJob]:
+        job = self._jobs.get(job_id)
+        if job is not None and not job.finished:
+            job._cancel.set()
+        return job
+
+    def _run(self, job: IngestionJob):
+        job.status = STATUS_RUNNING
+        job.started_at = _now()
+        db = self.session_factory()
+        try:
+            results = ingestion_logic.ingest_all(db, force=job.force, on_phase=job._on_phase, on_chunk=job._on_chunk)
+            # Committed: cancelling is no longer possible, only the in-memory swap remains.
+            job.phase = "reload"
+            job._timer.start("reload", job.rows_processed)
+            if results['terminology_version'] != terminology.version:
+                terminology.reload(db)
+            job.results = results
+            job.status = STATUS_SUCCEEDED
+            logger.info("Ingestion job %s finished: %s", job.id, results)
+        except IngestionCancelled:
+            db.rollback()
+            job.status = STATUS_CANCELLED
+            logger.info("Ingestion job %s cancelled", job.id)
+        except ingestion_logic.IngestionInProgress as e:
+            db.rollback()
+            job.error = str(e)
+            job.status = STATUS_FAILED
+            logger.warning("Ingestion job %s not started: %s", job.id, e)
+        except Exception as e:
+            db.rollback()
+            job.error = str(e)
+            job.status = STATUS_FAILED
+            logger.exception("Ingestion job %s failed", job.id)
+        finally:
+            job._timer.finish(job.rows_processed)
+            job.finished_at = _now()
+            db.close()
@@ -1,86 +1,381 @@
+"""
+Bulk ingestion engine for the NAMASTE code system and the ICD-11 concept map.
+
+Both the admin endpoint and the scripts in ingestion/ go through this module.
+CSVs are streamed in chunks into a temporary staging table (COPY on PostgreSQL,
+batched multi-row inserts elsewhere) and applied to the target table with a
+single set-based upsert, inside the caller's transaction.
+
+Every row carries a content hash, so the upsert only rewrites rows that changed,
+and every file's hash is recorded so an unchanged file is skipped outright.
+After the code system is loaded, each code's place in the hierarchy (parent,
+materialized path, depth and nested-set bounds) is recomputed and written where
+it changed. Only a new parent, path or depth counts as a change to the code
+(updated_at); bounds shifted by the renumbering are rewritten without it.
+"""
 import csv
+import datetime
+import hashlib
+import io
+import itertools
 import os
+from typing import Any, Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+
+from sqlalchemy import Column, Integer, MetaData, Table, and_, bindparam, func, select, text, true
+from sqlalchemy.engine import Connection
+from sqlalchemy.exc import OperationalError
 from sqlalchemy.orm import Session
-from . import models
 
-def ingest_namaste_codes(db: Session):
+from . import models, terminology
+from .hierarchy import Hierarchy
+
+DATA_DIR = os.path.join(os.path.dirname(__file__), '..', 'data')
+NAMASTE_CSV_PATH = os.path.join(DATA_DIR, 'NAMASTE.csv')
+CONCEPT_MAP_CSV_PATH = os.path.join(DATA_DIR, 'ayurveda_icd_match.csv')
+
+CHUNK_SIZE = int(os.getenv("INGEST_CHUNK_SIZE", "5000"))
+
+# Called after every staged chunk with the running stats; may raise to abort the load.
+ChunkCallback = Callable[[Dict[str, int]], None]
+
+# 'relatedto' is a safer, more technically correct default than 'equivalent'.
+DEFAULT_EQUIVALENCE = 'relatedto'
+
+NAMASTE_COLUMNS = ('code', 'term', 'term_diacritical', 'term_devanagari', 'short_definition')
+HIERARCHY_COLUMNS = ('parent_code', 'path', 'depth', 'lft', 'rgt')
+# The leading HIERARCHY_COLUMNS that place a code in the tree; the nested-set bounds follow.
+PLACE_COLUMNS = 3
+CONCEPT_MAP_COLUMNS = ('source_code', 'target_code', 'target_display', 'equivalence', 'rank', 'similarity_score')
+
+
+# Held for the whole ingestion transaction on PostgreSQL; any constant shared by every process works.
+INGESTION_LOCK_ID = 0x696e6773
+
+
+class IngestionInProgress(Exception):
+    """Another process (a worker or a script in ingestion/) is already loading the terminology."""
+
+
+def _lock_ingestion(db: Session):
     """
-    Populates the namaste_codesystem table from NAMASTE.csv using SQLAlchemy.
+    Makes the caller's transaction the only ingestion running against the
+    database, across processes; released when it commits or rolls back.
+    Raises IngestionInProgress instead of waiting.
     """
-    CSV_FILE_PATH = os.path.join(os.path.dirname(__file__), '..', 'data', 'NAMASTE.csv')
-    if not os.path.exists(CSV_FILE_PATH):
-        raise FileNotFoundError(f"NAMASTE.csv not found at {CSV_FILE_PATH}")
+    conn = db.connection()
+    if conn.dialect.name == "postgresql":
+        if not conn.scalar(text("SELECT pg_try_advisory_xact_lock(:id)"), {"id": INGESTION_LOCK_ID}):
+            raise IngestionInProgress("Another ingestion is already running")
+    elif conn.dialect.name == "sqlite":
+        # SQLite has a single writer: take the write lock now rather than at the first upsert.
+        try:
+            conn.exec_driver_sql("BEGIN IMMEDIATE")
+        except OperationalError as e:
+            raise IngestionInProgress("Another ingestion is already running") from e
 
-    inserted_rows = 0
-    with open(CSV_FILE_PATH, 'r', encoding='utf-8') as f:
+
+# --- CSV streaming ---
+
+def _read_chunks(path: str, parse_row: Callable[[Dict[str, str]], Optional[tuple]], stats: Dict[str, int],
+                 on_chunk: Optional[ChunkCallback] = None) -> Iterator[List[tuple]]:
+    """Yields lists of (line_no, *values, row_hash) tuples; rows parse_row rejects are only counted."""
+    if not os.path.exists(path):
+        raise FileNotFoundError(f"{os.path.basename(path)} not found at {path}")
+    with open(path, 'r', encoding='utf-8', newline='') as f:
         reader = csv.DictReader(f)
-        for row in reader:
-            code = row.get('NAMC_CODE', '').strip()
-            if not code:
-                continue
-            
-            # Check if the code already exists
-            exists = db.query(models.NamasteCode).filter(models.NamasteCode.code == code).first()
-            if not exists:
-                db_record = models.NamasteCode(
-                    code=code,
-                    term=row.get('NAMC_term', '').strip(),
-                    short_definition=row.get('short_definition', '').strip()
-                )
-                db.add(db_record)
-                inserted_rows += 1
-    
+        # Some NAMASTE headers carry stray spaces ("  NAMC _term_DEVANAGARI").
+        reader.fieldnames = [name.strip() for name in reader.fieldnames]
+        numbered = enumerate(reader, start=2)
+        while True:
+            batch = list(itertools.islice(numbered, CHUNK_SIZE))
+            if not batch:
+                return
+            chunk = []
+            for line_no, row in batch:
+                values = parse_row(row)
+                if values is None:
+                    stats['rejected'] += 1
+                else:
+                    chunk.append((line_no,) + values + (row_hash(values),))
+            stats['rows'] += len(batch)
+            if chunk:
+                yield chunk
+            if on_chunk is not None:
+                on_chunk(stats)
+
+
+def row_hash(values: Sequence[Any]) -> str:
+    return hashlib.sha1("\x1f".join('' if value is None else str(value) for value in values).encode('utf-8')).hexdigest()
+
+
+def file_hash(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _namaste_row(row: Dict[str, str]) -> Optional[tuple]:
+    code = (row.get('NAMC_CODE') or '').strip()
+    if not code:
+        return None
+    return (
+        code,
+        (row.get('NAMC_term') or '').strip(),
+        (row.get('NAMC _term_diacritical') or '').strip(),
+        (row.get('NAMC _term_DEVANAGARI') or '').strip(),
+        (row.get('short_definition') or '').strip()
+    )
+
+
+def _concept_map_row(row: Dict[str, str]) -> Optional[tuple]:
+    source_code = (row.get('ayurveda_code') or '').strip()
+    target_code = (row.get('icd_code') or '').strip()
+    if not source_code or not target_code:
+        return None
+    try:
+        rank = int(row['rank']) if (row.get('rank') or '').strip() else None
+        score = float(row['similarity_score']) if (row.get('similarity_score') or '').strip() else None
+    except ValueError:
+        return None
+    return (source_code, target_code, (row.get('icd_title') or '').strip(), DEFAULT_EQUIVALENCE, rank, score)
+
+
+# --- Staging ---
+
+def _staging_table(name: str, target: Table, columns: Sequence[str]) -> Table:
+    return Table(
+        name, MetaData(),
+        Column('line_no', Integer, nullable=False),
+        *(Column(column, target.c[column].type) for column in columns),
+        prefixes=['TEMPORARY']
+    )
+
+
+def _copy_rows(conn: Connection, table: Table, rows: List[tuple]):
+    """Streams rows into a PostgreSQL table with COPY, under psycopg2 or psycopg 3."""
+    columns = ', '.join(column.name for column in table.columns)
+    sql = f"COPY {table.name} ({columns}) FROM STDIN WITH (FORMAT csv)"
+    cursor = conn.connection.dbapi_connection.cursor()
+    try:
+        if hasattr(cursor, 'copy_expert'):
+            buffer = io.StringIO()
+            csv.writer(buffer).writerows(rows)
+            buffer.seek(0)
+            cursor.copy_expert(sql, buffer)
+        else:
+            with cursor.copy(sql) as copy:
+                for row in rows:
+                    copy.write_row(row)
+    finally:
+        cursor.close()
+
+
+def _load_staging(conn: Connection, table: Table, chunks: Iterator[List[tuple]]):
+    names = [column.name for column in table.columns]
+    for chunk in chunks:
+        if conn.dialect.name == 'postgresql':
+            _copy_rows(conn, table, chunk)
+        else:
+            conn.execute(table.insert(), [dict(zip(names, row)) for row in chunk])
+
+
+def _dialect_insert(conn: Connection):
+    if conn.dialect.name == 'postgresql':
+        from sqlalchemy.dialects.postgresql import insert
+    else:
+        from sqlalchemy.dialects.sqlite import insert
+    return insert
+
+
+def _latest_per_key(staging: Table, keys: Sequence[str]):
+    """Rows of the staging table, keeping only the last CSV line for each key."""
+    latest = select(func.max(staging.c.line_no)).group_by(*(staging.c[key] for key in keys))
+    return staging.c.line_no.in_(latest)
+
+
+def _apply_upsert(conn: Connection, staging: Table, target: Table, keys: Sequence[str], columns: Sequence[str], source_filter) -> Tuple[int, int, int]:
+    """Upserts the deduplicated staging rows into target; returns (inserted, updated, unchanged)."""
+    selected = select(*(staging.c[column] for column in columns), func.now().label('updated_at')).where(_latest_per_key(staging, keys), source_filter)
+    incoming = selected.subquery()
+    joined = incoming.join(target, and_(*(target.c[key] == incoming.c[key] for key in keys)))
+
+    total = conn.scalar(select(func.count()).select_from(incoming))
+    existing = conn.scalar(select(func.count()).select_from(joined))
+    updated = conn.scalar(
+        select(func.count()).select_from(joined).where(target.c.row_hash.is_distinct_from(incoming.c.row_hash))
+    )
+
+    statement = _dialect_insert(conn)(target).from_select(list(columns) + ['updated_at'], selected)
+    # Rows whose content hash is unchanged are left alone, so a rerun rewrites only what changed
+    # and updated_at marks exactly the rows an incremental export has to pick up.
+    statement = statement.on_conflict_do_update(
+        index_elements=[target.c[key] for key in keys],
+        set_={column: statement.excluded[column] for column in columns + ('updated_at',) if column not in keys},
+        where=target.c.row_hash.is_distinct_from(statement.excluded.row_hash)
+    )
+    conn.execute(statement)
+    return total - existing, updated, existing - updated
+
+
+def _prune_stale(conn: Connection, staging: Table, target: Table, keys: Sequence[str], group: str, source_filter) -> int:
+    """
+    Deletes target rows of every group present in the file (e.g. every source code)
+    whose key no longer appears in it, so dropped candidates do not linger.
+    """
+    present = select(staging.c[group]).where(source_filter)
+    still_listed = select(staging.c.line_no).where(source_filter, *(staging.c[key] == target.c[key] for key in keys)).exists()
+    return conn.execute(target.delete().where(target.c[group].in_(present), ~still_listed)).rowcount
+
+
+def _ingest(db: Session, path: str, parse_row, target: Table, keys: Sequence[str], columns: Sequence[str],
+            source_filter=None, prune_group: Optional[str] = None, on_chunk: Optional[ChunkCallback] = None) -> Dict[str, int]:
+    stats = {'rows': 0, 'inserted': 0, 'updated': 0, 'unchanged': 0, 'removed': 0, 'rejected': 0}
+    columns = tuple(columns) + ('row_hash',)
+    conn = db.connection()
+    staging = _staging_table(f"staging_{target.name}", target, columns)
+    # The staging table is created inside the caller's transaction, so a failed
+    # or cancelled load is rolled back together with it.
+    staging.create(conn)
+    _load_staging(conn, staging, _read_chunks(path, parse_row, stats, on_chunk))
+    if source_filter is not None:
+        stats['rejected'] += conn.scalar(
+            select(func.count()).select_from(staging).where(_latest_per_key(staging, keys), ~source_filter(staging))
+        )
+    accepted = source_filter(staging) if source_filter is not None else true()
+    stats['inserted'], stats['updated'], stats['unchanged'] = _apply_upsert(conn, staging, target, keys, columns, accepted)
+    if prune_group is not None:
+        stats['removed'] = _prune_stale(conn, staging, target, keys, prune_group, accepted)
+    staging.drop(conn)
+    return stats
+
+
+def _apply_hierarchy(conn: Connection) -> int:
+    """Recomputes every code's place in the hierarchy; returns how many rows it changed."""
+    table = models.NamasteCode.__table__
+    stored = {row[0]: tuple(row[1:]) for row in conn.execute(select(table.c.code, *(table.c[c] for c in HIERARCHY_COLUMNS)))}
+    # One new code shifts the nested-set bounds of everything after it, so the whole tree is renumbered.
+    moved, renumbered = [], []
+    for row in Hierarchy(stored).rows():
+        if stored[row[0]] != row[1:]:
+            placed = stored[row[0]][:PLACE_COLUMNS] == row[1:PLACE_COLUMNS + 1]
+            (renumbered if placed else moved).append(dict(zip(('code_key',) + HIERARCHY_COLUMNS, row)))
+    statement = table.update().where(table.c.code == bindparam('code_key'))
+    if moved:
+        # The transaction's now(), like the upsert, so incremental exports see one time per load.
+        conn.execute(statement.values(updated_at=func.now()), moved)
+    if renumbered:
+        # Bounds alone are bookkeeping: they are exported with the hierarchy, not as a change to the code.
+        conn.execute(statement, renumbered)
+    return len(moved) + len(renumbered)
+
+
+def _load_namaste_codes(db: Session, path: str, on_chunk: Optional[ChunkCallback] = None) -> Dict[str, int]:
+    stats = _ingest(db, path, _namaste_row, models.NamasteCode.__table__, ('code',), NAMASTE_COLUMNS, on_chunk=on_chunk)
+    stats['hierarchy_updated'] = _apply_hierarchy(db.connection())
+    return stats
+
+
+def _load_concept_map(db: Session, path: str, on_chunk: Optional[ChunkCallback] = None) -> Dict[str, int]:
+    codes = models.NamasteCode.__table__
+    # Every ranked candidate is kept: a mapping is identified by its source and target codes.
+    return _ingest(
+        db, path, _concept_map_row, models.ConceptMap.__table__, ('source_code', 'target_code'), CONCEPT_MAP_COLUMNS,
+        source_filter=lambda staging: staging.c.source_code.in_(select(codes.c.code)),
+        prune_group='source_code', on_chunk=on_chunk
+    )
+
+
+def _recorded_file_hash(db: Session, name: str) -> Optional[str]:
+    state = db.get(models.IngestionFileState, name)
+    return state.sha256 if state else None
+
+
+def _record_file_hash(db: Session, name: str, digest: str):
+    state = db.get(models.IngestionFileState, name)
+    if state is None:
+        state = models.IngestionFileState(file_name=name)
+        db.add(state)
+    state.sha256 = digest
+    state.ingested_at = datetime.datetime.now(datetime.timezone.utc)
+
+
+def _commit_version(db: Session, stats: Dict[str, Any]):
+    """
+    Stamps the terminology version in the load's transaction and commits, then
+    reloads the in-memory views; the reload writes the snapshot that running
+    workers poll, so they serve the new load without a restart.
+    """
+    stats['terminology_version'] = terminology.stamp_version(db)
     db.commit()
-    return inserted_rows
+    if stats['terminology_version'] != terminology.version:
+        terminology.reload(db)
 
-def ingest_concept_map(db: Session):
+
+# --- Public entry points ---
+
+def ingest_namaste_codes(db: Session, path: str = NAMASTE_CSV_PATH) -> Dict[str, Any]:
     """
-    Populates the concept_map table from ayurveda_icd_match.csv using SQLAlchemy.
+    Loads NAMASTE.csv into namaste_codesystem, renumbers the hierarchy, stamps a
+    terminology version, commits and reloads the in-memory views. Returns row,
+    inserted, updated, unchanged, rejected and hierarchy_updated counts and the
+    terminology_version.
     """
-    CSV_FILE_PATH = os.path.join(os.path.dirname(__file__), '..', 'data', 'ayurveda_icd_match.csv')
-    if not os.path.exists(CSV_FILE_PATH):
-        raise FileNotFoundError(f"ayurveda_icd_match.csv not found at {CSV_FILE_PATH}")
-
-    inserted_rows = 0
-    updated_rows = 0
-    skipped_rows = 0
-    
-    # Pre-fetch all existing NAMASTE codes for faster foreign key checks
-    namaste_codes = {code[0] for code in db.query(models.NamasteCode.code).all()}
-
-    with open(CSV_FILE_PATH, 'r', encoding='utf-8') as f:
-        reader = csv.DictReader(f)
-        for row in reader:
-            source_code = row.get('ayurveda_code', '').strip()
-            target_code = row.get('icd_code', '').strip()
-            if not source_code or not target_code:
-                skipped_rows += 1
-                continue
-
-            # Foreign key check
-            if source_code not in namaste_codes:
-                skipped_rows += 1
-                continue
-
-            # Check if a map for the source_code already exists
-            existing_map = db.query(models.ConceptMap).filter(models.ConceptMap.source_code == source_code).first()
-            
-            if existing_map:
-                # Update existing map
-                existing_map.target_code = row.get('icd_code', '').strip()
-                existing_map.target_display = row.get('icd_title', '').strip()
-                existing_map.equivalence = 'relatedto'
-                updated_rows += 1
-            else:
-                # Insert new map
-                db_record = models.ConceptMap(
-                    source_code=source_code,
-                    target_code=row.get('icd_code', '').strip(),
-                    target_display=row.get('icd_title', '').strip(),
-                    equivalence='relatedto'
-                )
-                db.add(db_record)
-                inserted_rows += 1
+    _lock_ingestion(db)
+    stats: Dict[str, Any] = _load_namaste_codes(db, path)
+    _record_file_hash(db, os.path.basename(path), file_hash(path))
+    _commit_version(db, stats)
+    return stats
+
+
+def ingest_concept_map(db: Session, path: str = CONCEPT_MAP_CSV_PATH) -> Dict[str, Any]:
+    """
+    Loads ayurveda_icd_match.csv into concept_map, one row per ranked candidate,
+    stamps a terminology version, commits and reloads the concept map cache.
+    Rows without both codes, or whose source code is not in namaste_codesystem,
+    are rejected; candidates no longer listed for a source code are removed.
+    """
+    _lock_ingestion(db)
+    stats: Dict[str, Any] = _load_concept_map(db, path)
+    _record_file_hash(db, os.path.basename(path), file_hash(path))
+    _commit_version(db, stats)
+    return stats
+
+
+def ingest_all(db: Session, force: bool = False, on_phase: Optional[Callable[[str], None]] = None,
+               on_chunk: Optional[ChunkCallback] = None) -> Dict[str, Any]:
+    """
+    Loads both CSVs in one transaction and stamps a new terminology version.
+
+    A file whose hash matches the last successful load is skipped unless `force`
+    is set. The concept map is reloaded whenever the code system changed, since
+    rows it rejected before may now have a valid source code. Nothing is visible
+    to readers until the single commit at the end. Raises IngestionInProgress
+    when another process is ingesting.
+    """
+    _lock_ingestion(db)
+    results: Dict[str, Any] = {}
+    namaste_changed = False
+    for name, path, load in (('namaste_codes', NAMASTE_CSV_PATH, _load_namaste_codes),
+                             ('concept_map', CONCEPT_MAP_CSV_PATH, _load_concept_map)):
+        if on_phase is not None:
+            on_phase(name)
+        digest = file_hash(path)
+        file_name = os.path.basename(path)
+        if not force and not namaste_changed and _recorded_file_hash(db, file_name) == digest:
+            results[name] = {'skipped': True}
+            continue
+        results[name] = load(db, path, on_chunk)
+        _record_file_hash(db, file_name, digest)
+        namaste_changed = namaste_changed or name == 'namaste_codes'
 
+    if all(result.get('skipped') for result in results.values()):
+        db.rollback()
+        results['terminology_version'] = terminology.current_version(db)
+        return results
+    if on_phase is not None:
+        on_phase('stamp_version')
+    results['terminology_version'] = terminology.stamp_version(db)
     db.commit()
-    return {"inserted": inserted_rows, "updated": updated_rows, "skipped": skipped_rows}
+    return results
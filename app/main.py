@@ -1,64 +1,119 @@
-from fastapi import FastAPI, Depends, HTTPException, Request
-from fastapi.responses import RedirectResponse
-from sqlalchemy.orm import Session
-from sqlalchemy import or_
-from typing import List, Dict, Any
+from fastapi import FastAPI, Depends, HTTPException, Request, Response, Query, Body
+from fastapi.responses import RedirectResponse, StreamingResponse
+from sqlalchemy import insert
+from sqlalchemy.ext.asyncio import AsyncSession
+from typing import List, Dict, Any, Optional
+from contextlib import asynccontextmanager
+from fastapi.concurrency import run_in_threadpool
 from fastapi.middleware.cors import CORSMiddleware
-from starlette.middleware.sessions import SessionMiddleware
+import asyncio
+import itertools
+import logging
 import uuid
 import os
-import httpx
-import jwt
 import datetime
+import jwt
 
-from . import models, schemas
-from .database import engine, get_db
+from . import models, migrations, schemas, terminology, http_cache, fhir, http_client, emr_outbox, diagnosis_history, suggest, metrics, sessions, analytics, bulk_export
+from .database import engine, get_async_db, SessionLocal, AsyncSessionLocal, async_engine, pool_status
+from .fragments import FastJSONResponse
+from .search_index import fold
+
+logger = logging.getLogger(__name__)
 
 # --- OAuth & App Configuration ---
 ABHA_SERVER_URL = os.getenv("ABHA_SERVER_URL", "http://127.0.0.1:8001")
 CLIENT_ID = "accura_emr_client"
 CLIENT_SECRET = "accura_emr_secret"
-APP_SECRET_KEY = os.getenv("APP_SECRET_KEY", "a_very_secret_key_for_sessions")
 BACKEND_BASE_URL = os.getenv("BACKEND_BASE_URL", "http://localhost:8000")
 FRONTEND_BASE_URL = os.getenv("FRONTEND_BASE_URL", "https://sih-frontend-nu.vercel.app")
 
 PATIENT_CLIENT_REDIRECT_URI = f"{FRONTEND_BASE_URL}/consent/callback"
 FRONTEND_CONSENT_SUCCESS_URI = f"{FRONTEND_BASE_URL}/add-patient/success"
-MOCK_FHIR_ENDPOINT = f"{ABHA_SERVER_URL}/fhir/bundle"
-
-models.Base.metadata.create_all(bind=engine)
+MOCK_FHIR_ENDPOINT = os.getenv("FHIR_BUNDLE_ENDPOINT", f"{ABHA_SERVER_URL}/fhir/bundle")
+
+SEARCH_DEFAULT_LIMIT = int(os.getenv("SEARCH_DEFAULT_LIMIT", "15"))
+SEARCH_MAX_LIMIT = int(os.getenv("SEARCH_MAX_LIMIT", "100"))
+AUTOCOMPLETE_DEFAULT_LIMIT = int(os.getenv("AUTOCOMPLETE_DEFAULT_LIMIT", "10"))
+AUTOCOMPLETE_MAX_LIMIT = int(os.getenv("AUTOCOMPLETE_MAX_LIMIT", "50"))
+TRANSLATE_BATCH_MAX = int(os.getenv("TRANSLATE_BATCH_MAX", "5000"))
+DIAGNOSIS_BATCH_MAX = int(os.getenv("DIAGNOSIS_BATCH_MAX", "1000"))
+HISTORY_DEFAULT_LIMIT = int(os.getenv("HISTORY_DEFAULT_LIMIT", "50"))
+HISTORY_MAX_LIMIT = int(os.getenv("HISTORY_MAX_LIMIT", "500"))
+HISTORY_STREAM_BATCH = int(os.getenv("HISTORY_STREAM_BATCH", "500"))
+EXPAND_DEFAULT_COUNT = int(os.getenv("EXPAND_DEFAULT_COUNT", "100"))
+EXPAND_MAX_COUNT = int(os.getenv("EXPAND_MAX_COUNT", "1000"))
+ANALYTICS_MAX_DAYS = int(os.getenv("ANALYTICS_MAX_DAYS", "366"))
+
+# Creates missing tables and brings tables created by earlier releases up to the models.
+migrations.upgrade(engine)
+
+outbox_dispatcher = emr_outbox.OutboxDispatcher(AsyncSessionLocal, MOCK_FHIR_ENDPOINT, http_client.get_client)
+session_store = sessions.make_store(AsyncSessionLocal)
+
+async def _watch_snapshot():
+    """Picks up terminology snapshots written by another worker's ingestion."""
+    while True:
+        await asyncio.sleep(terminology.SNAPSHOT_POLL_SECONDS)
+        try:
+            await run_in_threadpool(terminology.refresh_from_snapshot, SessionLocal)
+        except Exception:
+            logger.exception("Terminology snapshot refresh failed")
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Build the in-memory terminology indexes before serving traffic, from the snapshot when it is current.
+    db = SessionLocal()
+    try:
+        terminology.load(db)
+    finally:
+        db.close()
+    await http_client.start()
+    await outbox_dispatcher.start()
+    snapshot_watcher = asyncio.create_task(_watch_snapshot())
+    session_evictor = asyncio.create_task(sessions.evict_forever(session_store))
+    yield
+    session_evictor.cancel()
+    snapshot_watcher.cancel()
+    await outbox_dispatcher.stop()
+    await http_client.stop()
+    await async_engine.dispose()
 
 app = FastAPI(
     title="Accura Terminology Service",
     description="A FHIR-compliant microservice for mapping NAMASTE and ICD-11 terminologies.",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan
 )
 
-app.add_middleware(SessionMiddleware, secret_key=APP_SECRET_KEY, same_site='lax', https_only=True)
+# The session cookie holds only an opaque id; routes load the session with Depends(sessions.get_session).
+app.add_middleware(sessions.ServerSessionMiddleware, store=session_store, same_site='lax', https_only=True)
+app.add_middleware(metrics.MetricsMiddleware)
 app.add_middleware(
     CORSMiddleware,
     allow_origins=[FRONTEND_BASE_URL, "http://localhost:5173"],
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["ETag", "Link", "X-Next-Cursor", "X-Transaction-Time"],
 )
 
 # --- Authentication Endpoints ---
 
 @app.get("/auth/login", tags=["Authentication"])
-def auth_login(request: Request):
+async def auth_login(session: sessions.ServerSession = Depends(sessions.get_session)):
     state = str(uuid.uuid4())
-    request.session["oauth_state"] = state
+    session["oauth_state"] = state
     redirect_uri = f"{FRONTEND_BASE_URL}/auth/callback"
     auth_url = f"{ABHA_SERVER_URL}/authorize?client_id={CLIENT_ID}&redirect_uri={redirect_uri}&state={state}"
     return RedirectResponse(url=auth_url)
 
 @app.get("/auth/callback", tags=["Authentication"])
-async def auth_callback(request: Request, code: str, state: str):
-    if state != request.session.get("oauth_state"):
+async def auth_callback(code: str, state: str, session: sessions.ServerSession = Depends(sessions.get_session)):
+    # OAuth state is single use.
+    if state != session.pop("oauth_state", None):
         raise HTTPException(status_code=400, detail="Invalid state parameter")
-    async with httpx.AsyncClient() as client:
-        token_response = await client.post(f"{ABHA_SERVER_URL}/token", data={"code": code})
+    token_response = await http_client.get_client().post(f"{ABHA_SERVER_URL}/token", data={"code": code})
     if token_response.status_code != 200:
         raise HTTPException(status_code=400, detail="Failed to retrieve access token")
     token_data = token_response.json()
@@ -71,34 +126,35 @@ async def auth_callback(request: Request, code: str, state: str):
             raise HTTPException(status_code=400, detail="Invalid token: no sub claim")
     except jwt.PyJWTError:
         raise HTTPException(status_code=400, detail="Invalid token: could not decode")
-    request.session["user_id"] = user_id
-    request.session["user_name"] = user_name
+    # A new session id on sign-in, so an id obtained before it cannot be fixed on the user.
+    session.regenerate()
+    session["user_id"] = user_id
+    session["user_name"] = user_name
     return RedirectResponse(url=f"{FRONTEND_BASE_URL}/dashboard")
 
 # --- Patient Consent Endpoints ---
 
 @app.get("/consent/ask-patient", tags=["Patient Consent"])
-def consent_ask_patient(request: Request):
+async def consent_ask_patient(session: sessions.ServerSession = Depends(sessions.get_session)):
     state = str(uuid.uuid4())
-    request.session["oauth_state"] = state
+    session["oauth_state"] = state
     auth_url = f"{ABHA_SERVER_URL}/authorize?client_id={CLIENT_ID}&redirect_uri={PATIENT_CLIENT_REDIRECT_URI}&scope=patient_consent&state={state}"
     return RedirectResponse(url=auth_url)
 
 @app.get("/consent/callback", tags=["Patient Consent"])
-async def consent_callback(request: Request, code: str, state: str):
-    if state != request.session.get("oauth_state"):
+async def consent_callback(code: str, state: str, session: sessions.ServerSession = Depends(sessions.get_session)):
+    if state != session.pop("oauth_state", None):
         raise HTTPException(status_code=400, detail="Invalid state parameter")
-    async with httpx.AsyncClient() as client:
-        token_response = await client.post(f"{ABHA_SERVER_URL}/token", data={"code": code})
+    token_response = await http_client.get_client().post(f"{ABHA_SERVER_URL}/token", data={"code": code})
     if token_response.status_code != 200:
         raise HTTPException(status_code=400, detail="Failed to retrieve patient token")
     token_data = token_response.json()
-    request.session['consented_patient_token'] = token_data["access_token"]
+    session['consented_patient_token'] = token_data["access_token"]
     return RedirectResponse(url=FRONTEND_CONSENT_SUCCESS_URI)
 
 @app.get("/api/consent/details", tags=["Consent"])
-async def get_consent_details(request: Request):
-    token = request.session.get("consented_patient_token")
+async def get_consent_details(session: sessions.ServerSession = Depends(sessions.get_session)):
+    token = session.get("consented_patient_token")
     if not token:
         raise HTTPException(status_code=404, detail="No token found.")
     return {"access_token": token}
@@ -106,104 +162,456 @@ async def get_consent_details(request: Request):
 # --- Diagnosis & EMR Endpoints ---
 
 @app.post("/diagnosis/confirm", status_code=201, tags=["Diagnosis"])
-async def confirm_diagnosis(diag_request: schemas.ConfirmDiagnosisRequest, db: Session = Depends(get_db), request: Request = None):
-    doctor_id = request.session.get("user_id")
+async def confirm_diagnosis(diag_request: schemas.ConfirmDiagnosisRequest, db: AsyncSession = Depends(get_async_db), session: sessions.ServerSession = Depends(sessions.get_session)):
+    doctor_id = session.get("user_id")
     if not doctor_id:
         raise HTTPException(status_code=401, detail="Not authenticated")
 
-    mapping = db.query(models.ConceptMap).filter(models.ConceptMap.source_code == diag_request.namaste_code).first()
+    mapping = await terminology.concept_maps.get(db, diag_request.namaste_code)
     if not mapping:
         raise HTTPException(status_code=404, detail=f"Mapping not found for NAMASTE code: {diag_request.namaste_code}")
 
-    fhir_bundle = {
-        "resourceType": "Bundle", "type": "transaction", "timestamp": datetime.datetime.utcnow().isoformat() + "Z",
-        "entry": [
-            {"fullUrl": f"urn:uuid:{uuid.uuid4()}", "resource": {"resourceType": "Encounter", "status": "finished", "class": {"system": "http://terminology.hl7.org/CodeSystem/v3-ActCode", "code": "AMB", "display": "ambulatory"}, "subject": {"reference": f"Patient/{diag_request.patient_id}"}, "participant": [{"individual": {"reference": f"Practitioner/{doctor_id}"}}]}, "request": {"method": "POST", "url": "Encounter"}},
-            {"fullUrl": f"urn:uuid:{uuid.uuid4()}", "resource": {"resourceType": "Condition", "subject": {"reference": f"Patient/{diag_request.patient_id}"}, "code": {"text": mapping.target_display, "coding": [{"system": "NAMASTE", "code": mapping.source_code, "display": mapping.target_display}, {"system": "http://id.who.int/icd/release/11/mms", "code": mapping.target_code, "display": mapping.target_display}]}}, "request": {"method": "POST", "url": "Condition"}}
-        ]
-    }
-
-    async with httpx.AsyncClient() as client:
-        response = await client.post(MOCK_FHIR_ENDPOINT, json=fhir_bundle)
-        if response.status_code != 201:
-            raise HTTPException(status_code=502, detail="Failed to save bundle to mock EMR.")
-
+    # The EMR bundle is queued in the same transaction as the log entry and sent by the outbox dispatcher.
     log_entry = models.DiagnosisRecord(patient_id=diag_request.patient_id, doctor_id=doctor_id, namaste_code=mapping.source_code, namaste_term=mapping.target_display, icd_code=mapping.target_code, icd_display=mapping.target_display)
     db.add(log_entry)
-    db.commit()
+    emr_outbox.enqueue(db, fhir.diagnosis_entries(diag_request.patient_id, doctor_id, [mapping]))
+    await analytics.record_confirmed(db, doctor_id, [(mapping.source_code, mapping.target_code)])
+    await db.commit()
+    outbox_dispatcher.notify()
 
-    return {"status": "success", "message": "Diagnosis confirmed and logged."}
+    return {"status": "success", "message": "Diagnosis confirmed and queued for EMR submission."}
+
+@app.post("/diagnosis/confirm/batch", response_model=schemas.BatchConfirmDiagnosisResponse, tags=["Diagnosis"])
+async def confirm_diagnoses_batch(batch: schemas.BatchConfirmDiagnosisRequest, db: AsyncSession = Depends(get_async_db), session: sessions.ServerSession = Depends(sessions.get_session)):
+    """
+    Confirms many (patient_id, namaste_code) pairs at once. Mappings are resolved in
+    one lookup, every log row is written by one bulk insert, and each patient's
+    diagnoses are queued as a single Encounter with its Conditions. Items whose code
+    has no mapping are reported individually and do not fail the batch.
+    """
+    doctor_id = session.get("user_id")
+    if not doctor_id:
+        raise HTTPException(status_code=401, detail="Not authenticated")
+    if len(batch.items) > DIAGNOSIS_BATCH_MAX:
+        raise HTTPException(status_code=413, detail=f"At most {DIAGNOSIS_BATCH_MAX} diagnoses per batch.")
+
+    mappings = await terminology.concept_maps.get_many(db, [item.namaste_code for item in batch.items])
+    results, log_rows, per_patient = [], [], {}
+    for index, item in enumerate(batch.items):
+        mapping = mappings[item.namaste_code]
+        if not mapping:
+            results.append({"index": index, "patient_id": item.patient_id, "namaste_code": item.namaste_code, "status": "not_found", "detail": f"Mapping not found for NAMASTE code: {item.namaste_code}"})
+            continue
+        results.append({"index": index, "patient_id": item.patient_id, "namaste_code": item.namaste_code, "status": "confirmed"})
+        log_rows.append({"patient_id": item.patient_id, "doctor_id": doctor_id, "namaste_code": mapping.source_code, "namaste_term": mapping.target_display, "icd_code": mapping.target_code, "icd_display": mapping.target_display})
+        per_patient.setdefault(item.patient_id, []).append(mapping)
+
+    if log_rows:
+        await db.execute(insert(models.DiagnosisRecord), log_rows)
+        for patient_id, patient_mappings in per_patient.items():
+            emr_outbox.enqueue(db, fhir.diagnosis_entries(patient_id, doctor_id, patient_mappings))
+        await analytics.record_confirmed(db, doctor_id, [(row["namaste_code"], row["icd_code"]) for row in log_rows])
+        await db.commit()
+        outbox_dispatcher.notify()
+
+    return {"confirmed": len(log_rows), "failed": len(results) - len(log_rows), "results": results}
 
 @app.get("/diagnosis/history/{patient_id}", response_model=List[schemas.DiagnosisRecordResponse], tags=["Diagnosis"])
-def get_diagnosis_history(patient_id: str, db: Session = Depends(get_db)):
-    history = db.query(models.DiagnosisRecord).filter(models.DiagnosisRecord.patient_id == patient_id).order_by(models.DiagnosisRecord.timestamp.desc()).all()
-    return history
+async def get_diagnosis_history(
+    patient_id: str, request: Request, response: Response,
+    limit: Optional[int] = Query(None, ge=1, le=HISTORY_MAX_LIMIT), cursor: Optional[str] = None,
+    since: Optional[datetime.datetime] = None, until: Optional[datetime.datetime] = None,
+    namaste_code: Optional[str] = None, icd_code: Optional[str] = None,
+    format: str = Query("json", pattern="^(json|ndjson)$"),
+    db: AsyncSession = Depends(get_async_db)
+):
+    """
+    Returns the patient's diagnoses newest first, one page at a time. The next page
+    is requested with the cursor from the X-Next-Cursor/Link headers. With
+    format=ndjson (or Accept: application/x-ndjson) every matching record from the
+    cursor onwards is streamed instead, unless a limit is given.
+    """
+    try:
+        after_id = diagnosis_history.decode_cursor(cursor) if cursor else None
+    except diagnosis_history.InvalidCursor as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    query = diagnosis_history.history_query(patient_id, after_id, since, until, namaste_code, icd_code)
+
+    if format == "ndjson" or "application/x-ndjson" in request.headers.get("accept", ""):
+        if limit is not None:
+            query = query.limit(limit)
+        return StreamingResponse(_stream_history(query), media_type="application/x-ndjson")
+
+    page_size = limit or HISTORY_DEFAULT_LIMIT
+    # One extra row tells whether another page exists without a COUNT.
+    records = (await db.execute(query.limit(page_size + 1))).scalars().all()
+    if len(records) > page_size:
+        records = records[:page_size]
+        next_cursor = diagnosis_history.encode_cursor(records[-1])
+        response.headers["X-Next-Cursor"] = next_cursor
+        response.headers["Link"] = f'<{request.url.include_query_params(cursor=next_cursor)}>; rel="next"'
+    return records
+
+async def _stream_history(query):
+    # The stream outlives the request's dependencies, so it holds its own session.
+    async with AsyncSessionLocal() as db:
+        result = await db.stream_scalars(query.execution_options(yield_per=HISTORY_STREAM_BATCH))
+        async for record in result:
+            yield schemas.DiagnosisRecordResponse.model_validate(record).model_dump_json() + "\n"
 
 # --- Terminology API Endpoints ---
 
 @app.get("/", tags=["Root"])
-def read_root():
+async def read_root():
     return {"message": "Welcome to the Accura Terminology Service API. Go to /docs for API documentation."}
 
-@app.get("/terminology/names-only", response_model=List[str], tags=["Terminology"])
-def get_all_namaste_names(db: Session = Depends(get_db)):
-    results = db.query(models.NamasteCode.term).all()
-    return [result[0] for result in results if result[0]]
+@app.get("/terminology/names-only", response_model=List[str], tags=["Terminology"], deprecated=True)
+async def get_all_namaste_names(request: Request):
+    # Superseded by /terminology/autocomplete; kept for clients that still filter locally.
+    # Served from a buffer serialized and compressed once per terminology version.
+    payload = terminology.payload("names-only", lambda: [row[1] for row in terminology.prefix_index.rows if row[1]])
+    return http_cache.payload_response(request, payload)
+
+@app.get("/terminology/autocomplete", response_model=List[schemas.AutocompleteSuggestion], tags=["Terminology"])
+async def autocomplete_terms(request: Request, prefix: str, limit: int = Query(AUTOCOMPLETE_DEFAULT_LIMIT, ge=1, le=AUTOCOMPLETE_MAX_LIMIT)):
+    etag = terminology.etag("autocomplete", fold(prefix).strip(), str(limit))
+    if http_cache.is_not_modified(request, etag):
+        return http_cache.not_modified(etag)
+    # Matches romanized, diacritic-folded and Devanagari forms as well as codes.
+    results = terminology.prefix_index.complete(prefix, limit)
+    return FastJSONResponse(terminology.fragments.autocomplete(results), headers=http_cache.cache_headers(etag))
 
 @app.get("/search", response_model=List[schemas.NamasteTerm], tags=["Terminology"])
-def search_terms(term: str, db: Session = Depends(get_db)):
+async def search_terms(request: Request, term: str, limit: int = Query(SEARCH_DEFAULT_LIMIT, ge=1, le=SEARCH_MAX_LIMIT)):
     if not term:
         return []
-    results = db.query(models.NamasteCode).filter(or_(models.NamasteCode.term.ilike(f"%{term}%"), models.NamasteCode.short_definition.ilike(f"%{term}%"))).limit(15).all()
-    return results
+    query = fold(term).strip()
+    etag = terminology.etag("search", query, str(limit))
+    if http_cache.is_not_modified(request, etag):
+        return http_cache.not_modified(etag)
+    # Ranked by the in-memory index: exact code, code and word prefixes, then fuzzy matches.
+    # Repeated queries are served from the result cache; concurrent identical misses share one lookup.
+    version, index, views = terminology.version, terminology.search_index, terminology.fragments
+    body = await terminology.search_results.get((version, query, limit), lambda: views.search(index.search(term, limit)))
+    return FastJSONResponse(body, headers=http_cache.cache_headers(etag))
 
 @app.post("/translate", response_model=Dict[str, Any], tags=["Terminology"])
-def translate_namaste_code(request: schemas.TranslateRequest, db: Session = Depends(get_db)):
-    mapping = db.query(models.ConceptMap).filter(models.ConceptMap.source_code == request.namaste_code).first()
-    if not mapping:
+async def translate_namaste_code(request: schemas.TranslateRequest, db: AsyncSession = Depends(get_async_db)):
+    """
+    Returns up to `top_k` ICD-11 candidates for a NAMASTE code as `match` parameters,
+    best ranked first, optionally keeping only those scoring at least `min_score`.
+    """
+    candidates = await terminology.concept_maps.candidates(db, request.namaste_code, request.top_k, request.min_score)
+    if not candidates:
         raise HTTPException(status_code=404, detail=f"Mapping not found for NAMASTE code: {request.namaste_code}")
-    fhir_parameters_response = {
-        "resourceType": "Parameters",
-        "parameter": [
-            {"name": "result", "valueBoolean": True},
-            {"name": "match", "part": [{"name": "equivalence", "valueCode": mapping.equivalence}, {"name": "concept", "valueCoding": {"system": "http://id.who.int/icd/release/11/mms", "code": mapping.target_code, "display": mapping.target_display}}]}
-        ]
-    }
-    return fhir_parameters_response
+    # Assembled from match fragments rendered once per terminology version.
+    return FastJSONResponse(terminology.fragments.translate_parameters(candidates))
+
+@app.post("/translate/batch", response_model=Dict[str, Any], tags=["Terminology"])
+async def translate_namaste_codes_batch(
+    body: Dict[str, Any] = Body(..., examples=[{"namaste_codes": ["AA", "AAA-1"]}]),
+    top_k: int = Query(1, ge=1, le=50),
+    min_score: Optional[float] = Query(None, ge=0, le=1),
+    db: AsyncSession = Depends(get_async_db)
+):
+    """
+    Translates many NAMASTE codes in one call. Accepts {"namaste_codes": [...]}, a FHIR
+    Parameters resource or a Bundle of Parameters, and returns a batch-response Bundle
+    with one Parameters entry per input code; unmapped codes get a 404 entry.
+    `top_k` and `min_score` select candidates as for /translate.
+    """
+    try:
+        codes = fhir.extract_translate_codes(body)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if len(codes) > TRANSLATE_BATCH_MAX:
+        raise HTTPException(status_code=413, detail=f"At most {TRANSLATE_BATCH_MAX} codes per batch.")
+    candidates = await terminology.concept_maps.candidates_many(db, codes, top_k, min_score)
+    return FastJSONResponse(terminology.fragments.translate_batch_bundle([(code, candidates[code]) for code in codes]))
+
+# --- FHIR Terminology Operations ---
+
+def _check_system(system: Optional[str]):
+    if system is not None and system != fhir.NAMASTE_SYSTEM:
+        raise HTTPException(status_code=404, detail=f"Unknown code system: {system}")
+
+@app.get("/fhir/CodeSystem/$lookup", response_model=Dict[str, Any], tags=["Terminology"])
+async def lookup_code(request: Request, code: str, system: Optional[str] = None):
+    """FHIR CodeSystem/$lookup: display, definition, designations and the parent and child codes of a NAMASTE code."""
+    _check_system(system)
+    row = terminology.concepts.get(code)
+    if row is None:
+        raise HTTPException(status_code=404, detail=f"Unknown NAMASTE code: {code}")
+    etag = terminology.etag("lookup", code)
+    if http_cache.is_not_modified(request, etag):
+        return http_cache.not_modified(etag)
+    hierarchy = terminology.hierarchy
+    parameters = fhir.lookup_parameters(row, terminology.version, hierarchy.parent(code), hierarchy.children(code))
+    return FastJSONResponse(parameters, headers=http_cache.cache_headers(etag))
+
+@app.get("/fhir/ValueSet/$expand", response_model=Dict[str, Any], tags=["Terminology"])
+async def expand_valueset(
+    request: Request, code: Optional[str] = None, system: Optional[str] = None, filter: Optional[str] = None,
+    offset: int = Query(0, ge=0), count: int = Query(EXPAND_DEFAULT_COUNT, ge=1, le=EXPAND_MAX_COUNT)
+):
+    """
+    FHIR ValueSet/$expand over the NAMASTE hierarchy: every descendant of `code`
+    (the whole code system without it) in hierarchy order, one page at a time.
+    A page costs time proportional to its size. With a `filter` on code or term,
+    the subtree is scanned only until the page is full, and no total is given.
+    """
+    _check_system(system)
+    hierarchy, concepts = terminology.hierarchy, terminology.concepts
+    if code is not None and code not in hierarchy:
+        raise HTTPException(status_code=404, detail=f"Unknown NAMASTE code: {code}")
+    needle = fold(filter).strip() if filter else ""
+    etag = terminology.etag("expand", code or "", needle, str(offset), str(count))
+    if http_cache.is_not_modified(request, etag):
+        return http_cache.not_modified(etag)
+
+    if needle:
+        matches = (c for c in hierarchy.iter_descendants(code) if needle in c.casefold() or needle in fold(concepts[c][1]))
+        # One extra match tells whether another page exists.
+        page = list(itertools.islice(matches, offset, offset + count + 1))
+        total, has_more = None, len(page) > count
+        page = page[:count]
+    else:
+        page = hierarchy.descendants(code, offset, count)
+        total = hierarchy.descendant_count(code)
+        has_more = offset + len(page) < total
+
+    parameters = [{"name": "offset", "valueInteger": offset}, {"name": "count", "valueInteger": count}, {"name": "version", "valueString": terminology.version}]
+    if filter:
+        parameters.append({"name": "filter", "valueString": filter})
+    identifier = f"urn:uuid:{uuid.uuid5(uuid.NAMESPACE_URL, etag)}"
+    expansion = fhir.valueset_expansion(
+        identifier, terminology.installed_at.isoformat(), offset, total, [(c, concepts[c][1]) for c in page], parameters
+    )
+    headers = http_cache.cache_headers(etag)
+    if has_more:
+        headers["Link"] = f'<{request.url.include_query_params(offset=offset + count)}>; rel="next"'
+    return FastJSONResponse(expansion, headers=headers)
+
+# --- Mapping Suggestion Endpoints ---
+
+async def _suggestion_engine():
+    if not suggest.AVAILABLE:
+        raise HTTPException(status_code=503, detail="Mapping suggestions require numpy and scipy.")
+    return await run_in_threadpool(terminology.suggester, SessionLocal)
+
+def _suggestions(candidates) -> List[Dict[str, Any]]:
+    return [{"code": c.target_code, "display": c.target_display, "score": c.score} for c in candidates]
+
+@app.get("/translate/suggestions/{namaste_code}", response_model=List[schemas.SuggestedMapping], tags=["Terminology"])
+async def suggest_mappings(namaste_code: str, top_k: int = Query(5, ge=1, le=50)):
+    """
+    Ranks the known ICD-11 titles by TF-IDF character n-gram similarity to a NAMASTE
+    term and definition. Meant for codes that /translate cannot map yet.
+    """
+    suggester = await _suggestion_engine()
+    if namaste_code not in suggester:
+        raise HTTPException(status_code=404, detail=f"Unknown NAMASTE code: {namaste_code}")
+    return _suggestions(suggester.suggest(namaste_code, top_k))
+
+@app.get("/admin/concept-map/suggestions", response_model=Dict[str, List[schemas.SuggestedMapping]], tags=["Admin"])
+async def suggest_unmapped(top_k: int = Query(3, ge=1, le=50)):
+    """Suggested ICD-11 candidates for every NAMASTE code without a concept map row, scored in one pass."""
+    suggester = await _suggestion_engine()
+    results = await run_in_threadpool(suggester.suggest_many, None, top_k)
+    return {code: _suggestions(candidates) for code, candidates in results.items()}
+
+# --- Analytics Endpoints ---
+
+def _analytics_window(since: Optional[datetime.date], until: Optional[datetime.date]):
+    try:
+        return analytics.window(since, until, ANALYTICS_MAX_DAYS)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+async def _signed_in(session: sessions.ServerSession = Depends(sessions.get_session)):
+    # Analytics break confirmations down by doctor, so they are for signed-in users only.
+    if not session.get("user_id"):
+        raise HTTPException(status_code=401, detail="Not authenticated")
+
+def _code_counts(rows, by: str = "namaste"):
+    concepts = terminology.concepts
+    return [{"code": code, "display": concepts[code][1] if by == "namaste" and code in concepts else None, "count": count} for code, count in rows]
+
+@app.get("/analytics/top-codes", response_model=List[schemas.CodeCount], tags=["Analytics"], dependencies=[Depends(_signed_in)])
+async def get_top_codes(
+    since: Optional[datetime.date] = None, until: Optional[datetime.date] = None,
+    by: str = Query("namaste", pattern="^(namaste|icd)$"), limit: int = Query(10, ge=1, le=100),
+    db: AsyncSession = Depends(get_async_db)
+):
+    """Most confirmed NAMASTE (or ICD-11) codes between two UTC days, inclusive; the last 30 days by default."""
+    since, until = _analytics_window(since, until)
+    return _code_counts(await analytics.top_codes(db, since, until, by, limit), by)
+
+@app.get("/analytics/timeseries", response_model=List[schemas.DailyCount], tags=["Analytics"], dependencies=[Depends(_signed_in)])
+async def get_diagnosis_timeseries(
+    since: Optional[datetime.date] = None, until: Optional[datetime.date] = None,
+    namaste_code: Optional[str] = None, icd_code: Optional[str] = None,
+    db: AsyncSession = Depends(get_async_db)
+):
+    """Confirmed diagnoses per UTC day, optionally for one NAMASTE and/or ICD-11 code."""
+    since, until = _analytics_window(since, until)
+    rows = await analytics.time_series(db, since, until, namaste_code, icd_code)
+    return [{"day": day, "count": count} for day, count in rows]
+
+@app.get("/analytics/doctors", response_model=List[schemas.DoctorCount], tags=["Analytics"], dependencies=[Depends(_signed_in)])
+async def get_doctor_counts(
+    since: Optional[datetime.date] = None, until: Optional[datetime.date] = None,
+    limit: int = Query(10, ge=1, le=100), db: AsyncSession = Depends(get_async_db)
+):
+    """Confirmed diagnoses per doctor, most active first."""
+    since, until = _analytics_window(since, until)
+    rows = await analytics.doctor_breakdown(db, since, until, limit=limit)
+    return [{"doctor_id": doctor_id, "count": count} for doctor_id, count in rows]
+
+@app.get("/analytics/doctors/{doctor_id}", response_model=List[schemas.CodeCount], tags=["Analytics"], dependencies=[Depends(_signed_in)])
+async def get_doctor_code_counts(
+    doctor_id: str, since: Optional[datetime.date] = None, until: Optional[datetime.date] = None,
+    limit: int = Query(10, ge=1, le=100), db: AsyncSession = Depends(get_async_db)
+):
+    """One doctor's confirmed diagnoses per NAMASTE code."""
+    since, until = _analytics_window(since, until)
+    return _code_counts(await analytics.doctor_breakdown(db, since, until, doctor_id, limit))
+
+# --- Bulk Export Endpoints ---
+
+@app.get("/export/{resource}", tags=["Export"])
+async def export_resource(request: Request, resource: str, since: Optional[datetime.datetime] = Query(None, alias="_since")):
+    """
+    Streams every row of namaste-codes, namaste-hierarchy, concept-map or
+    diagnosis-log as NDJSON, gzipped when the client accepts it. With _since,
+    only rows changed at or after that time are sent; the X-Transaction-Time
+    header is the value to pass as _since on the next incremental pull. The
+    hierarchy's nested-set bounds are only exported in full. The diagnosis log
+    requires a signed-in user.
+    """
+    export = bulk_export.EXPORTS.get(resource)
+    if export is None:
+        raise HTTPException(status_code=404, detail=f"Unknown export: {resource}. Expected one of {', '.join(bulk_export.EXPORTS)}")
+    if since is not None and export.since_column is None:
+        raise HTTPException(status_code=400, detail=f"{resource} is only exported in full; _since is not supported.")
+    if export.signed_in_only:
+        session = await sessions.get_session(request)
+        if not session.get("user_id"):
+            raise HTTPException(status_code=401, detail="Not authenticated")
+    # Taken before the export is read, so no row committed after it can fall behind the next _since.
+    async with async_engine.connect() as conn:
+        transaction_time = await bulk_export.watermark(conn)
+    headers = {"X-Transaction-Time": transaction_time.isoformat(), "Vary": "Accept-Encoding"}
+    chunks = bulk_export.ndjson(async_engine, export.query(since))
+    if "gzip" in http_cache.accepted_encodings(request):
+        headers["Content-Encoding"] = "gzip"
+        chunks = bulk_export.gzipped(chunks)
+    return StreamingResponse(chunks, media_type="application/x-ndjson", headers=headers)
 
 # --- User Session Endpoint ---
 
 @app.get("/api/users/me", tags=["Users"])
-async def read_users_me(request: Request):
-    user_id = request.session.get("user_id")
-    user_name = request.session.get("user_name")
+async def read_users_me(session: sessions.ServerSession = Depends(sessions.get_session)):
+    user_id = session.get("user_id")
+    user_name = session.get("user_name")
     if not user_id:
         raise HTTPException(status_code=401, detail="Not authenticated")
     return {"userId": user_id, "name": user_name}
 
-# --- Admin Data Ingestion Endpoint ---
+# --- Admin Endpoints ---
+
+@app.get("/admin/cache-stats", tags=["Admin"])
+async def get_cache_stats():
+    mapped = terminology.mapped_snapshot
+    return {
+        "terminology_version": terminology.version,
+        "concept_map": terminology.concept_maps.stats(),
+        "search": terminology.search_results.stats(),
+        "snapshot": {"path": mapped.path, "version": mapped.version, "bytes": mapped.size} if mapped is not None else None
+    }
+
+def _rebuild_analytics():
+    db = SessionLocal()
+    try:
+        return analytics.rebuild(db)
+    finally:
+        db.close()
+
+@app.post("/admin/analytics/rebuild", tags=["Admin"])
+async def rebuild_analytics():
+    """Recomputes the diagnosis rollups from diagnosis_log."""
+    return await run_in_threadpool(_rebuild_analytics)
 
-from . import ingestion_logic
+@app.get("/admin/emr-outbox", tags=["Admin"])
+async def get_emr_outbox_status(db: AsyncSession = Depends(get_async_db)):
+    return {"endpoint": MOCK_FHIR_ENDPOINT, "counts": await emr_outbox.outbox_counts(db)}
 
-@app.get("/admin/ingest-data", tags=["Admin"])
-def trigger_ingestion(db: Session = Depends(get_db)):
+@app.get("/admin/db-pool", tags=["Admin"])
+async def get_db_pool_status():
+    return pool_status()
+
+# --- Metrics Endpoint ---
+
+metrics.CallbackGauge(
+    "accura_db_pool_connections", "Connections of the async engine's pool by state.",
+    lambda: {(state,): value for state, value in pool_status().items() if state in ("checked_out", "checked_in")},
+    ("state",)
+)
+metrics.CallbackGauge(
+    "accura_concept_map_cache", "Concept map cache counters and sizes.",
+    lambda: {(name,): value for name, value in terminology.concept_maps.stats().items()},
+    ("stat",)
+)
+metrics.CallbackGauge(
+    "accura_search_cache", "Search result cache counters and sizes; coalesced counts misses that joined an in-flight lookup.",
+    lambda: {(name,): value for name, value in terminology.search_results.stats().items()},
+    ("stat",)
+)
+metrics.CallbackGauge(
+    "accura_terminology_info", "The terminology version being served.",
+    lambda: {(terminology.version,): 1}, ("version",)
+)
+
+@app.get("/metrics", tags=["Admin"], include_in_schema=False)
+async def get_metrics():
+    return Response(content=metrics.render(), media_type=metrics.PROMETHEUS_CONTENT_TYPE)
+
+# --- Admin Data Ingestion Endpoints ---
+
+from . import ingestion_jobs
+
+ingestion_manager = ingestion_jobs.IngestionJobManager(SessionLocal)
+
+@app.post("/admin/ingestion-jobs", status_code=202, tags=["Admin"])
+async def start_ingestion_job(force: bool = False):
     """
-    A temporary admin endpoint to trigger the initial data ingestion.
-    This should be called once after deployment.
+    Starts a background ingestion of the NAMASTE and concept map CSVs. Files whose
+    content hash matches the last load are skipped unless force is set.
     """
     try:
-        print("Starting NAMASTE code ingestion...")
-        namaste_count = ingestion_logic.ingest_namaste_codes(db)
-        print(f"NAMASTE ingestion complete. Inserted {namaste_count} new codes.")
-
-        print("Starting Concept Map ingestion...")
-        map_results = ingestion_logic.ingest_concept_map(db)
-        print(f"Concept Map ingestion complete.")
-
-        return {
-            "status": "success",
-            "namaste_codes_inserted": namaste_count,
-            "concept_map_results": map_results
-        }
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
+        job = ingestion_manager.start(force=force)
+    except ingestion_jobs.JobAlreadyRunning as e:
+        raise HTTPException(status_code=409, detail={"message": str(e), "job_id": e.job.id})
+    return job.to_dict()
+
+@app.get("/admin/ingestion-jobs/{job_id}", tags=["Admin"])
+async def get_ingestion_job(job_id: str):
+    job = ingestion_manager.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Ingestion job not found: {job_id}")
+    return job.to_dict()
+
+@app.delete("/admin/ingestion-jobs/{job_id}", status_code=202, tags=["Admin"])
+async def cancel_ingestion_job(job_id: str):
+    job = ingestion_manager.cancel(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Ingestion job not found: {job_id}")
+    return job.to_dict()
+
+@app.get("/admin/ingest-data", status_code=202, tags=["Admin"], deprecated=True)
+async def trigger_ingestion(force: bool = False):
+    """
+    Deprecated: use POST /admin/ingestion-jobs. Kept for existing deployment
+    scripts; starts the same background job and returns the same job document.
+    """
+    return await start_ingestion_job(force=force)
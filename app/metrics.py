@@ -0,0 +1,309 @@
+"""
+Request, database, outbound HTTP and ingestion instrumentation, rendered in the
+Prometheus text format on /metrics.
+
+MetricsMiddleware opens a RequestStats for each request in a context variable.
+The SQLAlchemy cursor events and the httpx event hooks add to whichever request
+is current, so a request's latency splits into time in the database, time in
+outbound calls and the rest. Requests slower than SLOW_REQUEST_SECONDS are
+logged together with the statements they ran.
+
+Metrics are per process; with several workers, scrape each one or aggregate.
+"""
+import bisect
+import contextvars
+import logging
+import os
+import threading
+import time
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+logger = logging.getLogger(__name__)
+
+SLOW_REQUEST_SECONDS = float(os.getenv("SLOW_REQUEST_SECONDS", "1.0"))
+# Statements kept per request for the slow-request log.
+SLOW_REQUEST_MAX_QUERIES = int(os.getenv("SLOW_REQUEST_MAX_QUERIES", "50"))
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+INGESTION_BUCKETS = (0.1, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0)
+
+PROMETHEUS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+# --- Metric types ---
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _number(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labels: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(labels)
+        self._lock = threading.Lock()
+        REGISTRY.append(self)
+
+    def header(self) -> List[str]:
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name, documentation, labels=()):
+        super().__init__(name, documentation, labels)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, *label_values: str, amount: float = 1):
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def collect(self) -> List[str]:
+        with self._lock:
+            values = sorted(self._values.items())
+        return self.header() + [f"{self.name}{_labels(self.label_names, k)} {_number(v)}" for k, v in values]
+
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def set(self, value: float, *label_values: str):
+        with self._lock:
+            self._values[label_values] = value
+
+
+class CallbackGauge(_Metric):
+    """A gauge read when scraped, from a callback returning {label values: value}."""
+    kind = "gauge"
+
+    def __init__(self, name, documentation, read: Callable[[], Dict[Tuple[str, ...], float]], labels=()):
+        super().__init__(name, documentation, labels)
+        self.read = read
+
+    def collect(self) -> List[str]:
+        try:
+            values = sorted(self.read().items())
+        except Exception:
+            logger.exception("Reading metric %s failed", self.name)
+            values = []
+        return self.header() + [f"{self.name}{_labels(self.label_names, k)} {_number(v)}" for k, v in values]
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labels=(), buckets: Sequence[float] = LATENCY_BUCKETS):
+        super().__init__(name, documentation, labels)
+        self.buckets = tuple(buckets)
+        # label values -> [per-bucket counts (+Inf last), sum]
+        self._series: Dict[Tuple[str, ...], list] = {}
+
+    def observe(self, value: float, *label_values: str):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                series = self._series[label_values] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][index] += 1
+            series[1] += value
+
+    def collect(self) -> List[str]:
+        with self._lock:
+            series = sorted((k, (list(counts), total)) for k, (counts, total) in self._series.items())
+        lines = self.header()
+        for label_values, (counts, total) in series:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                le = 'le="%s"' % _number(bound)
+                lines.append(f"{self.name}_bucket{_labels(self.label_names, label_values, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_labels(self.label_names, label_values)} {_number(total)}")
+            lines.append(f"{self.name}_count{_labels(self.label_names, label_values)} {cumulative}")
+        return lines
+
+
+REGISTRY: List[_Metric] = []
+
+
+def render() -> str:
+    lines = []
+    for metric in REGISTRY:
+        lines.extend(metric.collect())
+    return "\n".join(lines) + "\n"
+
+
+# --- Metrics ---
+
+http_requests = Counter("accura_http_requests_total", "HTTP requests served.", ("method", "route", "status"))
+http_duration = Histogram("accura_http_request_duration_seconds", "Time to serve a request, until the last body byte.", ("method", "route"))
+http_db_queries = Histogram("accura_http_request_db_queries", "Database statements run per request.", ("route",), COUNT_BUCKETS)
+http_db_seconds = Histogram("accura_http_request_db_seconds", "Time per request spent executing database statements.", ("route",))
+http_outbound_seconds = Histogram("accura_http_request_outbound_seconds", "Time per request spent waiting on outbound HTTP calls.", ("route",))
+slow_requests = Counter("accura_slow_requests_total", "Requests slower than SLOW_REQUEST_SECONDS.", ("route",))
+
+db_query_seconds = Histogram("accura_db_query_duration_seconds", "Database statement execution time.", ("engine",))
+db_pool_checkout_seconds = Histogram("accura_db_pool_checkout_seconds", "Time to check a connection out of the async pool, including the wait and the pre-ping.")
+
+outbound_seconds = Histogram("accura_outbound_http_duration_seconds", "Outbound HTTP time to response headers.", ("host", "method", "status"))
+
+ingestion_phase_seconds = Histogram("accura_ingestion_phase_duration_seconds", "Duration of each ingestion phase.", ("phase",), INGESTION_BUCKETS)
+ingestion_rows = Counter("accura_ingestion_rows_total", "CSV rows processed by ingestion.", ("phase",))
+ingestion_row_rate = Gauge("accura_ingestion_rows_per_second", "Row rate of the last run of each ingestion phase.", ("phase",))
+
+
+# --- Per-request accounting ---
+
+class RequestStats:
+    __slots__ = ("queries", "query_seconds", "outbound_seconds", "statements")
+
+    def __init__(self):
+        self.queries = 0
+        self.query_seconds = 0.0
+        self.outbound_seconds = 0.0
+        self.statements: List[Tuple[float, str]] = []
+
+
+_current: contextvars.ContextVar[Optional[RequestStats]] = contextvars.ContextVar("accura_request_stats", default=None)
+
+
+def _route(scope) -> str:
+    route = scope.get("route")
+    return getattr(route, "path", None) or "unmatched"
+
+
+class MetricsMiddleware:
+    """Pure ASGI middleware, so streamed bodies are timed to the end and no extra task is spawned."""
+
+    def __init__(self, app, exclude: Iterable[str] = ("/metrics",)):
+        self.app = app
+        self.exclude = set(exclude)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"] in self.exclude:
+            await self.app(scope, receive, send)
+            return
+        stats = RequestStats()
+        token = _current.set(stats)
+        status = 500
+        start = time.perf_counter()
+
+        async def timed_send(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, timed_send)
+        finally:
+            _current.reset(token)
+            self._record(scope, status, time.perf_counter() - start, stats)
+
+    @staticmethod
+    def _record(scope, status: int, elapsed: float, stats: RequestStats):
+        route = _route(scope)
+        method = scope["method"]
+        http_requests.inc(method, route, str(status))
+        http_duration.observe(elapsed, method, route)
+        http_db_queries.observe(stats.queries, route)
+        http_db_seconds.observe(stats.query_seconds, route)
+        http_outbound_seconds.observe(stats.outbound_seconds, route)
+        if elapsed >= SLOW_REQUEST_SECONDS:
+            slow_requests.inc(route)
+            statements = "".join(f"\n  {seconds * 1000:8.2f} ms  {statement}" for seconds, statement in stats.statements)
+            logger.warning(
+                "Slow request %s %s (%s) took %.3fs: %d queries in %.3fs, outbound HTTP %.3fs%s",
+                method, scope["path"], route, elapsed, stats.queries, stats.query_seconds, stats.outbound_seconds, statements
+            )
+
+
+# --- SQLAlchemy ---
+
+def instrument_engine(engine, label: str):
+    """Times every statement of a (sync) engine; pass async_engine.sync_engine for the async one."""
+    from sqlalchemy import event
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def _before(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("accura_query_start", []).append(time.perf_counter())
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def _after(conn, cursor, statement, parameters, context, executemany):
+        elapsed = time.perf_counter() - conn.info["accura_query_start"].pop()
+        db_query_seconds.observe(elapsed, label)
+        stats = _current.get()
+        if stats is not None:
+            stats.queries += 1
+            stats.query_seconds += elapsed
+            if len(stats.statements) < SLOW_REQUEST_MAX_QUERIES:
+                stats.statements.append((elapsed, " ".join(statement.split())[:500]))
+
+    @event.listens_for(engine, "handle_error")
+    def _error(context):
+        starts = context.connection.info.get("accura_query_start") if context.connection is not None else None
+        if starts:
+            starts.pop()
+
+
+# --- httpx ---
+
+async def _on_request(request):
+    request.extensions["accura_start"] = time.perf_counter()
+
+
+async def _on_response(response):
+    start = response.request.extensions.get("accura_start")
+    if start is None:
+        return
+    elapsed = time.perf_counter() - start
+    outbound_seconds.observe(elapsed, response.request.url.host, response.request.method, str(response.status_code))
+    stats = _current.get()
+    if stats is not None:
+        stats.outbound_seconds += elapsed
+
+
+def httpx_event_hooks() -> Dict[str, list]:
+    return {"request": [_on_request], "response": [_on_response]}
+
+
+# --- Ingestion ---
+
+class PhaseTimer:
+    """Times consecutive ingestion phases and the rows each one processed."""
+
+    def __init__(self):
+        self._phase: Optional[str] = None
+        self._started = 0.0
+        self._rows_at_start = 0
+
+    def start(self, phase: str, rows_so_far: int):
+        self.finish(rows_so_far)
+        self._phase, self._started, self._rows_at_start = phase, time.perf_counter(), rows_so_far
+
+    def finish(self, rows_so_far: int):
+        if self._phase is None:
+            return
+        elapsed = time.perf_counter() - self._started
+        rows = rows_so_far - self._rows_at_start
+        ingestion_phase_seconds.observe(elapsed, self._phase)
+        if rows:
+            ingestion_rows.inc(self._phase, amount=rows)
+            ingestion_row_rate.set(rows / elapsed if elapsed else 0.0, self._phase)
+        self._phase = None
@@ -0,0 +1,79 @@
+"""
+Idempotent schema upgrade for databases created by earlier releases.
+
+create_all only creates missing tables, so a database created before a column,
+index or constraint was added keeps its old shape. upgrade() runs create_all
+and then brings existing tables up to the models:
+
+- adds every column the model has and the table lacks (all such columns are
+  nullable, so existing rows are left NULL until ingestion fills them);
+- replaces the old UNIQUE(source_code) of concept_map, which allowed a single
+  candidate per code, with uq_concept_map_source_target;
+- creates every index the models declare.
+
+It is safe to run on every startup and from every worker at once: on PostgreSQL
+the upgrade holds an advisory lock, and each step checks before it alters.
+"""
+from sqlalchemy import inspect, text
+from sqlalchemy.engine import Connection, Engine
+
+from . import models
+
+# Serializes concurrent upgrades on PostgreSQL; any constant shared by all workers works.
+UPGRADE_LOCK_ID = 0x61636375
+
+
+def _add_missing_columns(conn: Connection):
+    inspector = inspect(conn)
+    preparer = conn.dialect.identifier_preparer
+    if_not_exists = "IF NOT EXISTS " if conn.dialect.name == "postgresql" else ""
+    for table in models.Base.metadata.sorted_tables:
+        existing = {column["name"] for column in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name in existing:
+                continue
+            conn.execute(text(
+                f"ALTER TABLE {preparer.format_table(table)} ADD COLUMN {if_not_exists}"
+                f"{preparer.format_column(column)} {column.type.compile(dialect=conn.dialect)}"
+            ))
+
+
+def _concept_map_unique(conn: Connection):
+    """Swaps UNIQUE(source_code) for UNIQUE(source_code, target_code)."""
+    table = models.ConceptMap.__table__
+    inspector = inspect(conn)
+    constraints = inspector.get_unique_constraints(table.name)
+    single = [c for c in constraints if c["column_names"] == ["source_code"]]
+    present = any(c["name"] == "uq_concept_map_source_target" for c in constraints)
+    if not single and present:
+        return
+    if conn.dialect.name == "postgresql":
+        for constraint in single:
+            conn.execute(text(f'ALTER TABLE concept_map DROP CONSTRAINT IF EXISTS "{constraint["name"]}"'))
+        if not present:
+            conn.execute(text(
+                "ALTER TABLE concept_map ADD CONSTRAINT uq_concept_map_source_target UNIQUE (source_code, target_code)"
+            ))
+        return
+    # SQLite cannot drop a constraint: rebuild the table under the model's definition.
+    for index in inspector.get_indexes(table.name):
+        conn.execute(text(f'DROP INDEX IF EXISTS "{index["name"]}"'))
+    conn.execute(text("ALTER TABLE concept_map RENAME TO concept_map_old"))
+    table.create(conn)
+    columns = ", ".join(f'"{column.name}"' for column in table.columns)
+    conn.execute(text(f"INSERT INTO concept_map ({columns}) SELECT {columns} FROM concept_map_old"))
+    conn.execute(text("DROP TABLE concept_map_old"))
+
+
+def upgrade(engine: Engine):
+    """Creates missing tables, columns, constraints and indexes; commits."""
+    with engine.begin() as conn:
+        if conn.dialect.name == "postgresql":
+            conn.execute(text("SELECT pg_advisory_xact_lock(:id)"), {"id": UPGRADE_LOCK_ID})
+        models.Base.metadata.create_all(bind=conn)
+        _add_missing_columns(conn)
+        _concept_map_unique(conn)
+        # create_all skips indexes of tables that already exist, including those on new columns.
+        for table in models.Base.metadata.sorted_tables:
+            for index in table.indexes:
+                index.create(bind=conn, checkfirst=True)
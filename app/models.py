@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, ForeignKey, Text, DateTime
+from sqlalchemy import Column, Integer, Float, String, ForeignKey, Text, Date, DateTime, Index, UniqueConstraint
 from sqlalchemy.sql import func
 from .database import Base
 
@@ -7,16 +7,48 @@ class NamasteCode(Base):
     __tablename__ = "namaste_codesystem"
     code = Column(String, primary_key=True, index=True)
     term = Column(String)
+    term_diacritical = Column(String)
+    term_devanagari = Column(String)
     short_definition = Column(String)
+    row_hash = Column(String)
+    # Position in the code hierarchy, derived from the codes at ingestion (see hierarchy.py)
+    parent_code = Column(String, index=True)
+    path = Column(String, index=True)
+    depth = Column(Integer)
+    lft = Column(Integer, index=True)
+    rgt = Column(Integer)
+    # Set when ingestion inserts or changes the row; drives incremental exports
+    updated_at = Column(DateTime(timezone=True), index=True)
 
-# This model matches your concept_map table
+# This model matches your concept_map table; a source code has one row per ranked ICD-11 candidate
 class ConceptMap(Base):
     __tablename__ = "concept_map"
+    __table_args__ = (UniqueConstraint("source_code", "target_code", name="uq_concept_map_source_target"),)
     map_id = Column(Integer, primary_key=True, index=True)
-    source_code = Column(String, ForeignKey("namaste_codesystem.code"), nullable=False, unique=True)
+    source_code = Column(String, ForeignKey("namaste_codesystem.code"), nullable=False, index=True)
     target_code = Column(String, nullable=False)
     target_display = Column(String)
     equivalence = Column(String, nullable=False)
+    rank = Column(Integer)
+    similarity_score = Column(Float)
+    row_hash = Column(String)
+    updated_at = Column(DateTime(timezone=True), index=True)
+
+# Each ingestion stamps a version; read endpoints derive their ETags from the latest one
+class TerminologyVersion(Base):
+    __tablename__ = "terminology_version"
+    id = Column(Integer, primary_key=True, index=True)
+    version = Column(String, nullable=False)
+    namaste_codes = Column(Integer)
+    concept_maps = Column(Integer)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+
+# Content hash of each source CSV at its last successful ingestion
+class IngestionFileState(Base):
+    __tablename__ = "ingestion_file_state"
+    file_name = Column(String, primary_key=True)
+    sha256 = Column(String, nullable=False)
+    ingested_at = Column(DateTime(timezone=True))
 
 # This model logs confirmed diagnoses
 class DiagnosisRecord(Base):
@@ -29,3 +61,45 @@ class DiagnosisRecord(Base):
     icd_code = Column(String)
     icd_display = Column(String)
     timestamp = Column(DateTime(timezone=True), server_default=func.now())
+
+# Serves keyset pagination of a patient's history newest first
+diagnosis_history_index = Index("ix_diagnosis_log_patient_timestamp_id", DiagnosisRecord.patient_id, DiagnosisRecord.timestamp.desc(), DiagnosisRecord.id.desc())
+# Serves incremental (_since) exports of the whole log
+diagnosis_timestamp_index = Index("ix_diagnosis_log_timestamp", DiagnosisRecord.timestamp)
+
+# Confirmed diagnoses per UTC day and code pair, maintained with every confirmation (see analytics.py)
+class DiagnosisCodeDaily(Base):
+    __tablename__ = "diagnosis_code_daily"
+    day = Column(Date, primary_key=True)
+    namaste_code = Column(String, primary_key=True)
+    # '' when the log row had no ICD-11 code
+    icd_code = Column(String, primary_key=True)
+    count = Column(Integer, nullable=False)
+
+# Confirmed diagnoses per UTC day, doctor and NAMASTE code
+class DiagnosisDoctorDaily(Base):
+    __tablename__ = "diagnosis_doctor_daily"
+    day = Column(Date, primary_key=True)
+    doctor_id = Column(String, primary_key=True)
+    namaste_code = Column(String, primary_key=True)
+    count = Column(Integer, nullable=False)
+
+# Transactional outbox of FHIR bundle entries waiting to be sent to the EMR
+class EmrOutbox(Base):
+    __tablename__ = "emr_outbox"
+    __table_args__ = (Index("ix_emr_outbox_status_next_attempt", "status", "next_attempt_at"),)
+    id = Column(Integer, primary_key=True, index=True)
+    payload = Column(Text, nullable=False)
+    status = Column(String, nullable=False, default="pending")
+    attempts = Column(Integer, nullable=False, default=0)
+    next_attempt_at = Column(DateTime(timezone=True), nullable=False)
+    last_error = Column(Text)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    sent_at = Column(DateTime(timezone=True))
+
+# Server-side sessions shared by all workers (SESSION_STORE=database); the cookie holds only the id
+class WebSession(Base):
+    __tablename__ = "web_session"
+    id = Column(String, primary_key=True)
+    data = Column(Text, nullable=False)
+    expires_at = Column(DateTime(timezone=True), nullable=False, index=True)
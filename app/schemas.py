@@ -1,6 +1,6 @@
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
 from typing import Optional, List
-from datetime import datetime
+from datetime import date, datetime
 
 # Schema for the /search endpoint response
 class NamasteTerm(BaseModel):
@@ -11,15 +11,48 @@ class NamasteTerm(BaseModel):
     class Config:
         from_attributes = True
 
+# Schema for the /terminology/autocomplete endpoint response
+class AutocompleteSuggestion(BaseModel):
+    code: str
+    term: Optional[str] = None
+    term_diacritical: Optional[str] = None
+    term_devanagari: Optional[str] = None
+
+# Schema for a suggested ICD-11 candidate of an unmapped NAMASTE code
+class SuggestedMapping(BaseModel):
+    code: str
+    display: str
+    score: float
+
 # Schema for the /translate endpoint request body
 class TranslateRequest(BaseModel):
     namaste_code: str
+    top_k: int = Field(1, ge=1, le=50)
+    min_score: Optional[float] = Field(None, ge=0, le=1)
 
 # Schema for the POST /diagnosis/confirm endpoint request body
 class ConfirmDiagnosisRequest(BaseModel):
     patient_id: str
     namaste_code: str
 
+# Schema for the POST /diagnosis/confirm/batch endpoint request body
+class BatchConfirmDiagnosisRequest(BaseModel):
+    items: List[ConfirmDiagnosisRequest]
+
+# Per-item outcome in the POST /diagnosis/confirm/batch response
+class ConfirmDiagnosisResult(BaseModel):
+    index: int
+    patient_id: str
+    namaste_code: str
+    status: str
+    detail: Optional[str] = None
+
+# Schema for the POST /diagnosis/confirm/batch endpoint response
+class BatchConfirmDiagnosisResponse(BaseModel):
+    confirmed: int
+    failed: int
+    results: List[ConfirmDiagnosisResult]
+
 # Base schema for diagnosis records
 class DiagnosisRecordBase(BaseModel):
     patient_id: str
@@ -36,3 +69,17 @@ class DiagnosisRecordResponse(DiagnosisRecordBase):
 
     class Config:
         from_attributes = True
+
+# Schemas for the /analytics endpoints, served from the daily rollups
+class CodeCount(BaseModel):
+    code: str
+    display: Optional[str] = None
+    count: int
+
+class DailyCount(BaseModel):
+    day: date
+    count: int
+
+class DoctorCount(BaseModel):
+    doctor_id: str
+    count: int
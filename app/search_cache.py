@@ -0,0 +1,107 @@
+"""
+Result cache for /search with single-flight misses.
+
+Search has been answered from the in-memory SearchIndex since it replaced the
+ILIKE queries, so the database is not involved. What remains is CPU on the
+event loop: a short or misspelled term walks the substring and fuzzy tiers and
+costs up to a few milliseconds. Typeahead traffic repeats the same terms
+from many clients at once, so rendered results are kept in a bounded LRU with
+a TTL, keyed by the terminology version and the normalized query.
+
+A miss is computed in the threadpool, off the event loop. Identical
+requests arriving while it runs await the same computation instead of
+starting their own. The cache is cleared whenever a terminology version is
+installed; the version in the key keeps a result from outliving its index
+even if a clear races with an in-flight miss.
+"""
+import asyncio
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, Dict, Hashable, Tuple
+
+from fastapi.concurrency import run_in_threadpool
+
+SEARCH_CACHE_SIZE = int(os.getenv("SEARCH_CACHE_SIZE", "4096"))
+SEARCH_CACHE_TTL_SECONDS = float(os.getenv("SEARCH_CACHE_TTL_SECONDS", "300"))
+
+
+class SearchCache:
+    """Bounded LRU of rendered results with a TTL, whose misses are coalesced per key."""
+
+    def __init__(self, maxsize: int = SEARCH_CACHE_SIZE, ttl: float = SEARCH_CACHE_TTL_SECONDS):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        # clear() runs on whichever thread installs a terminology version.
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[Hashable, Tuple[float, bytes]]" = OrderedDict()
+        self._inflight: Dict[Hashable, asyncio.Future] = {}
+        self._generation = 0
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def clear(self):
+        with self._lock:
+            self._generation += 1
+            self._entries = OrderedDict()
+
+    def _cached(self, key: Hashable):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry[0] <= time.monotonic():
+                del self._entries[key]
+                self.expirations += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    async def _compute(self, key: Hashable, compute: Callable[[], bytes], generation: int) -> bytes:
+        try:
+            value = await run_in_threadpool(compute)
+        finally:
+            self._inflight.pop(key, None)
+        with self._lock:
+            # A result computed against a replaced terminology is handed out but not kept.
+            if generation == self._generation:
+                self._entries[key] = (time.monotonic() + self.ttl, value)
+                while len(self._entries) > self.maxsize:
+                    self._entries.popitem(last=False)
+                    self.evictions += 1
+        return value
+
+    async def get(self, key: Hashable, compute: Callable[[], bytes]) -> bytes:
+        """The cached result for `key`, or the result of `compute()` shared by every concurrent caller."""
+        value = self._cached(key)
+        if value is not None:
+            return value
+        pending = self._inflight.get(key)
+        if pending is None:
+            self.misses += 1
+            pending = self._inflight[key] = asyncio.ensure_future(self._compute(key, compute, self._generation))
+        else:
+            self.coalesced += 1
+        # Shielded, so one caller disconnecting does not cancel the lookup the others wait for.
+        return await asyncio.shield(pending)
+
+    def stats(self) -> Dict[str, float]:
+        lookups = self.hits + self.misses + self.coalesced
+        return {
+            "size": len(self._entries),
+            "maxsize": self.maxsize,
+            "hits": self.hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+        }
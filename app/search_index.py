@@ -0,0 +1,195 @@
+import bisect
+import re
+import unicodedata
+from collections import Counter, defaultdict
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+# Devanagari vowel signs are combining marks, so \w alone would split words apart.
+_TOKEN_RE = re.compile(r"[\w\u0900-\u097F]+")
+_COMBINING_DIACRITICS = re.compile(r"[\u0300-\u036F]")
+
+# Result tiers, best first: exact code, code prefix, whole word, word prefix,
+# substring inside a word (the old ILIKE behaviour) and finally trigram similarity.
+TIER_EXACT_CODE = 0
+TIER_CODE_PREFIX = 1
+TIER_WORD = 2
+TIER_WORD_PREFIX = 3
+TIER_SUBSTRING = 4
+TIER_FUZZY = 5
+
+FUZZY_THRESHOLD = 0.3
+
+Row = Tuple[str, Optional[str], Optional[str]]
+
+
+def fold(text: Optional[str]) -> str:
+    """Lower-cases text and strips Latin diacritics (vāta -> vata)."""
+    if not text:
+        return ""
+    return _COMBINING_DIACRITICS.sub("", unicodedata.normalize("NFKD", text)).casefold()
+
+
+def tokenize(text: Optional[str]) -> List[str]:
+    return _TOKEN_RE.findall(fold(text))
+
+
+def _trigrams(token: str) -> set:
+    padded = f"  {token} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def _inner_trigrams(token: str) -> set:
+    return {token[i:i + 3] for i in range(len(token) - 2)}
+
+
+class SearchIndex:
+    """
+    Immutable inverted index over (code, term, short_definition) rows.
+
+    Words are indexed once in a sorted vocabulary; postings point from a word to
+    the rows that contain it, and a trigram index over the vocabulary drives the
+    substring and fuzzy tiers. Every lookup works on the vocabulary first, so the
+    cost of a query depends on how many words it touches rather than on the size
+    of the code system.
+    """
+
+    def __init__(self, rows: Iterable[Row] = ()):
+        # A stable static order (shallow codes first) breaks ties inside a tier.
+        self.rows: List[Row] = sorted(rows, key=lambda r: (len(r[0]), r[0]))
+        self._code_to_row: Dict[str, int] = {}
+        self._codes: List[Tuple[str, int]] = []
+        term_postings: Dict[str, set] = defaultdict(set)
+        def_postings: Dict[str, set] = defaultdict(set)
+
+        for row_id, (code, term, short_definition) in enumerate(self.rows):
+            folded_code = code.casefold()
+            self._code_to_row[folded_code] = row_id
+            self._codes.append((folded_code, row_id))
+            for token in tokenize(term):
+                term_postings[token].add(row_id)
+            for token in tokenize(short_definition):
+                def_postings[token].add(row_id)
+        self._codes.sort()
+
+        self._vocabulary: List[str] = sorted(set(term_postings) | set(def_postings))
+        self._term_postings = {t: frozenset(ids) for t, ids in term_postings.items()}
+        self._def_postings = {t: frozenset(ids) for t, ids in def_postings.items()}
+
+        trigram_index: Dict[str, List[int]] = defaultdict(list)
+        self._vocab_trigram_counts: List[int] = []
+        for word_id, word in enumerate(self._vocabulary):
+            grams = _trigrams(word)
+            self._vocab_trigram_counts.append(len(grams))
+            for gram in grams:
+                trigram_index[gram].append(word_id)
+        self._trigram_index = dict(trigram_index)
+
+    def __len__(self) -> int:
+        return len(self.rows)
+
+    # --- Vocabulary lookups ---
+
+    def _words_with_prefix(self, prefix: str) -> List[str]:
+        start = bisect.bisect_left(self._vocabulary, prefix)
+        end = bisect.bisect_left(self._vocabulary, prefix + "\uffff", start)
+        return self._vocabulary[start:end]
+
+    def _words_containing(self, fragment: str) -> List[str]:
+        grams = _inner_trigrams(fragment)
+        if not grams:
+            # One- and two-letter fragments have no interior trigram; fall back to prefixes.
+            return self._words_with_prefix(fragment)
+        candidates = None
+        for gram in grams:
+            # Interior trigrams are padded-trigram members of any word containing them.
+            word_ids = set(self._trigram_index.get(gram, ()))
+            candidates = word_ids if candidates is None else candidates & word_ids
+            if not candidates:
+                return []
+        return [self._vocabulary[i] for i in candidates if fragment in self._vocabulary[i]]
+
+    def _similar_words(self, token: str) -> Dict[str, float]:
+        grams = _trigrams(token)
+        shared = Counter()
+        for gram in grams:
+            shared.update(self._trigram_index.get(gram, ()))
+        similar = {}
+        for word_id, overlap in shared.items():
+            union = len(grams) + self._vocab_trigram_counts[word_id] - overlap
+            score = overlap / union
+            if score >= FUZZY_THRESHOLD:
+                similar[self._vocabulary[word_id]] = score
+        return similar
+
+    def _rows_for_words(self, words: Iterable[str]) -> Tuple[set, set]:
+        in_term, in_definition = set(), set()
+        for word in words:
+            in_term.update(self._term_postings.get(word, ()))
+            in_definition.update(self._def_postings.get(word, ()))
+        return in_term, in_definition
+
+    # --- Query ---
+
+    def search(self, query: str, limit: int = 15) -> List[Row]:
+        """Returns up to `limit` rows ordered by relevance tier, then term match, then static order."""
+        folded = fold(query).strip()
+        if not folded or limit <= 0:
+            return []
+
+        ranked: Dict[int, Tuple[int, int]] = {}
+
+        def offer(row_ids: Iterable[int], tier: int, sub_rank: int = 0):
+            for row_id in row_ids:
+                key = (tier, sub_rank)
+                if row_id not in ranked or key < ranked[row_id]:
+                    ranked[row_id] = key
+
+        exact = self._code_to_row.get(folded)
+        if exact is not None:
+            offer([exact], TIER_EXACT_CODE)
+
+        start = bisect.bisect_left(self._codes, (folded,))
+        for code, row_id in self._codes[start:start + limit + 1]:
+            if not code.startswith(folded):
+                break
+            offer([row_id], TIER_CODE_PREFIX)
+
+        tokens = _TOKEN_RE.findall(folded)
+        if tokens:
+            self._offer_matches(tokens, lambda token: (token,), TIER_WORD, offer)
+            self._offer_matches(tokens, self._words_with_prefix, TIER_WORD_PREFIX, offer)
+            if len(ranked) < limit:
+                self._offer_matches(tokens, self._words_containing, TIER_SUBSTRING, offer)
+            if len(ranked) < limit:
+                self._offer_fuzzy(tokens, offer)
+
+        best = sorted(ranked.items(), key=lambda item: (item[1], item[0]))[:limit]
+        return [self.rows[row_id] for row_id, _ in best]
+
+    def _offer_matches(self, tokens: Sequence[str], expand, tier: int, offer):
+        """Offers rows in which every query token matches some word of the term or definition."""
+        term_hits = any_hits = None
+        for token in tokens:
+            in_term, in_definition = self._rows_for_words(expand(token))
+            in_either = in_term | in_definition
+            term_hits = in_term if term_hits is None else term_hits & in_term
+            any_hits = in_either if any_hits is None else any_hits & in_either
+            if not any_hits:
+                return
+        offer(term_hits, tier, 0)
+        offer(any_hits - term_hits, tier, 1)
+
+    def _offer_fuzzy(self, tokens: Sequence[str], offer):
+        # A row scores its best-matching word per query token, summed over the tokens.
+        row_scores: Dict[int, float] = defaultdict(float)
+        for token in tokens:
+            token_scores: Dict[int, float] = {}
+            for word, score in self._similar_words(token).items():
+                in_term, in_definition = self._rows_for_words([word])
+                for row_id in in_term | in_definition:
+                    token_scores[row_id] = max(token_scores.get(row_id, 0.0), score)
+            for row_id, score in token_scores.items():
+                row_scores[row_id] += score
+        # Quantise the score so the static row order still breaks near-ties.
+        for row_id, score in row_scores.items():
+            offer([row_id], TIER_FUZZY, -int(score * 100))
@@ -0,0 +1,307 @@
+"""
+Server-side sessions.
+
+The cookie carries only an opaque random session id; the data lives in a
+SessionStore. Nothing is read from the store until a route asks for the session
+through the get_session dependency, so requests that never touch the session
+(all of the terminology API) cost no lookup, and the cookie is only re-sent when
+the session changed or needs its expiry extended.
+
+Two stores are provided: MemorySessionStore, LRUs with TTLs for a single
+process, and DatabaseSessionStore, which keeps sessions in the web_session table
+so every worker sees them. SESSION_STORE picks one. Sessions that only hold
+OAuth state expire after SESSION_STATE_TTL_SECONDS, signed-in sessions after
+SESSION_TTL_SECONDS of inactivity, and expired rows are evicted in the background.
+"""
+import abc
+import asyncio
+import collections
+import datetime
+import json
+import logging
+import os
+import secrets
+from collections.abc import MutableMapping
+from typing import Any, Dict, Iterator, Optional, Tuple
+
+from fastapi import Request
+from sqlalchemy import delete, select
+from sqlalchemy.ext.asyncio import async_sessionmaker
+from starlette.datastructures import MutableHeaders
+from starlette.requests import HTTPConnection
+
+from . import models
+
+logger = logging.getLogger(__name__)
+
+SESSION_STORE = os.getenv("SESSION_STORE", "memory")
+SESSION_COOKIE = os.getenv("SESSION_COOKIE", "session")
+SESSION_TTL_SECONDS = int(os.getenv("SESSION_TTL_SECONDS", str(14 * 24 * 3600)))
+# Sessions without a signed-in user only carry OAuth state for a login or consent in flight.
+SESSION_STATE_TTL_SECONDS = int(os.getenv("SESSION_STATE_TTL_SECONDS", "600"))
+SESSION_MEMORY_MAXSIZE = int(os.getenv("SESSION_MEMORY_MAXSIZE", "10000"))
+# Anyone can create a state-only session, so they get a bound of their own.
+SESSION_STATE_MEMORY_MAXSIZE = int(os.getenv("SESSION_STATE_MEMORY_MAXSIZE", "2000"))
+SESSION_EVICT_SECONDS = float(os.getenv("SESSION_EVICT_SECONDS", "60"))
+
+# (data, expires_at) as stored
+Record = Tuple[Dict[str, Any], datetime.datetime]
+
+
+def utcnow() -> datetime.datetime:
+    return datetime.datetime.now(datetime.timezone.utc)
+
+
+def new_session_id() -> str:
+    return secrets.token_urlsafe(32)
+
+
+def signed_in(data: Dict[str, Any]) -> bool:
+    return bool(data.get("user_id"))
+
+
+def ttl_for(data: Dict[str, Any]) -> int:
+    return SESSION_TTL_SECONDS if signed_in(data) else SESSION_STATE_TTL_SECONDS
+
+
+# --- Stores ---
+
+class SessionStore(abc.ABC):
+    """Session persistence. Data must be JSON-serializable."""
+
+    @abc.abstractmethod
+    async def load(self, session_id: str) -> Optional[Record]:
+        ...
+
+    @abc.abstractmethod
+    async def save(self, session_id: str, data: Dict[str, Any], ttl: int):
+        ...
+
+    @abc.abstractmethod
+    async def delete(self, session_id: str):
+        ...
+
+    @abc.abstractmethod
+    async def evict_expired(self) -> int:
+        """Removes expired sessions; returns how many."""
+
+
+class MemorySessionStore(SessionStore):
+    """
+    Sessions of this process, least recently used dropped first beyond maxsize.
+    Signed-in and state-only sessions are bounded separately, so a flood of
+    anonymous logins only evicts other logins in flight, never a signed-in user.
+    """
+
+    def __init__(self, maxsize: int = SESSION_MEMORY_MAXSIZE, state_maxsize: int = SESSION_STATE_MEMORY_MAXSIZE):
+        self.maxsize = maxsize
+        self.state_maxsize = state_maxsize
+        self._sessions: "collections.OrderedDict[str, Tuple[str, datetime.datetime]]" = collections.OrderedDict()
+        self._states: "collections.OrderedDict[str, Tuple[str, datetime.datetime]]" = collections.OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._sessions) + len(self._states)
+
+    async def load(self, session_id: str) -> Optional[Record]:
+        for sessions in (self._sessions, self._states):
+            entry = sessions.get(session_id)
+            if entry is None:
+                continue
+            data, expires_at = entry
+            if expires_at <= utcnow():
+                del sessions[session_id]
+                return None
+            sessions.move_to_end(session_id)
+            return json.loads(data), expires_at
+        return None
+
+    async def save(self, session_id: str, data: Dict[str, Any], ttl: int):
+        sessions, other, maxsize = (self._sessions, self._states, self.maxsize) if signed_in(data) else \
+            (self._states, self._sessions, self.state_maxsize)
+        other.pop(session_id, None)
+        sessions[session_id] = (json.dumps(data), utcnow() + datetime.timedelta(seconds=ttl))
+        sessions.move_to_end(session_id)
+        while len(sessions) > maxsize:
+            sessions.popitem(last=False)
+
+    async def delete(self, session_id: str):
+        self._sessions.pop(session_id, None)
+        self._states.pop(session_id, None)
+
+    async def evict_expired(self) -> int:
+        now = utcnow()
+        evicted = 0
+        for sessions in (self._sessions, self._states):
+            expired = [session_id for session_id, (_, expires_at) in sessions.items() if expires_at <= now]
+            for session_id in expired:
+                del sessions[session_id]
+            evicted += len(expired)
+        return evicted
+
+
+class DatabaseSessionStore(SessionStore):
+    """Sessions in the web_session table, shared by every worker on the database."""
+
+    def __init__(self, session_factory: async_sessionmaker):
+        self.session_factory = session_factory
+
+    async def load(self, session_id: str) -> Optional[Record]:
+        async with self.session_factory() as db:
+            row = (await db.execute(
+                select(models.WebSession.data, models.WebSession.expires_at)
+                .where(models.WebSession.id == session_id, models.WebSession.expires_at > utcnow())
+            )).first()
+        if row is None:
+            return None
+        expires_at = row.expires_at
+        if expires_at.tzinfo is None:  # SQLite returns naive UTC timestamps
+            expires_at = expires_at.replace(tzinfo=datetime.timezone.utc)
+        return json.loads(row.data), expires_at
+
+    async def save(self, session_id: str, data: Dict[str, Any], ttl: int):
+        async with self.session_factory() as db:
+            await db.merge(models.WebSession(
+                id=session_id, data=json.dumps(data), expires_at=utcnow() + datetime.timedelta(seconds=ttl)
+            ))
+            await db.commit()
+
+    async def delete(self, session_id: str):
+        async with self.session_factory() as db:
+            await db.execute(delete(models.WebSession).where(models.WebSession.id == session_id))
+            await db.commit()
+
+    async def evict_expired(self) -> int:
+        async with self.session_factory() as db:
+            result = await db.execute(delete(models.WebSession).where(models.WebSession.expires_at <= utcnow()))
+            await db.commit()
+        return result.rowcount or 0
+
+
+def make_store(session_factory: async_sessionmaker) -> SessionStore:
+    if SESSION_STORE == "memory":
+        return MemorySessionStore()
+    if SESSION_STORE == "database":
+        return DatabaseSessionStore(session_factory)
+    raise ValueError(f"Unknown SESSION_STORE {SESSION_STORE!r}; expected 'memory' or 'database'")
+
+
+# --- Session ---
+
+class ServerSession(MutableMapping):
+    """The session of one request, read from the store on first load()."""
+
+    def __init__(self, store: SessionStore, session_id: Optional[str]):
+        self.store = store
+        self.id = session_id
+        self.expires_at: Optional[datetime.datetime] = None
+        self.modified = False
+        self.stale_id: Optional[str] = None
+        self._data: Optional[Dict[str, Any]] = None
+
+    @property
+    def loaded(self) -> bool:
+        return self._data is not None
+
+    async def load(self) -> "ServerSession":
+        if self._data is None:
+            record = await self.store.load(self.id) if self.id else None
+            if record is None:
+                # Never adopt an id the store does not know: a client must not choose its session id.
+                self.id, self._data = None, {}
+            else:
+                self._data, self.expires_at = record
+        return self
+
+    def regenerate(self):
+        """Moves the data to a new session id, e.g. on sign-in, so an id issued before it is worthless."""
+        if self.id and self.stale_id is None:
+            self.stale_id = self.id
+        self.id = None
+        self.modified = True
+
+    def _items(self) -> Dict[str, Any]:
+        if self._data is None:
+            raise RuntimeError("The session is not loaded; declare it with Depends(sessions.get_session)")
+        return self._data
+
+    def __getitem__(self, key: str) -> Any:
+        return self._items()[key]
+
+    def __setitem__(self, key: str, value: Any):
+        self._items()[key] = value
+        self.modified = True
+
+    def __delitem__(self, key: str):
+        del self._items()[key]
+        self.modified = True
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._items())
+
+    def __len__(self) -> int:
+        return len(self._items())
+
+
+async def get_session(request: Request) -> ServerSession:
+    """Dependency giving a route its loaded session; request.session works after it too."""
+    return await request.scope["session"].load()
+
+
+# --- Middleware ---
+
+class ServerSessionMiddleware:
+    """Pure ASGI middleware: puts an unloaded ServerSession in scope and persists it with the response."""
+
+    def __init__(self, app, store: SessionStore, cookie_name: str = SESSION_COOKIE, https_only: bool = True, same_site: str = "lax"):
+        self.app = app
+        self.store = store
+        self.cookie_name = cookie_name
+        self.flags = "; path=/; httponly; samesite=" + same_site + ("; secure" if https_only else "")
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] not in ("http", "websocket"):
+            await self.app(scope, receive, send)
+            return
+        session = ServerSession(self.store, HTTPConnection(scope).cookies.get(self.cookie_name) or None)
+        scope["session"] = session
+
+        async def send_with_cookie(message):
+            if message["type"] == "http.response.start" and session.loaded:
+                cookie = await self._persist(session)
+                if cookie is not None:
+                    MutableHeaders(scope=message).append("set-cookie", cookie)
+            await send(message)
+
+        await self.app(scope, receive, send_with_cookie)
+
+    async def _persist(self, session: ServerSession) -> Optional[str]:
+        """Saves or drops the session; returns the Set-Cookie value, if the cookie must change."""
+        if session.stale_id is not None:
+            await self.store.delete(session.stale_id)
+        data = session._items()
+        if not data:
+            if session.id is None or session.expires_at is None:
+                return None
+            await self.store.delete(session.id)
+            return f"{self.cookie_name}=null; max-age=0" + self.flags
+        ttl = ttl_for(data)
+        # Sliding expiry: an unchanged session is written back once less than half its TTL is left.
+        if not session.modified and session.expires_at is not None and \
+                (session.expires_at - utcnow()).total_seconds() > ttl / 2:
+            return None
+        if session.id is None:
+            session.id = new_session_id()
+        await self.store.save(session.id, data, ttl)
+        return f"{self.cookie_name}={session.id}; max-age={ttl}" + self.flags
+
+
+async def evict_forever(store: SessionStore, interval: float = SESSION_EVICT_SECONDS):
+    """Background loop removing expired sessions."""
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            evicted = await store.evict_expired()
+            if evicted:
+                logger.info("Evicted %d expired sessions", evicted)
+        except Exception:
+            logger.exception("Session eviction failed")
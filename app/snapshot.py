@@ -0,0 +1,444 @@
+"""
+Read-only binary snapshot of namaste_codesystem and concept_map.
+
+Ingestion writes the snapshot next to the database load, and every worker maps
+it read-only with mmap. What it buys:
+
+- code lookups ($lookup, $translate, code-by-code reads), the hierarchy
+  ($lookup parents and children, $expand) and the pre-rendered JSON fragments
+  are served straight from the mapped pages through the hash index, so all
+  workers on a host share one copy of them through the OS page cache;
+- a worker warms up and picks up a new version from the file, without querying
+  the database;
+- a reload in one worker (or an ingestion script) reaches the others, which
+  poll the file.
+
+Only the search and prefix indexes are built in each worker's own heap, from
+the code rows, once per install; they are the part of the memory that grows
+with the number of workers.
+
+Layout (little-endian, sections 8-byte aligned, in this order):
+
+    header          magic, format, terminology version and section counts
+    string offsets  u32[strings + 1] into the string blob
+    code rows       u32[codes * 7]: code, term, diacritical, devanagari,
+                    definition, search fragment, autocomplete fragment
+    map offsets     u32[codes + 1]: each code's run of candidates, best first
+    map strings     u32[maps * 4]: target code, target display, equivalence,
+                    match fragment
+    map ranks       i32[maps], -1 when unranked
+    map scores      f64[maps], NaN when unscored
+    hash slots      u32[slots]: code row + 1, open addressing on crc32(code)
+    parents         u32[codes]: row of each code's parent, NONE for a root
+    preorder        u32[codes]: row of the code at each preorder position
+    positions       u32[codes]: preorder position of each row
+    depths          u32[codes]: depth, by preorder position
+    sizes           u32[codes]: number of descendants, by preorder position
+    string blob     UTF-8 bytes
+
+Every string is stored once; NONE marks a NULL column. Fragments are JSON,
+so they are stored as strings and read back as bytes.
+"""
+import math
+import mmap
+import os
+import struct
+import tempfile
+import zlib
+from typing import Iterable, Iterator, List, Optional, Sequence, Tuple
+
+from . import fragments
+from .concept_map_cache import CachedMapping, candidate_order
+from .hierarchy import Hierarchy
+
+MAGIC = b"ACCSNAP\x00"
+FORMAT = 2
+NONE = 0xFFFFFFFF
+
+_HEADER = struct.Struct("<8sI16sIIIII")
+_CODE_COLUMNS = 7  # the five CodeRow columns, then the search and autocomplete fragments
+_ROW_COLUMNS = 5
+_MAP_COLUMNS = 4
+_SEARCH, _AUTOCOMPLETE = 5, 6
+
+CodeRow = Tuple[str, Optional[str], Optional[str], Optional[str], Optional[str]]
+
+
+class SnapshotError(Exception):
+    pass
+
+
+def _aligned(size: int) -> int:
+    return (size + 7) & ~7
+
+
+def _slot_count(codes: int) -> int:
+    slots = 8
+    while slots < codes * 2:
+        slots <<= 1
+    return slots
+
+
+def _sections(strings: int, codes: int, maps: int, slots: int) -> List[Tuple[int, int]]:
+    """(offset, length) of every fixed-width section, in file order."""
+    lengths = [
+        (strings + 1) * 4, codes * _CODE_COLUMNS * 4, (codes + 1) * 4,
+        maps * _MAP_COLUMNS * 4, maps * 4, maps * 8, slots * 4,
+        codes * 4, codes * 4, codes * 4, codes * 4, codes * 4
+    ]
+    sections, offset = [], _aligned(_HEADER.size)
+    for length in lengths:
+        sections.append((offset, length))
+        offset = _aligned(offset + length)
+    sections.append((offset, None))  # string blob, to the end of the file
+    return sections
+
+
+# --- Writing ---
+
+def build(version: str, codes: Iterable[CodeRow], mappings: Iterable[CachedMapping]) -> bytes:
+    """The snapshot of one terminology version, as bytes."""
+    strings: dict = {}
+    blob = bytearray()
+    string_offsets = [0]
+
+    def intern(value) -> int:
+        if value is None:
+            return NONE
+        string_id = strings.get(value)
+        if string_id is None:
+            string_id = strings[value] = len(string_offsets) - 1
+            blob.extend(value if isinstance(value, bytes) else value.encode("utf-8"))
+            string_offsets.append(len(blob))
+        return string_id
+
+    codes = sorted(codes, key=lambda row: row[0])
+    rows = {row[0]: i for i, row in enumerate(codes)}
+    code_ids = []
+    for code, term, diacritical, devanagari, definition in codes:
+        code_ids.extend(intern(value) for value in (code, term, diacritical, devanagari, definition))
+        code_ids.append(intern(fragments.search_fragment(code, term, definition)))
+        code_ids.append(intern(fragments.autocomplete_fragment(code, term, diacritical, devanagari)))
+
+    runs: List[List[CachedMapping]] = [[] for _ in codes]
+    for mapping in mappings:
+        if mapping.source_code in rows:
+            runs[rows[mapping.source_code]].append(mapping)
+    map_offsets, map_ids, ranks, scores = [0], [], [], []
+    for run in runs:
+        for mapping in sorted(run, key=candidate_order):
+            map_ids.extend((intern(mapping.target_code), intern(mapping.target_display), intern(mapping.equivalence),
+                            intern(fragments.match_fragment(mapping))))
+            ranks.append(-1 if mapping.rank is None else mapping.rank)
+            scores.append(math.nan if mapping.similarity_score is None else mapping.similarity_score)
+        map_offsets.append(len(ranks))
+
+    slots = [0] * _slot_count(len(codes))
+    mask = len(slots) - 1
+    for i, row in enumerate(codes):
+        slot = zlib.crc32(row[0].encode("utf-8")) & mask
+        while slots[slot]:
+            slot = (slot + 1) & mask
+        slots[slot] = i + 1
+
+    parents, preorder, depths, sizes = [NONE] * len(codes), [], [], []
+    positions = [0] * len(codes)
+    for code, parent, depth, size in Hierarchy(rows).preorder():
+        row = rows[code]
+        if parent is not None:
+            parents[row] = rows[parent]
+        positions[row] = len(preorder)
+        preorder.append(row)
+        depths.append(depth)
+        sizes.append(size)
+
+    sources = sum(1 for run in runs if run)
+    header = _HEADER.pack(MAGIC, FORMAT, version.encode("ascii")[:16].ljust(16, b"\0"),
+                          len(string_offsets) - 1, len(codes), len(ranks), len(slots), sources)
+    arrays = [
+        struct.pack(f"<{len(string_offsets)}I", *string_offsets), struct.pack(f"<{len(code_ids)}I", *code_ids),
+        struct.pack(f"<{len(map_offsets)}I", *map_offsets), struct.pack(f"<{len(map_ids)}I", *map_ids),
+        struct.pack(f"<{len(ranks)}i", *ranks), struct.pack(f"<{len(scores)}d", *scores),
+        struct.pack(f"<{len(slots)}I", *slots)
+    ] + [struct.pack(f"<{len(codes)}I", *values) for values in (parents, preorder, positions, depths, sizes)]
+    arrays.append(bytes(blob))
+    sections = _sections(len(string_offsets) - 1, len(codes), len(ranks), len(slots))
+
+    data = bytearray(header)
+    for (offset, _), array in zip(sections, arrays):
+        data.extend(b"\0" * (offset - len(data)))
+        data.extend(array)
+    return bytes(data)
+
+
+def write(path: str, data: bytes):
+    """Writes a built snapshot atomically: readers see either the previous file or the complete new one."""
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(prefix=".snapshot-", dir=directory)
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+
+# --- Reading ---
+
+class Snapshot:
+    """A snapshot in a mapped file (or in memory). Nothing is copied out of it until a row is read."""
+
+    def __init__(self, buffer, path: Optional[str] = None, stat: Optional[os.stat_result] = None):
+        view = memoryview(buffer)
+        if len(view) < _HEADER.size:
+            raise SnapshotError(f"{path} is not a terminology snapshot")
+        magic, file_format, version, strings, codes, maps, slots, sources = _HEADER.unpack_from(view)
+        if magic != MAGIC or file_format != FORMAT:
+            raise SnapshotError(f"{path} is not a format {FORMAT} terminology snapshot")
+        self._buffer = buffer
+        self.path = path
+        self.stat = stat
+        self.version = version.rstrip(b"\0").decode("ascii")
+        self.size = len(view)
+        sections = _sections(strings, codes, maps, slots)
+        typecodes = ("I", "I", "I", "I", "i", "d", "I", "I", "I", "I", "I", "I")
+        (self._string_offsets, self._code_ids, self._map_offsets, self._map_ids, self._ranks, self._scores,
+         self._slots, self._parents, self._preorder, self._positions, self._depths, self._sizes) = (
+            view[offset:offset + length].cast(typecode) for (offset, length), typecode in zip(sections, typecodes)
+        )
+        self._blob = view[sections[-1][0]:]
+        self._codes = codes
+        self._mask = slots - 1
+        self.concepts = SnapshotConcepts(self)
+        self.hierarchy = SnapshotHierarchy(self)
+        self.fragments = SnapshotFragments(self)
+        self.concept_maps = SnapshotCandidates(self, sources, maps)
+
+    def __len__(self) -> int:
+        return self._codes
+
+    def _bytes(self, string_id: int) -> memoryview:
+        return self._blob[self._string_offsets[string_id]:self._string_offsets[string_id + 1]]
+
+    def _string(self, string_id: int) -> Optional[str]:
+        if string_id == NONE:
+            return None
+        return str(self._bytes(string_id), "utf-8")
+
+    def row_of(self, code: str) -> Optional[int]:
+        """Position of `code` in the code rows, through the hash index."""
+        key = code.encode("utf-8")
+        slot = zlib.crc32(key) & self._mask
+        while True:
+            entry = self._slots[slot]
+            if not entry:
+                return None
+            if self._bytes(self._code_ids[(entry - 1) * _CODE_COLUMNS]) == key:
+                return entry - 1
+            slot = (slot + 1) & self._mask
+
+    def code(self, row: int) -> str:
+        return self._string(self._code_ids[row * _CODE_COLUMNS])
+
+    def code_row(self, row: int) -> CodeRow:
+        start = row * _CODE_COLUMNS
+        return tuple(self._string(string_id) for string_id in self._code_ids[start:start + _ROW_COLUMNS])
+
+    def lookup(self, code: str) -> Optional[CodeRow]:
+        """The row of `code`, or None when it is not in the snapshot."""
+        row = self.row_of(code)
+        return None if row is None else self.code_row(row)
+
+    def rows(self) -> Iterator[CodeRow]:
+        return (self.code_row(row) for row in range(self._codes))
+
+    def fragment(self, row: int, column: int) -> memoryview:
+        return self._bytes(self._code_ids[row * _CODE_COLUMNS + column])
+
+    def mapping(self, source_code: str, index: int) -> CachedMapping:
+        start = index * _MAP_COLUMNS
+        target, display, equivalence = (self._string(i) for i in self._map_ids[start:start + 3])
+        rank, score = self._ranks[index], self._scores[index]
+        return CachedMapping(source_code, target, display, equivalence,
+                             None if rank < 0 else rank, None if math.isnan(score) else score)
+
+    def match_fragment(self, row: int, target_code: str) -> Optional[memoryview]:
+        """The match fragment of one candidate of the code at `row`."""
+        key = target_code.encode("utf-8")
+        for index in self.candidate_range(row):
+            if self._bytes(self._map_ids[index * _MAP_COLUMNS]) == key:
+                return self._bytes(self._map_ids[index * _MAP_COLUMNS + 3])
+        return None
+
+    def candidate_range(self, row: int) -> Sequence[int]:
+        return range(self._map_offsets[row], self._map_offsets[row + 1])
+
+
+class SnapshotConcepts:
+    """Code rows by code, read through the hash index; a read-only stand-in for a dict of CodeRow."""
+
+    def __init__(self, snapshot: Snapshot):
+        self._snapshot = snapshot
+
+    def __len__(self) -> int:
+        return len(self._snapshot)
+
+    def __contains__(self, code: str) -> bool:
+        return self._snapshot.row_of(code) is not None
+
+    def __getitem__(self, code: str) -> CodeRow:
+        row = self._snapshot.lookup(code)
+        if row is None:
+            raise KeyError(code)
+        return row
+
+    def get(self, code: str, default=None):
+        row = self._snapshot.lookup(code)
+        return default if row is None else row
+
+
+class SnapshotHierarchy:
+    """The hierarchy of a snapshot, with the same lookups as Hierarchy."""
+
+    def __init__(self, snapshot: Snapshot):
+        self._snapshot = snapshot
+
+    def __len__(self) -> int:
+        return len(self._snapshot)
+
+    def __contains__(self, code: str) -> bool:
+        return self._snapshot.row_of(code) is not None
+
+    def _position(self, code: str) -> int:
+        row = self._snapshot.row_of(code)
+        if row is None:
+            raise KeyError(code)
+        return self._snapshot._positions[row]
+
+    def _code_at(self, position: int) -> str:
+        return self._snapshot.code(self._snapshot._preorder[position])
+
+    def parent(self, code: str) -> Optional[str]:
+        row = self._snapshot.row_of(code)
+        if row is None or self._snapshot._parents[row] == NONE:
+            return None
+        return self._snapshot.code(self._snapshot._parents[row])
+
+    def children(self, code: Optional[str] = None) -> List[str]:
+        """Direct children of `code`, or the roots when code is None."""
+        if code is not None and code not in self:
+            return []
+        start, end = self._run(code)
+        children = []
+        # Each child's subtree follows it in preorder, so the next sibling is one subtree further on.
+        while start < end:
+            children.append(self._code_at(start))
+            start += self._snapshot._sizes[start] + 1
+        return children
+
+    def ancestors(self, code: str) -> List[str]:
+        """From the root down to the parent of `code`."""
+        chain = []
+        row = self._snapshot.row_of(code)
+        parent = NONE if row is None else self._snapshot._parents[row]
+        while parent != NONE:
+            chain.append(self._snapshot.code(parent))
+            parent = self._snapshot._parents[parent]
+        return chain[::-1]
+
+    def depth(self, code: str) -> int:
+        return self._snapshot._depths[self._position(code)]
+
+    def descendant_count(self, code: Optional[str] = None) -> int:
+        return len(self._snapshot) if code is None else self._snapshot._sizes[self._position(code)]
+
+    def _run(self, code: Optional[str]) -> Tuple[int, int]:
+        if code is None:
+            return 0, len(self._snapshot)
+        start = self._position(code) + 1
+        return start, start + self._snapshot._sizes[start - 1]
+
+    def descendants(self, code: Optional[str] = None, offset: int = 0, count: Optional[int] = None) -> List[str]:
+        """A page of the descendants of `code` (of every code when None), in preorder."""
+        start, end = self._run(code)
+        start += offset
+        if count is not None:
+            end = min(end, start + count)
+        return [self._code_at(position) for position in range(start, end)]
+
+    def iter_descendants(self, code: Optional[str] = None) -> Iterator[str]:
+        start, end = self._run(code)
+        return (self._code_at(position) for position in range(start, end))
+
+
+class SnapshotFragments(fragments.Fragments):
+    """The pre-rendered fragments of a snapshot, read from it as bytes."""
+
+    def __init__(self, snapshot: Snapshot):
+        super().__init__()
+        self._snapshot = snapshot
+
+    def search_fragment(self, code: str) -> Optional[memoryview]:
+        row = self._snapshot.row_of(code)
+        return None if row is None else self._snapshot.fragment(row, _SEARCH)
+
+    def autocomplete_fragment(self, code: str) -> Optional[memoryview]:
+        row = self._snapshot.row_of(code)
+        return None if row is None else self._snapshot.fragment(row, _AUTOCOMPLETE)
+
+    def match_fragment(self, mapping) -> Optional[memoryview]:
+        row = self._snapshot.row_of(mapping.source_code)
+        return None if row is None else self._snapshot.match_fragment(row, mapping.target_code)
+
+
+class SnapshotCandidates:
+    """The concept map of a snapshot, with the same lookups as CandidateIndex."""
+
+    def __init__(self, snapshot: Snapshot, sources: int, maps: int):
+        self._snapshot = snapshot
+        self.sources = sources
+        self._maps = maps
+
+    def __len__(self) -> int:
+        return self._maps
+
+    def __contains__(self, source_code: str) -> bool:
+        row = self._snapshot.row_of(source_code)
+        return row is not None and len(self._snapshot.candidate_range(row)) > 0
+
+    def __iter__(self) -> Iterator[CachedMapping]:
+        for row in range(len(self._snapshot)):
+            candidates = self._snapshot.candidate_range(row)
+            if candidates:
+                source_code = self._snapshot.code(row)
+                for index in candidates:
+                    yield self._snapshot.mapping(source_code, index)
+
+    def candidates(self, source_code: str, top_k: int = 1, min_score: Optional[float] = None) -> List[CachedMapping]:
+        row = self._snapshot.row_of(source_code)
+        if row is None:
+            return []
+        found = []
+        for index in self._snapshot.candidate_range(row):
+            # NaN (no score) never passes a score threshold.
+            if min_score is not None and not self._snapshot._scores[index] >= min_score:
+                continue
+            found.append(self._snapshot.mapping(source_code, index))
+            if len(found) >= top_k:
+                break
+        return found
+
+
+def open_snapshot(path: str) -> Optional[Snapshot]:
+    """Maps the snapshot at `path`, or returns None if there is none or it is unreadable."""
+    try:
+        with open(path, "rb") as f:
+            stat = os.fstat(f.fileno())
+            mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        return Snapshot(mapped, path, stat)
+    except (OSError, ValueError, SnapshotError):
+        return None
@@ -0,0 +1,161 @@
+"""
+Offline NAMASTE -> ICD-11 candidate suggestions.
+
+NAMASTE terms and definitions and the ICD-11 titles already known from the
+concept map are embedded as character n-gram TF-IDF vectors in one shared
+vocabulary. Candidates for any set of codes are scored with a sparse matrix
+product against every ICD title at once, in row batches so memory stays
+bounded, and the best `top_k` are picked with argpartition.
+
+numpy and scipy are optional dependencies; without them AVAILABLE is False and
+the suggestion endpoints answer 503.
+"""
+import os
+import re
+from collections import Counter
+from typing import Dict, Iterable, List, NamedTuple, Optional, Sequence, Tuple
+
+from sqlalchemy.orm import Session
+
+from . import models
+from .search_index import tokenize
+
+try:
+    import numpy as np
+    from scipy import sparse
+except ImportError:  # the suggestion engine is optional
+    np = None
+    sparse = None
+
+AVAILABLE = np is not None and sparse is not None
+
+NGRAM_MIN = 2
+NGRAM_MAX = 4
+SCORE_BATCH_ROWS = int(os.getenv("SUGGEST_BATCH_ROWS", "1024"))
+
+# ICD-11 linearization titles carry their depth as leading "- - -" markers.
+_DEPTH_MARKERS = re.compile(r"^[\s-]+")
+
+
+class Suggestion(NamedTuple):
+    target_code: str
+    target_display: str
+    score: float
+
+
+def clean_title(title: Optional[str]) -> str:
+    return _DEPTH_MARKERS.sub("", title or "").strip()
+
+
+def ngrams(text: Optional[str]) -> Counter:
+    """Character n-grams of every folded word, padded so word starts and ends count."""
+    grams: Counter = Counter()
+    for token in tokenize(text):
+        padded = f" {token} "
+        for n in range(NGRAM_MIN, NGRAM_MAX + 1):
+            grams.update(padded[i:i + n] for i in range(len(padded) - n + 1))
+    return grams
+
+
+def namaste_text(term: Optional[str], short_definition: Optional[str]) -> str:
+    return f"{term or ''} {short_definition or ''}"
+
+
+class SuggestionEngine:
+    """
+    TF-IDF n-gram vectors of NAMASTE codes (in `codes` order) and ICD-11 titles
+    (in `targets` order), L2-normalized so a matrix product gives cosine scores.
+    """
+
+    def __init__(self, codes: Iterable[Tuple[str, Optional[str], Optional[str]]],
+                 targets: Iterable[Tuple[str, Optional[str]]], mapped: Iterable[str] = ()):
+        if not AVAILABLE:
+            raise RuntimeError("The suggestion engine requires numpy and scipy.")
+        codes = list(codes)
+        self.codes: List[str] = [code for code, _, _ in codes]
+        self._rows: Dict[str, int] = {code: i for i, code in enumerate(self.codes)}
+        titles: Dict[str, str] = {}
+        for target_code, display in targets:
+            titles.setdefault(target_code, clean_title(display))
+        self.targets: List[Tuple[str, str]] = sorted(titles.items())
+        mapped = set(mapped)
+        self.unmapped: List[str] = [code for code in self.codes if code not in mapped]
+
+        code_grams = [ngrams(namaste_text(term, definition)) for _, term, definition in codes]
+        target_grams = [ngrams(title) for _, title in self.targets]
+        vocabulary: Dict[str, int] = {}
+        for grams in code_grams + target_grams:
+            for gram in grams:
+                vocabulary.setdefault(gram, len(vocabulary))
+        self.vocabulary_size = len(vocabulary)
+
+        code_counts = self._counts(code_grams, vocabulary)
+        target_counts = self._counts(target_grams, vocabulary)
+        documents = len(code_grams) + len(target_grams)
+        df = np.bincount(code_counts.indices, minlength=self.vocabulary_size) + \
+            np.bincount(target_counts.indices, minlength=self.vocabulary_size)
+        idf = np.log((1 + documents) / (1 + df)) + 1.0
+        self._code_vectors = self._weigh(code_counts, idf)
+        # Stored transposed, so scoring a batch of codes is one CSR x CSC product.
+        self._target_vectors_t = self._weigh(target_counts, idf).T.tocsc()
+
+    @staticmethod
+    def _counts(documents: Sequence[Counter], vocabulary: Dict[str, int]):
+        indptr, indices, data = [0], [], []
+        for grams in documents:
+            indices.extend(vocabulary[gram] for gram in grams)
+            data.extend(grams.values())
+            indptr.append(len(indices))
+        return sparse.csr_matrix(
+            (np.asarray(data, dtype=np.float32), np.asarray(indices, dtype=np.int32), np.asarray(indptr, dtype=np.int32)),
+            shape=(len(documents), len(vocabulary))
+        )
+
+    @staticmethod
+    def _weigh(counts, idf):
+        """Sublinear term frequency times idf, each row scaled to unit length."""
+        weighted = counts.copy()
+        weighted.data = (1.0 + np.log(weighted.data)) * idf[weighted.indices].astype(np.float32)
+        norms = np.sqrt(np.asarray(weighted.multiply(weighted).sum(axis=1)).ravel())
+        norms[norms == 0] = 1.0
+        return sparse.diags(1.0 / norms).dot(weighted).tocsr()
+
+    def __len__(self) -> int:
+        return len(self.codes)
+
+    def __contains__(self, code: str) -> bool:
+        return code in self._rows
+
+    def suggest(self, code: str, top_k: int = 5) -> List[Suggestion]:
+        return self.suggest_many([code], top_k).get(code, [])
+
+    def suggest_many(self, codes: Optional[Iterable[str]] = None, top_k: int = 5) -> Dict[str, List[Suggestion]]:
+        """Ranked candidates for `codes` (every unmapped code by default); unknown codes are left out."""
+        codes = self.unmapped if codes is None else [code for code in dict.fromkeys(codes) if code in self._rows]
+        results: Dict[str, List[Suggestion]] = {}
+        if not codes or not self.targets:
+            return {code: [] for code in codes}
+        top_k = min(top_k, len(self.targets))
+        rows = np.fromiter((self._rows[code] for code in codes), dtype=np.int64, count=len(codes))
+        for start in range(0, len(rows), SCORE_BATCH_ROWS):
+            batch = rows[start:start + SCORE_BATCH_ROWS]
+            scores = self._code_vectors[batch].dot(self._target_vectors_t).toarray()
+            best = np.argpartition(-scores, top_k - 1, axis=1)[:, :top_k]
+            best_scores = np.take_along_axis(scores, best, axis=1)
+            order = np.argsort(-best_scores, axis=1, kind="stable")
+            best = np.take_along_axis(best, order, axis=1)
+            best_scores = np.take_along_axis(best_scores, order, axis=1)
+            for offset, row in enumerate(batch):
+                results[self.codes[row]] = [
+                    Suggestion(self.targets[target][0], self.targets[target][1], round(float(score), 6))
+                    for target, score in zip(best[offset], best_scores[offset]) if score > 0
+                ]
+        return results
+
+
+def load_engine(db: Session) -> SuggestionEngine:
+    """Builds an engine from namaste_codesystem and the ICD-11 titles in concept_map."""
+    codes = db.query(models.NamasteCode.code, models.NamasteCode.term, models.NamasteCode.short_definition).all()
+    targets = db.query(models.ConceptMap.target_code, models.ConceptMap.target_display).distinct().all()
+    mapped = [code for code, in db.query(models.ConceptMap.source_code).distinct()]
+    return SuggestionEngine(codes, targets, mapped)
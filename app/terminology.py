@@ -0,0 +1,213 @@
+"""
+In-memory views of the terminology tables.
+
+The NAMASTE code system only changes when ingestion runs, so the read endpoints
+answer from structures built here at startup and rebuilt after every ingestion.
+Every view is tagged with the terminology version stamped by that ingestion.
+
+A reload from the database also writes a snapshot file (see snapshot.py) that
+other workers on the host map instead of querying the database; they pick up a
+new snapshot by polling its file status, and install it only when it holds the
+version stamped in the database. Code lookups, the hierarchy, the pre-rendered
+fragments and the concept map are served from the mapped file; only the search
+and prefix indexes are built in each worker from the snapshot's rows.
+"""
+import datetime
+import hashlib
+import logging
+import os
+import tempfile
+import threading
+from typing import Any, Callable, Dict, Mapping, Optional, Tuple
+
+from sqlalchemy.orm import Session
+
+from sqlalchemy.engine import make_url
+
+from . import models, snapshot
+from .autocomplete import PrefixIndex
+from .concept_map_cache import ConceptMapCache, load_mappings
+from .database import DATABASE_URL
+from .fragments import Fragments
+from .hierarchy import Hierarchy
+from .http_cache import Payload, make_etag
+from .search_cache import SearchCache
+from .search_index import SearchIndex
+from .suggest import SuggestionEngine, load_engine
+
+logger = logging.getLogger(__name__)
+
+UNVERSIONED = "0"
+
+# One file per database, so deployments sharing a host never install each other's snapshot.
+_DATABASE_KEY = hashlib.sha256(make_url(DATABASE_URL).render_as_string(hide_password=True).encode("utf-8")).hexdigest()[:12]
+# An empty path disables the snapshot file; every worker then loads from the database.
+SNAPSHOT_PATH = os.getenv(
+    "TERMINOLOGY_SNAPSHOT_PATH", os.path.join(tempfile.gettempdir(), f"accura-terminology-{_DATABASE_KEY}.snapshot")
+)
+SNAPSHOT_POLL_SECONDS = float(os.getenv("TERMINOLOGY_SNAPSHOT_POLL_SECONDS", "5"))
+
+version = UNVERSIONED
+# When this worker installed the current version; the timestamp of $expand results.
+installed_at = datetime.datetime.now(datetime.timezone.utc)
+search_index = SearchIndex()
+prefix_index = PrefixIndex()
+concept_maps = ConceptMapCache()
+search_results = SearchCache()
+fragments = Fragments()
+hierarchy = Hierarchy()
+concepts: Mapping[str, snapshot.CodeRow] = {}
+_payloads: Dict[Tuple[str, str], Payload] = {}
+_suggester: Optional[Tuple[str, SuggestionEngine]] = None
+_suggester_lock = threading.Lock()
+mapped_snapshot: Optional[snapshot.Snapshot] = None
+# File status of the last snapshot refused for its version, so it is checked once.
+_ignored_stat: Optional[Tuple[int, int]] = None
+
+
+def content_version(db: Session) -> str:
+    """Hashes the terminology tables, so identical content always gets the same version."""
+    digest = hashlib.sha256()
+    codes = db.query(
+        models.NamasteCode.code, models.NamasteCode.term, models.NamasteCode.term_diacritical,
+        models.NamasteCode.term_devanagari, models.NamasteCode.short_definition
+    ).order_by(models.NamasteCode.code)
+    maps = db.query(
+        models.ConceptMap.source_code, models.ConceptMap.target_code, models.ConceptMap.target_display,
+        models.ConceptMap.equivalence, models.ConceptMap.rank, models.ConceptMap.similarity_score
+    ).order_by(models.ConceptMap.source_code, models.ConceptMap.target_code)
+    for query in (codes, maps):
+        for row in query:
+            digest.update("\x1f".join("" if value is None else str(value) for value in row).encode("utf-8"))
+            digest.update(b"\x1e")
+        digest.update(b"\x1d")
+    return digest.hexdigest()[:16]
+
+
+def stamp_version(db: Session) -> str:
+    """Records a new terminology version for the current table contents; the caller commits."""
+    stamped = models.TerminologyVersion(
+        version=content_version(db),
+        namaste_codes=db.query(models.NamasteCode).count(),
+        concept_maps=db.query(models.ConceptMap).count()
+    )
+    db.add(stamped)
+    return stamped.version
+
+
+def current_version(db: Session) -> str:
+    latest = db.query(models.TerminologyVersion.version).order_by(models.TerminologyVersion.id.desc()).first()
+    return latest[0] if latest else UNVERSIONED
+
+
+def _map(source: snapshot.Snapshot):
+    """Swaps in the views read straight from `source`."""
+    global fragments, hierarchy, concepts, mapped_snapshot
+    fragments, hierarchy, concepts = source.fragments, source.hierarchy, source.concepts
+    concept_maps.replace_index(source.concept_maps)
+    mapped_snapshot = source
+
+
+def _install(source: snapshot.Snapshot):
+    """Swaps in the views of the snapshot's version: search indexes built from its rows, the rest mapped."""
+    global version, installed_at, search_index, prefix_index, _payloads, _suggester
+    new_search_index = SearchIndex((code, term, definition) for code, term, _, _, definition in source.rows())
+    new_prefix_index = PrefixIndex((code, term, diacritical, devanagari) for code, term, diacritical, devanagari, _ in source.rows())
+    # Responses are assembled from the fragments, so they are swapped in together with the indexes.
+    version, search_index, prefix_index = source.version, new_search_index, new_prefix_index
+    _map(source)
+    installed_at = datetime.datetime.now(datetime.timezone.utc)
+    search_results.clear()
+    _payloads = {}
+    _suggester = None
+
+
+def reload(db: Session):
+    """Rebuilds every in-memory view from the database, swaps it in atomically and writes the snapshot."""
+    rows = db.query(
+        models.NamasteCode.code, models.NamasteCode.term, models.NamasteCode.term_diacritical,
+        models.NamasteCode.term_devanagari, models.NamasteCode.short_definition
+    ).all()
+    data = snapshot.build(current_version(db), rows, load_mappings(db))
+    source = None
+    if SNAPSHOT_PATH:
+        try:
+            snapshot.write(SNAPSHOT_PATH, data)
+            source = snapshot.open_snapshot(SNAPSHOT_PATH)
+        except OSError as e:
+            logger.warning("Could not write the terminology snapshot to %s: %s", SNAPSHOT_PATH, e)
+    # Without the file the same snapshot is served from this worker's memory.
+    _install(source if source is not None else snapshot.Snapshot(data))
+    return len(search_index)
+
+
+def load(db: Session):
+    """Startup: maps the snapshot when it holds the current version, otherwise reloads from the database."""
+    if SNAPSHOT_PATH:
+        source = snapshot.open_snapshot(SNAPSHOT_PATH)
+        if source is not None and source.version == current_version(db):
+            _install(source)
+            return len(search_index)
+    return reload(db)
+
+
+def refresh_from_snapshot(session_factory: Callable[[], Session]) -> bool:
+    """
+    Installs the snapshot if another worker replaced it with the version stamped in
+    the database; returns whether it did. A snapshot of any other version (a stale
+    file, or one left by another deployment) is never installed.
+    """
+    global _ignored_stat
+    if not SNAPSHOT_PATH:
+        return False
+    try:
+        current = os.stat(SNAPSHOT_PATH)
+    except OSError:
+        return False
+    key = (current.st_ino, current.st_mtime_ns)
+    mapped = mapped_snapshot.stat if mapped_snapshot is not None else None
+    if key == _ignored_stat or (mapped is not None and key == (mapped.st_ino, mapped.st_mtime_ns)):
+        return False
+    source = snapshot.open_snapshot(SNAPSHOT_PATH)
+    if source is None:
+        return False
+    with session_factory() as db:
+        stamped = current_version(db)
+    if source.version != stamped:
+        logger.warning("Ignoring terminology snapshot %s: version %s, database has %s", SNAPSHOT_PATH, source.version, stamped)
+        _ignored_stat = key
+        return False
+    if source.version == version:
+        # Same content rewritten by another worker: remap it so the old file can be released.
+        _map(source)
+        return False
+    _install(source)
+    logger.info("Loaded terminology version %s from %s", source.version, SNAPSHOT_PATH)
+    return True
+
+
+def payload(name: str, build: Callable[[], Any]) -> Payload:
+    """Returns the serialized payload `name` for the current version, building it on first use."""
+    key = (version, name)
+    cached = _payloads.get(key)
+    if cached is None:
+        cached = _payloads[key] = Payload(make_etag(version, name), build())
+    return cached
+
+
+def etag(*parts: str) -> str:
+    return make_etag(version, *parts)
+
+
+def suggester(session_factory: Callable[[], Session]) -> SuggestionEngine:
+    """
+    The mapping suggestion engine for the current version. It takes a few seconds
+    to fit, so it is built on first use rather than on every reload.
+    """
+    global _suggester
+    with _suggester_lock:
+        if _suggester is None or _suggester[0] != version:
+            built_for = version
+            with session_factory() as db:
+                _suggester = (built_for, load_engine(db))
+        return _suggester[1]
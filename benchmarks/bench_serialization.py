@@ -0,0 +1,122 @@
+"""
+Benchmarks response serialization of the terminology read endpoints.
+
+Reads the bundled CSVs through the ingestion parsers, so no database is needed:
+
+    python benchmarks/bench_serialization.py [--requests 2000] [--top-k 3]
+
+The dict path is what the endpoints did before: build dicts, validate them
+against the response model (search, autocomplete) or run jsonable_encoder
+(translate) and render a JSONResponse. The fragment path joins the bytes
+pre-rendered for the terminology version. Both must produce the same JSON; the
+report gives CPU time per response and payload size.
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import time
+from collections import defaultdict
+from typing import List
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from fastapi.encoders import jsonable_encoder  # noqa: E402
+from fastapi.responses import JSONResponse  # noqa: E402
+from pydantic import TypeAdapter  # noqa: E402
+
+from app import fhir, fragments, ingestion_logic, schemas  # noqa: E402
+from app.autocomplete import PrefixIndex  # noqa: E402
+from app.concept_map_cache import CachedMapping, CandidateIndex  # noqa: E402
+from app.search_index import SearchIndex  # noqa: E402
+
+
+def load_csvs():
+    stats = defaultdict(int)
+    rows = [values[1:-1] for chunk in ingestion_logic._read_chunks(
+        ingestion_logic.NAMASTE_CSV_PATH, ingestion_logic._namaste_row, stats) for values in chunk]
+    mappings = [CachedMapping(*values[1:-1]) for chunk in ingestion_logic._read_chunks(
+        ingestion_logic.CONCEPT_MAP_CSV_PATH, ingestion_logic._concept_map_row, stats) for values in chunk]
+    # Duplicate (source, target) rows collapse to the last one, as the upsert does.
+    mappings = list({(m.source_code, m.target_code): m for m in mappings}.values())
+    return rows, mappings
+
+
+def cpu_per_call(calls, render) -> float:
+    """CPU microseconds per call, best of three passes."""
+    best = None
+    for _ in range(3):
+        start = time.process_time()
+        for call in calls:
+            render(call)
+        elapsed = time.process_time() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best / len(calls) * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--requests', type=int, default=2000, help='responses rendered per endpoint and path')
+    parser.add_argument('--top-k', type=int, default=3)
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    rows, mappings = load_csvs()
+    search_index = SearchIndex((code, term, definition) for code, term, _, _, definition in rows)
+    prefix_index = PrefixIndex((code, term, diacritical, devanagari) for code, term, diacritical, devanagari, _ in rows)
+    index = CandidateIndex(mappings)
+    start = time.perf_counter()
+    views = fragments.Fragments(rows, index)
+    build_ms = (time.perf_counter() - start) * 1000
+
+    rng = random.Random(args.seed)
+    words = sorted({word.lower() for _, term, *_ in rows for word in term.replace('-', ' ').split() if len(word) > 3})
+    searches = [search_index.search(rng.choice(words), 15) for _ in range(args.requests)]
+    completions = [prefix_index.complete(rng.choice(words)[:3], 10) for _ in range(args.requests)]
+    sources = sorted({m.source_code for m in mappings})
+    translations = [index.candidates(rng.choice(sources), args.top_k) for _ in range(args.requests)]
+    batches = [[(code, index.candidates(code, args.top_k)) for code in rng.sample(sources + ['UNMAPPED'], 50)]
+               for _ in range(max(args.requests // 20, 1))]
+
+    search_model = TypeAdapter(List[schemas.NamasteTerm])
+    autocomplete_model = TypeAdapter(List[schemas.AutocompleteSuggestion])
+
+    def model_response(model, content):
+        return JSONResponse(model.dump_python(model.validate_python(content), mode='json')).body
+
+    def batch_dicts(results):
+        return fhir.translate_batch_bundle([
+            fhir.translate_parameters(candidates) if candidates else fhir.translate_not_found(code) for code, candidates in results
+        ])
+
+    endpoints = [
+        ('search', searches,
+         lambda r: model_response(search_model, [{"code": c, "term": t, "short_definition": d} for c, t, d in r]),
+         lambda r: fragments.FastJSONResponse(views.search(r)).body),
+        ('autocomplete', completions,
+         lambda r: model_response(autocomplete_model, [
+             {"code": c, "term": t, "term_diacritical": a, "term_devanagari": v} for c, t, a, v in r]),
+         lambda r: fragments.FastJSONResponse(views.autocomplete(r)).body),
+        ('translate', translations,
+         lambda r: JSONResponse(jsonable_encoder(fhir.translate_parameters(r))).body,
+         lambda r: fragments.FastJSONResponse(views.translate_parameters(r)).body),
+        ('translate/batch', batches,
+         lambda r: JSONResponse(jsonable_encoder(batch_dicts(r))).body,
+         lambda r: fragments.FastJSONResponse(views.translate_batch_bundle(r)).body),
+    ]
+
+    print(f"{len(rows)} codes, {len(mappings)} mappings, fragments built in {build_ms:.1f} ms"
+          f" ({'orjson' if fragments.orjson is not None else 'json'})")
+    print(f"{'endpoint':<16}{'dicts us':>10}{'fragments us':>14}{'reduction':>11}{'bytes':>9}")
+    for name, calls, old, new in endpoints:
+        for call in calls:
+            if json.loads(old(call)) != json.loads(new(call)):
+                sys.exit(f"{name}: fragment response differs from the dict response for {call!r}")
+        old_us, new_us = cpu_per_call(calls, old), cpu_per_call(calls, new)
+        size = sum(len(new(call)) for call in calls) / len(calls)
+        print(f"{name:<16}{old_us:>10.1f}{new_us:>14.1f}{1 - new_us / old_us:>10.0%}{size:>9.0f}")
+
+
+if __name__ == '__main__':
+    main()
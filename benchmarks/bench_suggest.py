@@ -0,0 +1,107 @@
+"""
+Benchmarks the vectorized mapping suggestion engine against per-row scoring.
+
+Reads the bundled CSVs directly, so no database is needed:
+
+    python benchmarks/bench_suggest.py [--top-k 5] [--repeat 3]
+
+The baseline scores every (NAMASTE code, ICD title) pair in Python with the same
+TF-IDF weights. Both must agree on the top candidate; the report also gives the
+engine's recall of the curated mapping, using the codes that already have one.
+"""
+import argparse
+import csv
+import math
+import os
+import sys
+import time
+from collections import Counter
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from app import ingestion_logic, suggest  # noqa: E402
+
+
+def load_csvs():
+    with open(ingestion_logic.NAMASTE_CSV_PATH, encoding='utf-8', newline='') as f:
+        reader = csv.DictReader(f)
+        reader.fieldnames = [name.strip() for name in reader.fieldnames]
+        codes = [(row['NAMC_CODE'].strip(), row['NAMC_term'], row['short_definition']) for row in reader if row['NAMC_CODE'].strip()]
+    with open(ingestion_logic.CONCEPT_MAP_CSV_PATH, encoding='utf-8', newline='') as f:
+        curated = [(row['ayurveda_code'].strip(), row['icd_code'].strip(), row['icd_title'])
+                   for row in csv.DictReader(f) if row['ayurveda_code'].strip() and row['icd_code'].strip()]
+    return codes, curated
+
+
+def per_row_scores(codes, targets, top_k):
+    """Builds dict vectors with the engine's weighting and scores every pair one by one."""
+    code_grams = [suggest.ngrams(suggest.namaste_text(term, definition)) for _, term, definition in codes]
+    target_grams = [suggest.ngrams(title) for _, title in targets]
+    df = Counter()
+    for grams in code_grams + target_grams:
+        df.update(grams.keys())
+    documents = len(code_grams) + len(target_grams)
+
+    def vector(grams):
+        weights = {g: (1 + math.log(n)) * (math.log((1 + documents) / (1 + df[g])) + 1) for g, n in grams.items()}
+        norm = math.sqrt(sum(w * w for w in weights.values())) or 1.0
+        return {g: w / norm for g, w in weights.items()}
+
+    target_vectors = [vector(grams) for grams in target_grams]
+    results = {}
+    for (code, _, _), grams in zip(codes, code_grams):
+        query = vector(grams)
+        scored = []
+        for (target_code, _), target in zip(targets, target_vectors):
+            score = sum(weight * target.get(gram, 0.0) for gram, weight in query.items())
+            if score > 0:
+                scored.append((score, target_code))
+        scored.sort(key=lambda item: -item[0])
+        results[code] = [target_code for _, target_code in scored[:top_k]]
+    return results
+
+
+def best_of(repeat, fn):
+    timings, result = [], None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        timings.append(time.perf_counter() - start)
+    return min(timings), result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--top-k', type=int, default=5)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+    if not suggest.AVAILABLE:
+        sys.exit("numpy and scipy are required for this benchmark.")
+
+    codes, curated = load_csvs()
+    mapped = {source for source, _, _ in curated}
+    print(f"{len(codes)} NAMASTE codes, {len({target for _, target, _ in curated})} ICD-11 titles, {len(mapped)} curated mappings")
+
+    fit_seconds, engine = best_of(args.repeat, lambda: suggest.SuggestionEngine(
+        codes, [(target, title) for _, target, title in curated], mapped))
+    all_codes = [code for code, _, _ in codes]
+    vectorized_seconds, vectorized = best_of(args.repeat, lambda: engine.suggest_many(all_codes, args.top_k))
+    per_row_seconds, per_row = best_of(1, lambda: per_row_scores(codes, engine.targets, args.top_k))
+
+    agree = sum(1 for code in all_codes if vectorized[code][:1] and per_row[code][:1] == [vectorized[code][0].target_code])
+    expected = {}
+    for source, target, _ in curated:
+        expected.setdefault(source, set()).add(target)
+    hits_at_1 = sum(1 for code in expected if {s.target_code for s in vectorized.get(code, [])[:1]} & expected[code])
+    hits_at_k = sum(1 for code in expected if {s.target_code for s in vectorized.get(code, [])} & expected[code])
+
+    print(f"fit:                 {fit_seconds * 1000:9.1f} ms")
+    print(f"vectorized, all:     {vectorized_seconds * 1000:9.1f} ms")
+    print(f"per-row, all:        {per_row_seconds * 1000:9.1f} ms  ({per_row_seconds / vectorized_seconds:.0f}x slower)")
+    print(f"top-1 agreement:     {agree}/{len(all_codes)}")
+    print(f"curated recall@1:    {hits_at_1}/{len(expected)}")
+    print(f"curated recall@{args.top_k}:    {hits_at_k}/{len(expected)}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,300 @@
+"""
+Endpoint load test and ingestion micro-benchmarks with local stand-ins.
+
+Seeds a database from the bundled CSVs, starts the mock ABHA/EMR server and the
+service on local ports, drives concurrent load against the main endpoints and
+writes a JSON report:
+
+    python benchmarks/load_test.py --requests 2000 --concurrency 32 --output report.json
+    python benchmarks/load_test.py --baseline report.json --max-regression 0.2
+
+A throwaway SQLite database is used unless --database-url points at Postgres.
+With --baseline, the run exits non-zero if any scenario's p95 latency or
+throughput regressed by more than --max-regression, so CI can gate on it.
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import math
+import os
+import platform
+import random
+import sys
+import tempfile
+import threading
+import time
+import urllib.parse
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(__file__))
+
+import httpx  # noqa: E402
+import uvicorn  # noqa: E402
+
+import mock_abha  # noqa: E402
+
+SCENARIOS = ("search", "translate", "names_only", "confirm", "history")
+PATIENTS = 20
+
+
+# --- Measurement ---
+
+class QueryCounter:
+    """
+    Counts statements sent to the database by the sync and async engines, and
+    pool checkouts; a checkout costs a pre-ping round trip even when no
+    statement follows.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.count = 0
+        self.checkouts = 0
+
+    def __call__(self, *args):
+        with self._lock:
+            self.count += 1
+
+    def _checkout(self, *args):
+        with self._lock:
+            self.checkouts += 1
+
+    def attach(self, *engines):
+        from sqlalchemy import event
+        for engine in engines:
+            event.listen(engine, "before_cursor_execute", self)
+            event.listen(engine, "checkout", self._checkout)
+
+
+def percentile(sorted_values, p):
+    if not sorted_values:
+        return None
+    return sorted_values[max(math.ceil(p / 100 * len(sorted_values)) - 1, 0)]
+
+
+def summarize(latencies, errors, seconds, queries, checkouts):
+    ordered = sorted(latencies)
+    total = len(ordered)
+    return {
+        "requests": total,
+        "errors": errors,
+        "seconds": round(seconds, 4),
+        "throughput_rps": round(total / seconds, 1) if seconds else None,
+        "latency_ms": {
+            "mean": round(sum(ordered) / total * 1000, 3) if total else None,
+            **{f"p{p}": round(percentile(ordered, p) * 1000, 3) if total else None for p in (50, 95, 99)},
+            "max": round(ordered[-1] * 1000, 3) if total else None,
+        },
+        "queries_per_request": round(queries / total, 3) if total else None,
+        "checkouts_per_request": round(checkouts / total, 3) if total else None,
+    }
+
+
+async def drive(client, make_request, total, concurrency, counter):
+    """Sends `total` requests from `concurrency` workers; returns the scenario summary."""
+    latencies, errors, sequence = [], 0, itertools.count()
+
+    async def worker():
+        nonlocal errors
+        while (i := next(sequence)) < total:
+            method, url, kwargs = make_request(i)
+            start = time.perf_counter()
+            response = await client.request(method, url, **kwargs)
+            latencies.append(time.perf_counter() - start)
+            if response.status_code >= 400:
+                errors += 1
+
+    queries_before, checkouts_before = counter.count, counter.checkouts
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return summarize(latencies, errors, time.perf_counter() - start, counter.count - queries_before,
+                     counter.checkouts - checkouts_before)
+
+
+# --- Setup ---
+
+def configure_environment(args, mock_url):
+    """Points the service at the stand-ins; must run before the app is imported."""
+    workdir = tempfile.mkdtemp(prefix="accura-bench-")
+    os.environ["DATABASE_URL"] = args.database_url or f"sqlite:///{os.path.join(workdir, 'bench.db')}"
+    os.environ["ABHA_SERVER_URL"] = mock_url
+    os.environ["FHIR_BUNDLE_ENDPOINT"] = f"{mock_url}/fhir/bundle"
+    os.environ["TERMINOLOGY_SNAPSHOT_PATH"] = os.path.join(workdir, "terminology.snapshot")
+    return workdir
+
+
+def ingestion_benchmarks(ingestion_logic, SessionLocal, repeat):
+    """Times both CSV loaders twice: the first run as seeded, the second with every row unchanged."""
+    results = {}
+    for name, load in (("namaste_codes", ingestion_logic.ingest_namaste_codes),
+                       ("concept_map", ingestion_logic.ingest_concept_map)):
+        runs = []
+        for _ in range(repeat):
+            with SessionLocal() as db:
+                start = time.perf_counter()
+                stats = load(db)
+                seconds = time.perf_counter() - start
+            runs.append({
+                "seconds": round(seconds, 4),
+                "rows_per_second": round(stats["rows"] / seconds, 1) if seconds else None,
+                **stats,
+            })
+        results[name] = runs
+    return results
+
+
+def make_scenarios(session_cookie, codes, mapped, search_terms):
+    cookie = {"Cookie": session_cookie}
+
+    def search(i):
+        return "GET", "/search", {"params": {"term": search_terms[i % len(search_terms)]}}
+
+    def translate(i):
+        return "POST", "/translate", {"json": {"namaste_code": mapped[i % len(mapped)]}}
+
+    def names_only(i):
+        return "GET", "/terminology/names-only", {}
+
+    def confirm(i):
+        body = {"patient_id": f"bench-patient-{i % PATIENTS}", "namaste_code": mapped[i % len(mapped)]}
+        return "POST", "/diagnosis/confirm", {"json": body, "headers": cookie}
+
+    def history(i):
+        return "GET", f"/diagnosis/history/bench-patient-{i % PATIENTS}", {"params": {"limit": 50}}
+
+    return {"search": search, "translate": translate, "names_only": names_only, "confirm": confirm, "history": history}
+
+
+def search_terms_from(rows, rng, count=200):
+    words = sorted({word for _, term, *_ in rows for word in (term or "").replace("-", " ").split() if len(word) > 3})
+    picks = rng.sample(words, min(count, len(words)))
+    # A mix of whole words, prefixes and misspellings exercises every search tier.
+    return [w.lower() if n % 3 == 0 else w[:4].lower() if n % 3 == 1 else (w[:-2] + w[-1:]).lower() for n, w in enumerate(picks)]
+
+
+async def login(client):
+    """Runs the OAuth flow against the mock; returns the session cookie for authenticated requests."""
+    response = await client.get("/auth/login")
+    state = urllib.parse.parse_qs(urllib.parse.urlparse(response.headers["location"]).query)["state"][0]
+    # The session cookie is Secure, so it is carried by hand over the plain-HTTP test connection.
+    cookie = response.headers["set-cookie"].split(";", 1)[0]
+    response = await client.get("/auth/callback", params={"code": "bench", "state": state}, headers={"Cookie": cookie})
+    if response.status_code != 307:
+        raise RuntimeError(f"Login against the mock ABHA server failed: {response.status_code} {response.text}")
+    return response.headers["set-cookie"].split(";", 1)[0]
+
+
+def compare(report, baseline, max_regression):
+    """Lists scenarios whose p95 latency rose or throughput fell by more than max_regression."""
+    regressions = []
+    for name, current in report["scenarios"].items():
+        previous = baseline.get("scenarios", {}).get(name)
+        if not previous:
+            continue
+        old_p95, new_p95 = previous["latency_ms"]["p95"], current["latency_ms"]["p95"]
+        if old_p95 and new_p95 > old_p95 * (1 + max_regression):
+            regressions.append(f"{name}: p95 {old_p95} ms -> {new_p95} ms")
+        old_rps, new_rps = previous["throughput_rps"], current["throughput_rps"]
+        if old_rps and new_rps < old_rps * (1 - max_regression):
+            regressions.append(f"{name}: throughput {old_rps} -> {new_rps} req/s")
+    return regressions
+
+
+# --- Main ---
+
+async def run_load(base_url, args, scenarios, counter):
+    results = {}
+    limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+    async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=60) as client:
+        session_cookie = await login(client)
+        for name in args.scenarios:
+            make_request = scenarios(session_cookie)[name]
+            await drive(client, make_request, args.warmup, args.concurrency, counter)
+            results[name] = await drive(client, make_request, args.requests, args.concurrency, counter)
+            print(f"{name:>12}: {results[name]['throughput_rps']:>8} req/s  p95 {results[name]['latency_ms']['p95']} ms"
+                  f"  {results[name]['queries_per_request']} queries/req  {results[name]['checkouts_per_request']} checkouts/req"
+                  f"  {results[name]['errors']} errors", file=sys.stderr)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--database-url", help="database to seed and test against (default: a temporary SQLite file)")
+    parser.add_argument("--requests", type=int, default=1000, help="measured requests per scenario")
+    parser.add_argument("--warmup", type=int, default=100, help="unmeasured requests per scenario")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--scenarios", nargs="+", choices=SCENARIOS, default=list(SCENARIOS))
+    parser.add_argument("--ingestion-repeat", type=int, default=2)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--output", help="write the JSON report here instead of stdout")
+    parser.add_argument("--baseline", help="previous report to compare against")
+    parser.add_argument("--max-regression", type=float, default=0.2)
+    args = parser.parse_args()
+
+    mock = mock_abha.serve()
+    configure_environment(args, f"http://127.0.0.1:{mock_abha.bound_port(mock)}")
+
+    from app import ingestion_logic, main as service, models, terminology
+    from app.database import SessionLocal, async_engine, engine
+
+    counter = QueryCounter()
+    counter.attach(engine, async_engine.sync_engine)
+
+    ingestion = ingestion_benchmarks(ingestion_logic, SessionLocal, args.ingestion_repeat)
+    with SessionLocal() as db:
+        terminology.stamp_version(db)
+        db.commit()
+        rows = db.query(models.NamasteCode.code, models.NamasteCode.term).all()
+        mapped = sorted(code for code, in db.query(models.ConceptMap.source_code).distinct())
+
+    rng = random.Random(args.seed)
+    search_terms = search_terms_from(rows, rng)
+    rng.shuffle(mapped)
+
+    server = uvicorn.Server(uvicorn.Config(service.app, host="127.0.0.1", port=0, log_level="warning"))
+    thread = threading.Thread(target=server.run, name="service", daemon=True)
+    thread.start()
+    while not server.started:
+        time.sleep(0.02)
+    base_url = f"http://127.0.0.1:{server.servers[0].sockets[0].getsockname()[1]}"
+    try:
+        scenarios = asyncio.run(run_load(
+            base_url, args, lambda cookie: make_scenarios(cookie, [code for code, _ in rows], mapped, search_terms), counter
+        ))
+    finally:
+        server.should_exit = True
+        thread.join()
+        mock.should_exit = True
+
+    report = {
+        "environment": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "database": engine.dialect.name,
+            "concurrency": args.concurrency,
+            "requests_per_scenario": args.requests,
+            "terminology_version": terminology.version,
+            "emr_bundles_received": mock_abha.received["bundles"],
+        },
+        "scenarios": scenarios,
+        "ingestion": ingestion,
+    }
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+    else:
+        print(output)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(report, json.load(f), args.max_regression)
+        for regression in regressions:
+            print(f"REGRESSION {regression}", file=sys.stderr)
+        sys.exit(1 if regressions else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,46 @@
+"""
+Local stand-in for the ABHA OAuth server and the EMR FHIR endpoint.
+
+Issues tokens the service accepts (signed with the same mock key) and accepts
+every FHIR transaction Bundle, counting them, so the load test needs no network.
+"""
+import threading
+import time
+import urllib.parse
+
+import jwt
+import uvicorn
+from fastapi import FastAPI, Request
+
+MOCK_SECRET_KEY = "mock_secret_key"
+
+app = FastAPI(title="Mock ABHA / EMR")
+received = {"bundles": 0, "entries": 0}
+
+
+@app.post("/token")
+async def token(request: Request):
+    form = urllib.parse.parse_qs((await request.body()).decode())
+    subject = f"bench-doctor-{form.get('code', ['0'])[0]}"
+    return {"access_token": jwt.encode({"sub": subject, "name": "Benchmark Doctor"}, MOCK_SECRET_KEY, algorithm="HS256")}
+
+
+@app.post("/fhir/bundle", status_code=201)
+async def fhir_bundle(request: Request):
+    bundle = await request.json()
+    received["bundles"] += 1
+    received["entries"] += len(bundle.get("entry", []))
+    return {"resourceType": "Bundle", "type": "transaction-response"}
+
+
+def serve(host: str = "127.0.0.1", port: int = 0) -> uvicorn.Server:
+    """Starts the mock on a background thread and returns once it is listening."""
+    server = uvicorn.Server(uvicorn.Config(app, host=host, port=port, log_level="error"))
+    threading.Thread(target=server.run, name="mock-abha", daemon=True).start()
+    while not server.started:
+        time.sleep(0.02)
+    return server
+
+
+def bound_port(server: uvicorn.Server) -> int:
+    return server.servers[0].sockets[0].getsockname()[1]
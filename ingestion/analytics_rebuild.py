@@ -0,0 +1,38 @@
+import os
+import sys
+
+# Allow running as `python ingestion/analytics_rebuild.py` from the repository root.
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from app import analytics, migrations
+from app.database import SessionLocal, engine
+
+def rebuild_rollups():
+    """
+    Recomputes the diagnosis analytics rollups (diagnosis_code_daily and
+    diagnosis_doctor_daily) from the raw diagnosis_log. Safe to run while the
+    service is confirming diagnoses.
+    """
+    db = None
+    try:
+        print("Connecting to the database...")
+        migrations.upgrade(engine)
+        db = SessionLocal()
+
+        print("Rebuilding diagnosis rollups from diagnosis_log...")
+        results = analytics.rebuild(db)
+
+        print(f"\nRebuild complete: {results['diagnoses']} diagnoses in {results['code_rows']} code rows "
+              f"and {results['doctor_rows']} doctor rows.")
+
+    except Exception as error:
+        print(f"\nAn error occurred: {error}")
+        if db is not None:
+            db.rollback()
+    finally:
+        if db is not None:
+            db.close()
+            print("Database connection closed.")
+
+if __name__ == '__main__':
+    rebuild_rollups()
@@ -1,65 +1,46 @@
-import csv
-import psycopg2
 import os
+import sys
 
-# --- Configuration ---
-DB_NAME = "ayush_setu_db"
-DB_USER = "postgres"
-DB_PASS = "pass@123"
-DB_HOST = "localhost"
-DB_PORT = "5432"
+# Allow running as `python ingestion/namaste_ingest.py` from the repository root.
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from app import ingestion_logic, migrations
+from app.database import SessionLocal, engine
 
-CSV_FILE_PATH = os.path.join(os.path.dirname(__file__), '..', 'data', 'NAMASTE.csv')
+# --- Configuration ---
+# Connection settings come from the same DB_* / DATABASE_URL environment variables as the app.
+CSV_FILE_PATH = ingestion_logic.NAMASTE_CSV_PATH
 # --------------------
 
 def ingest_namaste_codes():
     """
-    Connects to the PostgreSQL database and populates the NEW namaste_codesystem
-    table structure from the multi-column NAMASTE CSV file.
+    Bulk-loads the NAMASTE CSV into the namaste_codesystem table through the
+    shared ingestion engine. Existing codes are updated in place, so it is safe
+    to run repeatedly. Running workers pick the new codes up from the
+    terminology snapshot.
     """
-    conn = None
-    inserted_rows = 0
+    db = None
     try:
         print("Connecting to the database...")
-        conn = psycopg2.connect(dbname=DB_NAME, user=DB_USER, password=DB_PASS, host=DB_HOST, port=DB_PORT)
-        cur = conn.cursor()
-        print("Database connection successful.")
-
-        if not os.path.exists(CSV_FILE_PATH):
-            print(f"Error: CSV file not found at {CSV_FILE_PATH}")
-            return
+        migrations.upgrade(engine)
+        db = SessionLocal()
 
         print(f"Reading data from {CSV_FILE_PATH}...")
-        with open(CSV_FILE_PATH, 'r', encoding='utf-8') as f:
-            # Use DictReader to easily access columns by header name
-            reader = csv.DictReader(f)
-            
-            insert_query = """
-                INSERT INTO namaste_codesystem (code, term, short_definition)
-                VALUES (%s, %s, %s) ON CONFLICT (code) DO NOTHING;
-            """
-            
-            for row in reader:
-                # Extract data using header names, providing default empty strings
-                code = row.get('NAMC_CODE', '').strip()
-                term = row.get('NAMC_term', '').strip()
-                short_def = row.get('short_definition', '').strip()
-                cur.execute(insert_query, (code, term, short_def))
-                inserted_rows += cur.rowcount
+        results = ingestion_logic.ingest_namaste_codes(db, CSV_FILE_PATH)
 
-            conn.commit()
-            print(f"\nIngestion complete.")
-            print(f"Successfully inserted {inserted_rows} new NAMASTE codes.")
+        print(f"\nIngestion complete (terminology version {results['terminology_version']}).")
+        print(f"Read {results['rows']} rows: {results['inserted']} inserted, {results['updated']} updated, "
+              f"{results['unchanged']} unchanged, {results['rejected']} rejected.")
+        print(f"Hierarchy positions updated for {results['hierarchy_updated']} codes.")
 
-    except (Exception, psycopg2.DatabaseError) as error:
+    except Exception as error:
         print(f"\nAn error occurred: {error}")
-        if conn:
-            conn.rollback()
+        if db is not None:
+            db.rollback()
     finally:
-        if conn is not None:
-            cur.close()
-            conn.close()
+        if db is not None:
+            db.close()
             print("Database connection closed.")
 
 if __name__ == '__main__':
-    ingest_namaste_codes()
\ No newline at end of file
+    ingest_namaste_codes()
@@ -0,0 +1,26 @@
+"""
+Shared fixtures. The app is pointed at a throwaway SQLite database before it is
+imported, and the bundled NAMASTE.csv is ingested into it once per session.
+"""
+import os
+import tempfile
+
+import pytest
+
+_TMP = tempfile.mkdtemp(prefix="accura-tests-")
+os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(_TMP, 'accura.db')}"
+os.environ["TERMINOLOGY_SNAPSHOT_PATH"] = os.path.join(_TMP, "terminology.snapshot")
+
+from fastapi.testclient import TestClient  # noqa: E402
+
+from app import ingestion_logic  # noqa: E402
+from app.database import SessionLocal  # noqa: E402
+from app.main import app  # noqa: E402
+
+
+@pytest.fixture(scope="session")
+def client():
+    with SessionLocal() as db:
+        ingestion_logic.ingest_namaste_codes(db)
+    with TestClient(app) as client:
+        yield client
@@ -0,0 +1,23 @@
+import asyncio
+
+import pytest
+from fastapi.testclient import TestClient
+
+from app import main, sessions
+
+ROUTES = ["/analytics/top-codes", "/analytics/timeseries", "/analytics/doctors", "/analytics/doctors/doctor-1"]
+
+
+@pytest.mark.parametrize("route", ROUTES)
+def test_analytics_require_a_session(client, route):
+    response = client.get(route)
+    assert response.status_code == 401
+
+
+@pytest.mark.parametrize("route", ROUTES)
+def test_analytics_for_a_signed_in_user(client, route):
+    session_id = sessions.new_session_id()
+    data = {"user_id": "doctor-1"}
+    asyncio.run(main.session_store.save(session_id, data, sessions.ttl_for(data)))
+    signed_in = TestClient(main.app, cookies={sessions.SESSION_COOKIE: session_id})
+    assert signed_in.get(route).status_code == 200
@@ -0,0 +1,38 @@
+import json
+import time
+
+from app import ingestion_logic
+from app.database import SessionLocal
+
+
+def _rows(response):
+    assert response.status_code == 200
+    return [json.loads(line) for line in response.text.splitlines()]
+
+
+def test_one_new_code_makes_a_small_incremental_export(client, tmp_path):
+    # The watermark is a second behind the database clock; step past the session's first load.
+    time.sleep(2)
+    since = client.get("/export/namaste-codes").headers["X-Transaction-Time"]
+
+    with open(ingestion_logic.NAMASTE_CSV_PATH, encoding="utf-8") as f:
+        rows = f.read().rstrip("\n")
+    path = tmp_path / "NAMASTE.csv"
+    path.write_text(rows + "\n99999,A-99,TEST,test,test,test definition, ,\n", encoding="utf-8")
+    with SessionLocal() as db:
+        stats = ingestion_logic.ingest_namaste_codes(db, str(path))
+    # A-99 comes first under A, so it renumbers the bounds of nearly every code...
+    assert stats["hierarchy_updated"] > 1000
+
+    # ...but only the new code changed.
+    changed = _rows(client.get("/export/namaste-codes", params={"_since": since}))
+    assert [row["code"] for row in changed] == ["A-99"]
+    assert changed[0]["parent_code"] == "A"
+
+    bounds = {row["code"]: row for row in _rows(client.get("/export/namaste-hierarchy"))}
+    assert bounds["A"]["lft"] < bounds["A-99"]["lft"] < bounds["A-99"]["rgt"] < bounds["A"]["rgt"]
+
+
+def test_hierarchy_export_is_full_only(client):
+    response = client.get("/export/namaste-hierarchy", params={"_since": "2024-01-01T00:00:00Z"})
+    assert response.status_code == 400
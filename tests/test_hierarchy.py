@@ -0,0 +1,78 @@
+import pytest
+
+from app import snapshot, terminology
+from app.hierarchy import Hierarchy
+
+CODES = ["A", "AA", "AAA", "AAA-1", "AAA-2", "AAA-2.1", "AAA-10", "AAB", "AYU", "B", "DIS", "W"]
+
+
+def _snapshot_hierarchy(codes):
+    return snapshot.Snapshot(snapshot.build("test", [(code, code, None, None, None) for code in codes], [])).hierarchy
+
+
+@pytest.fixture(params=["heap", "snapshot"])
+def hierarchy(request):
+    return Hierarchy(CODES) if request.param == "heap" else _snapshot_hierarchy(CODES)
+
+
+def test_codes_without_a_parent_are_roots(hierarchy):
+    assert hierarchy.children() == ["A", "AYU", "B", "DIS", "W"]
+    assert hierarchy.parent("AYU") is None
+    assert hierarchy.parent("DIS") is None
+
+
+def test_codes_nest_by_prefix_in_natural_order(hierarchy):
+    assert hierarchy.ancestors("AAA-2.1") == ["A", "AA", "AAA", "AAA-2"]
+    assert hierarchy.children("AAA") == ["AAA-1", "AAA-2", "AAA-10"]
+    assert hierarchy.depth("AAA-2.1") == 4
+    assert hierarchy.descendants("A") == ["AA", "AAA", "AAA-1", "AAA-2", "AAA-2.1", "AAA-10", "AAB"]
+    assert hierarchy.descendants("A", offset=2, count=3) == ["AAA-1", "AAA-2", "AAA-2.1"]
+    assert hierarchy.descendant_count("AA") == 6
+
+
+def test_bundled_code_system_roots(client):
+    letters = [chr(c) for c in range(ord("A"), ord("W") + 1)]
+    roots = terminology.hierarchy.children()
+    # AYU and DIS have no parent code in the system, so they stand beside the letters, not under A and D.
+    assert roots == sorted(letters + ["AYU", "DIS"])
+    assert "AYU" not in terminology.hierarchy.children("A")
+    assert "DIS" not in terminology.hierarchy.children("D")
+
+
+def _expand(client, **params):
+    response = client.get("/fhir/ValueSet/$expand", params=params)
+    assert response.status_code == 200
+    return response, response.json()["expansion"]
+
+
+def _codes(expansion):
+    return [concept["code"] for concept in expansion["contains"]]
+
+
+def test_expand_pages_through_the_subtree(client):
+    descendants = terminology.hierarchy.descendants("AA")
+    response, first = _expand(client, code="AA", count=5)
+    assert first["total"] == len(descendants)
+    assert _codes(first) == descendants[:5]
+    assert "offset=5" in response.headers["Link"]
+
+    _, second = _expand(client, code="AA", offset=5, count=5)
+    assert _codes(second) == descendants[5:10]
+
+    response, last = _expand(client, code="AA", offset=len(descendants) - 2, count=5)
+    assert _codes(last) == descendants[-2:]
+    assert "Link" not in response.headers
+
+
+def test_filtered_expand_pages_through_matches(client):
+    # The filter is applied while walking the subtree, so offset and count apply to the matches.
+    matches = [code for code in terminology.hierarchy.descendants("A") if "-1" in code]
+    assert len(matches) > 6
+    response, first = _expand(client, code="A", filter="-1", count=3)
+    assert "total" not in first
+    assert _codes(first) == matches[:3]
+    assert "offset=3" in response.headers["Link"]
+
+    response, last = _expand(client, code="A", filter="-1", offset=len(matches) - 1, count=3)
+    assert _codes(last) == matches[-1:]
+    assert "Link" not in response.headers